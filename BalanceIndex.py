@@ -0,0 +1,194 @@
+## As-of-date balances ## 任意日期余额与净资产查询
+import numpy as np
+import pandas as pd
+
+from ChartOfAccounts import ChartOfAccounts
+from FSTemplate import FSTemplate
+from TrialBalance import to_long, date_col
+
+_day_offset = 2**31 ## days since 1970 as unsigned 32 bits in the low half of a key; the account ID is the high half
+_empty_run = (np.array([], dtype=np.int64), np.zeros((0, 2)), np.zeros((0, 2)))
+
+
+def _build_run(keys, deltas):
+    ## sorted run: unique (account, day) keys, that day's (debit, credit) and the account's running totals to that day
+    if not len(keys):
+        return _empty_run
+    order = np.argsort(keys, kind='stable') ## two sorted runs concatenated merge in about linear time
+    keys, deltas = keys[order], deltas[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    keys, deltas = keys[starts], np.add.reduceat(deltas, starts, axis=0)
+    cums = np.cumsum(deltas, axis=0)
+    new_account = np.r_[True, (keys[1:] >> 32) != (keys[:-1] >> 32)]
+    first = np.flatnonzero(new_account)
+    cums -= (cums[first] - deltas[first])[np.cumsum(new_account) - 1] ## running totals restart at each account
+    return keys, deltas, cums
+
+
+def _lookup(run, keys):
+    ## running (debit, credit) of each key's account on or before its day; 0 where the account has nothing by then
+    run_keys, _, cums = run
+    if not len(run_keys):
+        return np.zeros((len(keys), 2))
+    pos = np.searchsorted(run_keys, keys, side='right') - 1
+    found = pos >= 0
+    found[found] = (run_keys[pos[found]] >> 32) == (keys[found] >> 32)
+    return np.where(found[:, None], cums[np.maximum(pos, 0)], 0.0)
+
+
+def _days(dates):
+    dates = pd.DatetimeIndex(pd.to_datetime([dates] if np.ndim(dates) == 0 else dates))
+    if dates.hasnans:
+        raise ValueError("Dates must not be empty (NaT)")
+    return dates.to_numpy(dtype='datetime64[D]').astype(np.int64)
+
+
+class BalanceIndex:
+    """
+    Point-in-time balances: running DR/CR totals of every posting account, per settle date, sorted by (account ID, date),
+    so the balance of any set of accounts on any set of dates is one binary search per (account, date) pair, all at once
+    New entries are added without re-summing the history: they go into a small second run that is merged into the main
+    one only when it has grown to a fraction (1/compact_ratio) of it; a query reads both runs and adds them
+
+    Use as:
+        bidx = BalanceIndex.from_ledger(transaction_df) ## the concat_je_rows layout (or TrialBalance.to_long's), with Settle_date
+        bidx.add(todays_transaction_df) ## as entries arrive, in any date order
+        bidx.as_of('2024-03-15') ## every posting account's DR/CR totals and balance at the end of that day
+        bidx.balances(['SFP_A_FA_E', 'SCI_I_DI_USD'], pd.date_range('2024-01-31', '2024-12-31', freq='ME')) ## totals of any level
+        bidx.nav(pd.date_range('2024-01-01', '2024-12-31'), FX) ## daily net assets per currency and NAV in the presentation currency
+
+    Balances are DR - CR, per the currency in the account name, and include everything settled on or before the date
+    (opening balances can be added as entries dated before the first day)
+    """
+    def __init__(self, coa=None, compact_ratio=8, min_tail=4096):
+        self.coa = coa if coa is not None else ChartOfAccounts.from_template()
+        self.compact_ratio = compact_ratio
+        self.min_tail = min_tail
+        self.base = _empty_run
+        self.tail = _empty_run
+        self.n_entries = 0
+
+    @classmethod
+    def from_ledger(cls, ledger_df, coa=None, date_col=date_col):
+        bidx = cls(coa)
+        bidx.add(ledger_df, date_col)
+        return bidx
+
+    def add(self, ledger_df, date_col=date_col):
+        """adds the postings of ledger_df; returns self"""
+        long_df = ledger_df if 'Amount' in ledger_df.columns else to_long(ledger_df, date_col)
+        if not len(long_df):
+            return self
+        if date_col not in long_df.columns or long_df[date_col].isna().any():
+            raise ValueError(f"Every posting needs a {date_col} to be indexed as of a date")
+        account_ids = self.coa.encode(long_df['Account']).astype(np.int64)
+        keys = (account_ids << 32) | (_days(long_df[date_col]) + _day_offset)
+        values = np.nan_to_num(long_df['Value'].to_numpy(dtype=float))
+        is_debit = (long_df['Side'] == 'DR').to_numpy()
+        deltas = np.column_stack([np.where(is_debit, values, 0.0), np.where(is_debit, 0.0, values)])
+        self.tail = _build_run(np.concatenate([self.tail[0], keys]), np.concatenate([self.tail[1], deltas]))
+        if len(self.tail[0]) > max(self.min_tail, len(self.base[0]) // self.compact_ratio):
+            self.compact()
+        self.n_entries += len(long_df)
+        return self
+
+    def compact(self):
+        """merges the recent run into the main one"""
+        if len(self.tail[0]):
+            self.base = _build_run(np.concatenate([self.base[0], self.tail[0]]), np.concatenate([self.base[1], self.tail[1]]))
+            self.tail = _empty_run
+        return self
+
+    def posting_accounts(self):
+        """IDs of the accounts with entries, sorted"""
+        return np.unique(np.concatenate([self.base[0], self.tail[0]]) >> 32)
+
+    def totals(self, account_ids, dates):
+        """array [date, account, (debit, credit)]: running totals of posting accounts (IDs) at the end of each date"""
+        account_ids = np.asarray(account_ids, dtype=np.int64)
+        days = _days(dates)
+        keys = ((account_ids[None, :] << 32) | (days[:, None] + _day_offset)).ravel()
+        totals = _lookup(self.base, keys) + _lookup(self.tail, keys)
+        return totals.reshape(len(days), len(account_ids), 2)
+
+    def as_of(self, date, accounts=None):
+        """
+        posting accounts (or those at or below accounts) with anything settled by the end of date:
+        Account, Currency, Debit, Credit, Balance
+        """
+        account_ids = self._leaves(accounts)
+        totals = self.totals(account_ids, [date])[0]
+        held = (totals != 0).any(axis=1)
+        debit, credit = totals[held, 0], totals[held, 1]
+        return pd.DataFrame({'Account': self.coa.decode(account_ids[held]),
+                             'Currency': np.array(self.coa.currencies + [None], dtype=object)[account_ids[held]],
+                             'Debit': debit, 'Credit': credit, 'Balance': debit - credit})
+
+    def balances(self, accounts, dates):
+        """
+        balances (DR - CR) at the end of each date: DataFrame dates x (Account, Currency); an account at any level is the
+        sum of the posting accounts at or below it, one column per currency they are in; share counts (*_S) are not added
+        into their money parents
+        """
+        dates = pd.DatetimeIndex(pd.to_datetime([dates] if np.ndim(dates) == 0 else dates))
+        columns, leaf_ids, column_pos = [], [], []
+        currencies = np.array(self.coa.currencies + [None], dtype=object)
+        for account in accounts:
+            share_count = account in self.coa.ids and self._is_share_count(self.coa.ids[account])
+            leaves = self._leaves([account], additive_only=not share_count)
+            leaf_currs = currencies[leaves]
+            for curr in dict.fromkeys(leaf_currs):
+                columns.append((account, curr))
+                picked = leaves[leaf_currs == curr] if curr is not None else leaves[pd.isna(leaf_currs)]
+                leaf_ids.append(picked)
+                column_pos.append(np.full(len(picked), len(columns) - 1))
+        if not columns:
+            return pd.DataFrame(index=dates, columns=pd.MultiIndex.from_tuples([], names=['Account', 'Currency']), dtype=float)
+        leaf_ids, column_pos = np.concatenate(leaf_ids), np.concatenate(column_pos)
+        totals = self.totals(leaf_ids, dates)
+        leaf_balances = totals[:, :, 0] - totals[:, :, 1]
+        grid = np.zeros((len(dates), len(columns)))
+        np.add.at(grid, (slice(None), column_pos), leaf_balances)
+        return pd.DataFrame(grid, index=dates, columns=pd.MultiIndex.from_tuples(columns, names=['Account', 'Currency']))
+
+    def net_assets(self, dates):
+        """
+        net assets per currency at the end of each date (DataFrame dates x currency): the SFP posting accounts plus the SCF
+        ones, since cash moves are booked through the cash flow statement (the template derives SFP_A_CCE from them)
+        """
+        dates = pd.DatetimeIndex(pd.to_datetime([dates] if np.ndim(dates) == 0 else dates))
+        account_ids = self._leaves(['SFP', 'SCF'], additive_only=True)
+        currencies = np.array(self.coa.currencies + [None], dtype=object)[account_ids]
+        curr_codes, currs = pd.factorize(pd.Series(currencies, dtype=object), use_na_sentinel=False)
+        totals = self.totals(account_ids, dates)
+        grid = np.zeros((len(dates), len(currs)))
+        np.add.at(grid, (slice(None), curr_codes), totals[:, :, 0] - totals[:, :, 1])
+        return pd.DataFrame(grid, index=dates, columns=pd.Index(currs, name='Currency'))
+
+    def nav(self, dates, FX=None, presentation_curr=None):
+        """
+        net_assets per currency and, given FX (FXRates, eg FXRates.from_snapshots of the month-end XR_dfs), NAV: their sum
+        in the presentation currency at each date's rate (the last snapshot on or before it)
+        """
+        nav_df = self.net_assets(dates)
+        if FX is not None:
+            presentation_curr = presentation_curr or FX.presentation_curr or FSTemplate.load().presentation_curr
+            nav = np.zeros(len(nav_df))
+            for curr in nav_df.columns:
+                if pd.isna(curr):
+                    raise ValueError("Net assets in accounts without a currency cannot be translated")
+                nav += nav_df[curr].to_numpy() * FX.rates(nav_df.index, presentation_curr, curr, via=presentation_curr)
+            nav_df['NAV'] = nav
+        return nav_df
+
+    def _is_share_count(self, account_id):
+        return any(self.coa.codes[account_id].endswith(suffix) for suffix in FSTemplate.non_additive_suffixes)
+
+    def _leaves(self, accounts=None, additive_only=False):
+        ## posting account IDs at or below accounts (all of them if None), optionally without share counts
+        leaves = self.posting_accounts()
+        if accounts is not None:
+            leaves = leaves[np.logical_or.reduce([self.coa.under(account, leaves) for account in accounts])] if len(accounts) else leaves[:0]
+        if additive_only:
+            leaves = np.array([account_id for account_id in leaves if not self._is_share_count(account_id)], dtype=np.int64)
+        return leaves
@@ -0,0 +1,163 @@
+## Chart of accounts: interned account IDs and the account hierarchy ## 会计科目表：科目编号与层级
+import numpy as np
+import pandas as pd
+
+from FSTemplate import FSTemplate, template_path
+import Money
+
+account_cols = [f'{side}_account_{n}' for n in range(3) for side in ['DR', 'CR']]
+
+
+class ChartOfAccounts:
+    """
+    Every account code gets a small integer ID, in registration order: the template accounts first (in template order),
+    then the ledger's own sub-accounts as they are met (SFP_A_FA_E_USD_BV_ABC.XNYS, SCF_OA_PPI_USD_ABC.XNYS, ...)
+    IDs never change once given, so ID arrays and categoricals from different ledgers of one registry line up
+    The hierarchy is a prefix tree over the underscore segments: each account's parent is its longest prefix that is itself
+    an account (SFP_A_FA_E_USD_BV_ABC.XNYS -> SFP_A_FA_E_USD_BV -> SFP_A_FA_E_USD -> SFP_A_FA_E -> SFP_A_FA -> SFP_A -> SFP)
+
+    Use as:
+        coa = ChartOfAccounts.from_template()
+        ids = coa.encode(ledger_df['DR_account_0']) ## int32 IDs, -1 where empty
+        ledger_df = coa.encode_ledger(transaction_df) ## DR/CR account columns as categoricals
+        fees = coa.under('SCI_E', ids) ## rows booked to SCI_E or any account below it
+        coa.code(ids[0]), coa.parent_of(ids[0]), coa.ancestors(ids[0])
+    """
+    def __init__(self, codes=()):
+        self.codes = [] ## ID: code
+        self.ids = {} ## code: ID
+        self.parents = [] ## ID: parent ID, -1 for a root (SFP, SCI, SCF, SCNAV, XR_...)
+        self.children = [] ## ID: [child IDs]
+        self.roots = [] ## IDs without a parent
+        self.depths = [] ## ID: 0 for roots
+        self.currencies = [] ## ID: currency the account is stated in, None for mixed-currency totals
+        for code in codes:
+            self.intern(code)
+
+    @classmethod
+    def from_template(cls, path=template_path):
+        fst = FSTemplate.load(path)
+        return cls(fst.accounts[:fst.n_template])
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return code in self.ids
+
+    def intern(self, code):
+        """ID of code, registering it (and placing it in the hierarchy) if new"""
+        account_id = self.ids.get(code)
+        if account_id is None:
+            account_id = len(self.codes)
+            segments = code.split('_')
+            parent = -1
+            for n in range(len(segments) - 1, 0, -1):
+                parent = self.ids.get('_'.join(segments[:n]), -1)
+                if parent >= 0:
+                    break
+            self.codes.append(code)
+            self.ids[code] = account_id
+            self.parents.append(parent)
+            self.children.append([])
+            self.depths.append(self.depths[parent] + 1 if parent >= 0 else 0)
+            self.currencies.append(Money._account_currency(code))
+            siblings = self.children[parent] if parent >= 0 else self.roots
+            for sibling in [sibling for sibling in siblings if self.codes[sibling].startswith(code + '_')]:
+                siblings.remove(sibling) ## registered before this account; it moves under it
+                self.children[account_id].append(sibling)
+                self.parents[sibling] = account_id
+                self._set_depths(sibling)
+            siblings.append(account_id)
+        return account_id
+
+    def _set_depths(self, account_id):
+        stack = [account_id]
+        while stack:
+            account_id = stack.pop()
+            self.depths[account_id] = self.depths[self.parents[account_id]] + 1
+            stack.extend(self.children[account_id])
+
+    def code(self, account_id):
+        return self.codes[account_id]
+
+    def parent_of(self, account_id):
+        return self.parents[account_id]
+
+    def ancestors(self, account_id):
+        """IDs from the account's parent up to its root"""
+        ancestors = []
+        while self.parents[account_id] >= 0:
+            account_id = self.parents[account_id]
+            ancestors.append(account_id)
+        return ancestors
+
+    def subtree(self, code):
+        """IDs of code and every account below it, as a sorted array"""
+        if code not in self.ids:
+            return np.array([], dtype=np.int32)
+        subtree, stack = [], [self.ids[code]]
+        while stack:
+            account_id = stack.pop()
+            subtree.append(account_id)
+            stack.extend(self.children[account_id])
+        return np.sort(np.array(subtree, dtype=np.int32))
+
+    def encode(self, accounts):
+        """account codes -> int32 IDs (-1 for empty cells: NaN, None, ''); new codes are registered"""
+        codes, uniques = pd.factorize(pd.Series(np.asarray(accounts, dtype=object)).replace('', np.nan), use_na_sentinel=True)
+        lookup = np.array([self.intern(str(code)) for code in uniques] + [-1], dtype=np.int32)
+        return lookup[codes]
+
+    def decode(self, ids):
+        """int32 IDs -> account codes as an object array, None for -1"""
+        lookup = np.array(self.codes + [None], dtype=object)
+        ids = np.asarray(ids)
+        return lookup[np.where(ids < 0, len(self.codes), ids)]
+
+    def categorical(self, ids):
+        """IDs as a pandas Categorical over the whole chart; category codes are the IDs themselves"""
+        return pd.Categorical.from_codes(np.asarray(ids, dtype=np.int32), categories=pd.Index(self.codes, dtype=object), validate=False)
+
+    def encode_ledger(self, ledger_df, kind='category'):
+        """
+        copy of ledger_df (eg from concat_je_rows) with its DR/CR account columns as categoricals (kind='category')
+        or int32 IDs (kind='id'); the value columns are untouched
+        """
+        ledger_df = ledger_df.copy()
+        ids = {col: self.encode(ledger_df[col]) for col in account_cols if col in ledger_df.columns}
+        for col, col_ids in ids.items(): ## categories taken after every column is interned, so all columns share them
+            ledger_df[col] = self.categorical(col_ids) if kind == 'category' else col_ids
+        return ledger_df
+
+    def decode_ledger(self, ledger_df, fillempty=''):
+        """back to account code strings, from either encoding"""
+        ledger_df = ledger_df.copy()
+        for col in account_cols:
+            if col in ledger_df.columns:
+                ids = ledger_df[col].cat.codes.to_numpy() if isinstance(ledger_df[col].dtype, pd.CategoricalDtype) else ledger_df[col].to_numpy()
+                codes = self.decode(ids)
+                ledger_df[col] = np.where(pd.isna(codes), fillempty, codes) if fillempty is not None else codes
+        return ledger_df
+
+    def under(self, code, ids):
+        """
+        boolean mask of the ID array: True where the account is code or below it in the hierarchy
+        code can also be a plain string prefix of registered codes (eg 'SCI_E_O'), matched against the chart, not the rows
+        """
+        subtree = self.subtree(code)
+        if not len(subtree):
+            subtree = np.array([account_id for account_id, account in enumerate(self.codes) if account.startswith(code)], dtype=np.int32)
+        return np.isin(np.asarray(ids), subtree)
+
+    def ancestor_table(self):
+        """
+        array A[ID, depth] = the account's ancestor at that depth (itself at its own depth), -1 below it;
+        one gather A[ids, d] rolls a whole ID column up to depth d
+        """
+        table = np.full((len(self.codes), max(self.depths, default=-1) + 1), -1, dtype=np.int32)
+        for account_id in range(len(self.codes)):
+            table[account_id, self.depths[account_id]] = account_id
+            for ancestor in self.ancestors(account_id):
+                table[account_id, self.depths[ancestor]] = ancestor
+        return table
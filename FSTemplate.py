@@ -0,0 +1,289 @@
+## Financial statement template: compiled formula plan ## 财务报表模板：公式编译
+import ast
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+template_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Regular_FSs_template.csv')
+statements = ['SFP', 'SCI', 'SCF', 'SCNAV']
+
+_token_re = re.compile(r"\s*(?:(?P<ref>[A-Za-z][A-Za-z0-9_Δ]*)(?P<lag>\{t[01]\})?|(?P<num>\d+(?:\.\d+)?)|(?P<op>[-+*/()]))")
+_pair_re = re.compile(r'([A-Z]{3})2([A-Z]{3})$')
+_plan_cache = {} ## (path, mtime, size): FSTemplate
+
+
+class FSTemplate:
+    """
+    Parses the Formula column of Regular_FSs_template.csv once and compiles every calculated account into one generated
+    function over a values array V[account, period, ...], in dependency (topological) order:
+        X_{t1} or X = X this period; X_{t0} = X last period
+        XR_{t1}/XR_{t0} without a currency pair take the pair of the last XR_<pair> in the formula, else the account's own (eg _CAD2HKD)
+        calculated accounts without a formula are the sum of their child accounts (SFP_A_FA_E_USD = _BV + _CUM_UGLΔFV),
+        child accounts in a foreign currency being translated at XR_<curr>2<presentation curr>_{t1}
+        anything referenced but not in the template (eg SCF_OA_OEPCC_CAD) is an input defaulting to 0
+        accounts both entered and calculated (SFP_A_CCE_<curr>, SCNAV_ΔNAXR_<pair>) keep an entered value; their formula
+        only fills the periods where none is given (NaN)
+    Accounts whose formulas only reach back through inputs are evaluated for all periods at once; accounts that depend on
+    their own (or each other's) last-period values (SCNAV_NAEP, SCNAV_SO, ...) are stepped through the periods together
+
+    Use as:
+        fst = FSTemplate.load() ## compiled once per template file, rebuilt only when the file changes
+        values_df = fst.evaluate(inputs_df, opening) ## inputs_df: entered accounts x periods; opening: account values before the first period
+        fs_dict = fst.statements(values_df) ## {'SFP': ..., 'SCI': ..., 'SCF': ..., 'SCNAV': ...}
+    """
+    non_additive_suffixes = ['_S'] ## share counts (SCNAV_SUB_S, SCNAV_RED_S) are not summed into their money parents
+
+    def __init__(self, path=template_path):
+        self.path = path
+        self.template_df = pd.read_csv(path, encoding='gbk', dtype=str)
+        self._parse()
+        self._compile()
+
+    @classmethod
+    def load(cls, path=template_path):
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        if key not in _plan_cache:
+            for stale_key in [k for k in _plan_cache if k[0] == key[0]]:
+                del _plan_cache[stale_key]
+            _plan_cache[key] = cls(path)
+        return _plan_cache[key]
+
+    def _parse(self):
+        rows = self.template_df.dropna(subset=['Index'])
+        self.accounts = [] ## template order, first occurrence; headers and their 'Total ...' rows share one account
+        self.entered, self.calculated, self.formulas = set(), set(), {}
+        for _, row in rows.iterrows():
+            account = re.sub(r'_\{t[01]\}$', '', row['Index'].strip()) ## XR_CAD2HKD_{t0} and XR_CAD2HKD_{t1} are one account
+            if account not in self.formulas and account not in self.accounts:
+                self.accounts.append(account)
+            if str(row['DR/CR, Entered Accounts']).strip() == '1':
+                self.entered.add(account)
+            if str(row['Calculated_Accounts']).strip() == '1':
+                self.calculated.add(account)
+            if isinstance(row['Formula'], str) and row['Formula'].strip():
+                self.formulas.setdefault(account, row['Formula'].strip())
+
+        pairs = [_pair_re.search(account) for account in self.accounts if account.startswith('XR_')]
+        self.presentation_curr = pairs[0].group(2) if pairs else None
+        self.currencies = sorted({pair.group(1) for pair in pairs} | ({self.presentation_curr} if pairs else set()))
+
+        self.parents = {} ## longest underscore prefix that is itself a template account
+        for account in self.accounts:
+            segments = account.split('_')
+            for n in range(len(segments) - 1, 0, -1):
+                if '_'.join(segments[:n]) in self.accounts:
+                    self.parents[account] = '_'.join(segments[:n])
+                    break
+
+        self.exprs = {} ## account: [(token kind, value, lag)], refs resolved to account names
+        for account, formula in self.formulas.items():
+            expr = self._tokenize(account, formula)
+            if expr is not None:
+                self.exprs[account] = expr
+        for account in self.accounts:
+            if account in self.calculated and account not in self.exprs:
+                children = [child for child, parent in self.parents.items() if parent == account
+                            and not any(child.endswith(suffix) for suffix in self.non_additive_suffixes)]
+                if children:
+                    self.exprs[account] = self._children_sum(children)
+
+        self.n_template = len(self.accounts)
+        for expr in self.exprs.values(): ## references outside the template become inputs
+            for kind, ref, _ in expr:
+                if kind == 'ref' and ref not in self.accounts:
+                    self.accounts.append(ref)
+
+    def _tokenize(self, account, formula):
+        expr, pos, xr_pair = [], 0, None
+        account_pair = _pair_re.search(account)
+        while pos < len(formula):
+            match = _token_re.match(formula, pos)
+            if match is None or match.end() == pos:
+                return None ## free text such as 'Accumulate ledger'
+            pos = match.end()
+            if match.group('ref'):
+                ref, lag = match.group('ref'), match.group('lag')
+                if lag:
+                    ref = ref.rstrip('_')
+                if ref.startswith('XR_'):
+                    xr_pair = ref[len('XR_'):]
+                elif ref == 'XR':
+                    pair = xr_pair or (account_pair.group(0) if account_pair else None)
+                    if pair is None:
+                        return None
+                    ref = f'XR_{pair}'
+                expr.append(('ref', ref, lag == '{t0}'))
+            elif match.group('num'):
+                expr.append(('num', match.group('num'), False))
+            else:
+                expr.append(('op', match.group('op'), False))
+        try:
+            ast.parse(' '.join('x' if kind == 'ref' else value for kind, value, _ in expr), mode='eval')
+        except SyntaxError:
+            return None
+        return expr
+
+    def _children_sum(self, children):
+        expr = []
+        for child in children:
+            if expr:
+                expr.append(('op', '+', False))
+            curr = child.split('_')[-1]
+            if curr in self.currencies and curr != self.presentation_curr and f'XR_{curr}2{self.presentation_curr}' in self.accounts:
+                expr += [('ref', child, False), ('op', '*', False), ('ref', f'XR_{curr}2{self.presentation_curr}', False)]
+            else:
+                expr.append(('ref', child, False))
+        return expr
+
+    def _compile(self):
+        self.pos = {account: i for i, account in enumerate(self.accounts)}
+        deps_t1 = {account: {ref for kind, ref, lag in expr if kind == 'ref' and not lag} for account, expr in self.exprs.items()}
+        deps_t0 = {account: {ref for kind, ref, lag in expr if kind == 'ref' and lag and ref in self.exprs} for account, expr in self.exprs.items()}
+
+        ## same-period references must form a DAG
+        order, indegree = [], {account: len(deps & self.exprs.keys()) for account, deps in deps_t1.items()}
+        dependents = {account: [] for account in self.exprs}
+        for account, deps in deps_t1.items():
+            for dep in deps & self.exprs.keys():
+                dependents[dep].append(account)
+        ready = [account for account in self.accounts if indegree.get(account) == 0]
+        while ready:
+            account = ready.pop(0)
+            order.append(account)
+            for dependent in dependents[account]:
+                indegree[dependent] -= 1
+                if indegree[dependent] == 0:
+                    ready.append(dependent)
+        if len(order) < len(self.exprs):
+            raise ValueError(f"Circular formulas in {self.path}: {sorted(self.exprs.keys() - set(order))}")
+        self.order = order
+
+        ## last-period references can still loop back (X = X_{t0} + ...); those strongly connected groups are stepped per period
+        graph = {account: deps_t1[account] & self.exprs.keys() | deps_t0[account] for account in self.exprs}
+        stages = []
+        for scc in _sccs(graph, order):
+            recurrent = len(scc) > 1 or scc[0] in deps_t0[scc[0]]
+            stages.append((recurrent, [account for account in order if account in scc]))
+        self.stages = stages
+
+        lines = ['def _plan(V, O):']
+        for recurrent, accounts in stages:
+            if recurrent:
+                lines.append('    for t in range(V.shape[1]):')
+                lines += [f'        V[{self.pos[account]}, t] = {self._code(account, recurrent=True)}' for account in accounts]
+            else:
+                lines += [f'    V[{self.pos[account]}] = {self._code(account, recurrent=False)}' for account in accounts]
+        self.source = '\n'.join(lines) + '\n    return V\n'
+        self.entered_calculated = np.array(sorted(self.pos[account] for account in self.entered & self.exprs.keys()), dtype=np.int64)
+        self._exec_plan()
+
+    def _exec_plan(self):
+        namespace = {'_lag': _lag, '_entered': _entered}
+        exec(compile(self.source, f'<FSTemplate {os.path.basename(self.path)}>', 'exec'), namespace)
+        self._plan = namespace['_plan']
+
+    def __getstate__(self): ## the compiled plan does not pickle; it is re-executed from its source on load, without re-parsing the file
+        state = self.__dict__.copy()
+        del state['_plan']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._exec_plan()
+
+    def _code(self, account, recurrent):
+        expr = self._code_expr(account, recurrent)
+        if account not in self.entered:
+            return expr
+        given = f'V[{self.pos[account]}, t]' if recurrent else f'V[{self.pos[account]}]' ## an entered value wins over the formula
+        return f'_entered({given}, {expr})'
+
+    def _code_expr(self, account, recurrent):
+        code = []
+        for kind, value, lag in self.exprs[account]:
+            if kind != 'ref':
+                code.append(value)
+            elif recurrent:
+                i = self.pos[value]
+                code.append(f'(V[{i}, t - 1] if t else O[{i}])' if lag else f'V[{i}, t]')
+            else:
+                i = self.pos[value]
+                code.append(f'_lag(V, O, {i})' if lag else f'V[{i}]')
+        return ' '.join(code)
+
+    def evaluate(self, inputs, opening=None):
+        """
+        inputs: DataFrame of entered accounts (index) x periods (columns), or an array V[account, period, ...] in self.accounts order
+        opening: account values for the period before the first one (the {t0} of period 0); Series, or array O[account, ...]
+        missing accounts are 0, except entered and calculated ones, which are calculated (NaN in an array does the same);
+        returns every account x period, same type as inputs
+        """
+        if isinstance(inputs, pd.DataFrame):
+            V = inputs.reindex(self.accounts).to_numpy(dtype=float, copy=True)
+            missing = np.isnan(V)
+            missing[self.entered_calculated] = False
+            V[missing] = 0
+            O = np.zeros(len(self.accounts)) if opening is None else pd.Series(opening, dtype=float).reindex(self.accounts).fillna(0).to_numpy()
+            return pd.DataFrame(self._plan(V, O), index=self.accounts, columns=inputs.columns)
+        V = np.array(inputs, dtype=float)
+        O = np.zeros((len(self.accounts),) + V.shape[2:]) if opening is None else np.asarray(opening, dtype=float)
+        return self._plan(V, O)
+
+    def entered_account(self, account):
+        """
+        the entered template account a ledger account posts into: itself, or for a sub-account its longest template prefix
+        if that is entered (SFP_A_FA_E_USD_BV_ABC.XNYS -> SFP_A_FA_E_USD_BV, SCI_XRPLFXC_HKD -> SCI_XRPLFXC); None otherwise
+        """
+        if account in self.entered:
+            return account
+        segments = account.split('_')
+        for n in range(len(segments) - 1, 0, -1):
+            prefix = '_'.join(segments[:n])
+            if prefix in self.pos and self.pos[prefix] < self.n_template:
+                return prefix if prefix in self.entered else None
+        return None
+
+    def statements(self, values_df):
+        """splits evaluated values into {'SFP': ..., 'SCI': ..., 'SCF': ..., 'SCNAV': ...} in template order"""
+        return {statement: values_df.loc[[account for account in self.accounts[:self.n_template]
+                                          if account == statement or account.startswith(f'{statement}_')]]
+                for statement in statements}
+
+
+def _entered(given, formula): ## entered value where there is one, else the formula's
+    return np.where(np.isnan(given), formula, given)
+
+
+def _lag(V, O, i): ## values of account i shifted one period back, the opening value filling the first period
+    return np.concatenate([O[i][None], V[i][:-1]])
+
+
+def _sccs(graph, order):
+    ## Tarjan's strongly connected components, dependencies first
+    index, low, stack, on_stack, sccs = {}, {}, [], set(), []
+    def visit(node):
+        index[node] = low[node] = len(index)
+        stack.append(node)
+        on_stack.add(node)
+        for dep in graph[node]:
+            if dep not in index:
+                visit(dep)
+                low[node] = min(low[node], low[dep])
+            elif dep in on_stack:
+                low[node] = min(low[node], index[dep])
+        if low[node] == index[node]:
+            scc = []
+            while True:
+                dep = stack.pop()
+                on_stack.discard(dep)
+                scc.append(dep)
+                if dep == node:
+                    break
+            sccs.append(scc)
+    for node in order:
+        if node not in index:
+            visit(node)
+    return sccs
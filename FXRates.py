@@ -0,0 +1,118 @@
+## Exchange rates ## 汇率
+import functools
+
+import numpy as np
+import pandas as pd
+
+
+class FXRates:
+    """
+    Exchange rates in this project's QUOTE/BASE format (see README): rate(quote, base) = units of quote per 1 unit of base,
+    eg 7.8 HKD/USD is rate('HKD', 'USD') = 7.8, the same cell as XR_df.loc['HKD', 'USD']
+    Backed by a dense array rates[date, quote, base] with integer-coded currencies; a date reads the last snapshot on or before it
+    A missing pair is taken from its inverse, else triangulated through the presentation currency P:
+        rate(Q, B) = rate(P, B) / rate(P, Q)
+
+    Use as:
+        FX = FXRates.from_snapshots({'2024-01-31': XR0_df, '2024-02-29': XR1_df}, presentation_curr='HKD')
+        FX.rate('2024-02-15', 'CNY', 'USD') ## scalar, LRU cached
+        FX.rates(ledger_df['Settle_date'], 'HKD', ledger_df['Trxn_value_curr']) ## whole columns at once
+        FX.translate(ledger_df['Trxn_value'], ledger_df['Trxn_value_curr'], 'HKD', ledger_df['Settle_date'])
+    """
+    def __init__(self, rates, currencies, dates=None, presentation_curr=None, cache_size=4096):
+        ## rates: array [date, quote, base] (or [quote, base] for a single undated snapshot), NaN where a pair is not quoted
+        self.currencies = list(currencies)
+        self.curr_index = pd.Index(self.currencies)
+        self.array = np.asarray(rates, dtype=float).reshape(-1, len(self.currencies), len(self.currencies))
+        self.dates = None if dates is None else pd.to_datetime(pd.Index(dates)).to_numpy(dtype='datetime64[ns]')
+        if self.dates is not None and len(self.dates) != len(self.array):
+            raise ValueError(f"{len(self.dates)} dates for {len(self.array)} rate snapshots")
+        self.presentation_curr = presentation_curr
+        self.cache_size = cache_size
+        self.rate = functools.lru_cache(maxsize=cache_size)(self._rate)
+
+    def __getstate__(self): ## the LRU cache wrapper does not pickle; rebuilt on load
+        state = self.__dict__.copy()
+        del state['rate']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.rate = functools.lru_cache(maxsize=self.cache_size)(self._rate)
+
+    @classmethod
+    def from_frame(cls, XR_df, presentation_curr=None): ## one undated snapshot, eg XR0_df
+        return cls.from_snapshots({None: XR_df}, presentation_curr=presentation_curr)
+
+    @classmethod
+    def from_snapshots(cls, XR_dfs, presentation_curr=None):
+        ## XR_dfs: {date: XR_df} with XR_df.loc[quote, base]; {None: XR_df} for a single undated snapshot
+        currencies = sorted(set().union(*[set(XR_df.index) | set(XR_df.columns) for XR_df in XR_dfs.values()]))
+        dates = sorted(XR_dfs, key=pd.Timestamp) if None not in XR_dfs else None
+        rates = [XR_dfs[date].reindex(index=currencies, columns=currencies).to_numpy(dtype=float)
+                 for date in (dates if dates is not None else XR_dfs)]
+        return cls(rates, currencies, dates=dates, presentation_curr=presentation_curr)
+
+    @classmethod
+    def from_long(cls, XR_long_df, date_col='Date', quote_col='Quote_curr', base_col='Base_curr', rate_col='Rate', presentation_curr=None):
+        ## one row per (date, quote, base) quote, eg a rate history download
+        currencies = sorted(set(XR_long_df[quote_col]) | set(XR_long_df[base_col]))
+        date_codes, dates = pd.factorize(pd.to_datetime(XR_long_df[date_col]), sort=True)
+        curr_index = pd.Index(currencies)
+        rates = np.full((len(dates), len(currencies), len(currencies)), np.nan)
+        rates[date_codes, curr_index.get_indexer(XR_long_df[quote_col]), curr_index.get_indexer(XR_long_df[base_col])] = XR_long_df[rate_col].to_numpy(dtype=float)
+        return cls(rates, currencies, dates=dates, presentation_curr=presentation_curr)
+
+    def _date_pos(self, dates, n):
+        if self.dates is None or dates is None: ## undated snapshot, or the latest one
+            return np.full(n, len(self.array) - 1)
+        dates = pd.DatetimeIndex(pd.to_datetime([dates] if np.ndim(dates) == 0 else dates)).to_numpy(dtype='datetime64[ns]')
+        date_pos = np.searchsorted(self.dates, dates, side='right') - 1
+        if (date_pos < 0).any():
+            raise KeyError(f"No exchange rates on or before {dates[np.argmax(date_pos < 0)]}")
+        return np.broadcast_to(date_pos, n)
+
+    def _curr_pos(self, currs, n):
+        currs = np.asarray([currs] if np.ndim(currs) == 0 else currs, dtype=object)
+        curr_pos = self.curr_index.get_indexer(currs)
+        if (curr_pos < 0).any():
+            raise KeyError(f"Currency not in exchange rates: {currs[np.argmax(curr_pos < 0)]}")
+        return np.broadcast_to(curr_pos, n)
+
+    def rates(self, dates, quotes, bases, via=None, strict=True):
+        """
+        quote per base for whole columns of (date, quote, base); scalars broadcast
+        via = currency to triangulate missing pairs through, defaults to the presentation currency
+        a pair that is neither quoted, nor inverted, nor triangulated raises KeyError; strict=False leaves it NaN instead
+        """
+        n = max(np.size(dates) if dates is not None else 1, np.size(quotes), np.size(bases))
+        date_pos = self._date_pos(dates, n)
+        quote_pos, base_pos = self._curr_pos(quotes, n), self._curr_pos(bases, n)
+        xr = np.where(quote_pos == base_pos, 1.0, self.array[date_pos, quote_pos, base_pos])
+        missing = np.isnan(xr)
+        if missing.any(): ## inverse pair
+            xr[missing] = 1 / self.array[date_pos[missing], base_pos[missing], quote_pos[missing]]
+            missing = np.isnan(xr)
+        via = via if via is not None else self.presentation_curr
+        if missing.any() and via is not None: ## cross rate through the presentation currency, either direction quoted
+            via_pos = self.curr_index.get_loc(via)
+            d, q, b = date_pos[missing], quote_pos[missing], base_pos[missing]
+            via_per_base = np.where(b == via_pos, 1.0, np.where(np.isnan(self.array[d, via_pos, b]), 1 / self.array[d, b, via_pos], self.array[d, via_pos, b]))
+            via_per_quote = np.where(q == via_pos, 1.0, np.where(np.isnan(self.array[d, via_pos, q]), 1 / self.array[d, q, via_pos], self.array[d, via_pos, q]))
+            xr[missing] = via_per_base / via_per_quote
+        if strict and np.isnan(xr).any():
+            i = np.argmax(np.isnan(xr))
+            raise KeyError(f"Exchange rate not found: {self.currencies[quote_pos[i]]}/{self.currencies[base_pos[i]]}"
+                           + (f" as of {pd.Timestamp(self.dates[date_pos[i]]).date()}" if self.dates is not None else ''))
+        return xr
+
+    def _rate(self, date, quote, base, via=None):
+        return float(self.rates(None if date is None else [date], quote, base, via=via)[0])
+
+    def translate(self, values, currs, to_curr, dates=None):
+        """values stated in currs, restated in to_curr at each row's rate"""
+        return np.asarray(values, dtype=float) * self.rates(dates, to_curr, currs)
+
+    def snapshot(self, date=None):
+        """rates as of date as a QUOTE x BASE DataFrame, the XR0_df/XR1_df layout"""
+        return pd.DataFrame(self.array[self._date_pos(None if date is None else [date], 1)[0]], index=self.currencies, columns=self.currencies)
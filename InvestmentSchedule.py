@@ -0,0 +1,123 @@
+## Investment Schedule (IS) ## 投资明细表
+import numpy as np
+import pandas as pd
+
+
+class InvestmentSchedule:
+    """
+    Per-security positions behind the SFP_A_FA_* accounts, keyed by (Security_code, currency)
+    Each position owns one slot in flat NumPy arrays and a dict maps the key to its slot, so reads and updates are O(1)
+    while opens and closes stream through TransactionJEM, and whole-book reads (eg revaluation) stay vectorized
+
+        Unitsheld = units of the security held on the books
+        Avgbp = average book price per unit; average cost method, so closes relieve BV at Avgbp and do not change it
+        BV = book value, Unitsheld * Avgbp
+        CUM_UGLΔFV = cumulative unrealized g/l at fair value (adjunct asset account); positive is a DR balance, negative a CR balance
+        Asset_class = the SFP_A_FA_<class> the position sits in: 'E' (equity, default) or 'O' for options opened by FAOL_open
+
+    Use as:
+        IS = InvestmentSchedule.from_df(IS_t0_df) ## last period's closing Investment Schedule, or InvestmentSchedule() to start empty
+        tjem = TransactionJEM(df, XR0_df, XR1_df, IS=IS)
+        ...
+        IS_t1_df = IS.to_df()
+    """
+    is_cols = ['Security_code', 'Currency', 'Unitsheld', 'Avgbp', 'BV', 'CUM_UGLΔFV']
+
+    def __init__(self, capacity=64):
+        self.slots = {} ## (Security_code, currency): slot
+        self.keys = []
+        self.unitsheld = np.zeros(capacity)
+        self.avgbp = np.zeros(capacity)
+        self.bv = np.zeros(capacity)
+        self.cum_ugl = np.zeros(capacity)
+        self.asset_classes = [] ## slot: 'E', 'O', ...
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.slots
+
+    def _slot(self, sec_code, curr):
+        slot = self.slots.get((sec_code, curr))
+        if slot is None:
+            slot = len(self.keys)
+            if slot == len(self.unitsheld): ## double capacity (from at least one slot)
+                for name in ['unitsheld', 'avgbp', 'bv', 'cum_ugl']:
+                    setattr(self, name, np.concatenate([getattr(self, name), np.zeros(max(slot, 1))]))
+            self.slots[(sec_code, curr)] = slot
+            self.keys.append((sec_code, curr))
+            self.asset_classes.append('E')
+        return slot
+
+    def get(self, sec_code, curr):
+        """
+        returns (avgbp, unitsheld, CUM_UGLΔFV) of the position, in the order func_FAE_close takes them; zeros if never opened
+        """
+        slot = self.slots.get((sec_code, curr))
+        if slot is None:
+            return 0.0, 0.0, 0.0
+        return float(self.avgbp[slot]), float(self.unitsheld[slot]), float(self.cum_ugl[slot])
+
+    def open(self, sec_code, curr, units, value, date=None, asset_class=None):
+        ## buy; value is the book cost of the units, fees included; date (settle date) is kept by LotLedger;
+        ## asset_class ('O' for options) is kept for the position's SFP_A_FA_<class> accounts, eg at revaluation
+        slot = self._slot(sec_code, curr)
+        if asset_class is not None:
+            self.asset_classes[slot] = asset_class
+        self.unitsheld[slot] += units
+        self.bv[slot] += value
+        self.avgbp[slot] = self.bv[slot] / self.unitsheld[slot] if self.unitsheld[slot] else 0.0
+
+    def close(self, sec_code, curr, units):
+        """
+        sell; relieves BV at the average book price and the pro rata portion of CUM_UGLΔFV
+        returns the position BEFORE the close as (avgbp_t0, unitsheld_t0, CUM_UGLΔFV_t0), ie the inputs of func_FAE_close
+        """
+        if (sec_code, curr) not in self.slots:
+            raise KeyError(f"No open position in the Investment Schedule: {sec_code} ({curr})")
+        slot = self.slots[(sec_code, curr)]
+        avgbp_t0, unitsheld_t0, cum_ugl_t0 = float(self.avgbp[slot]), float(self.unitsheld[slot]), float(self.cum_ugl[slot])
+        if unitsheld_t0 <= 1e-12:
+            raise ValueError(f"Closing {units} units of {sec_code} ({curr}) with none held")
+        if units > unitsheld_t0 + 1e-9:
+            raise ValueError(f"Closing {units} units of {sec_code} ({curr}) with {unitsheld_t0} held")
+        if abs(unitsheld_t0 - units) <= 1e-9: ## fully closed; zero out instead of leaving float residue
+            self.unitsheld[slot] = self.bv[slot] = self.avgbp[slot] = self.cum_ugl[slot] = 0.0
+        else:
+            self.unitsheld[slot] -= units
+            self.bv[slot] -= units * avgbp_t0
+            self.cum_ugl[slot] -= (units / unitsheld_t0) * cum_ugl_t0
+        return avgbp_t0, unitsheld_t0, cum_ugl_t0
+
+    def set_cum_ugl(self, sec_code, curr, cum_ugl): ## after revaluing the position to fair value
+        self.cum_ugl[self._slot(sec_code, curr)] = cum_ugl
+
+    def to_df(self, include_closed=False):
+        n = len(self.keys)
+        IS_df = pd.DataFrame({'Security_code': [key[0] for key in self.keys],
+                              'Currency': [key[1] for key in self.keys],
+                              'Unitsheld': self.unitsheld[:n],
+                              'Avgbp': self.avgbp[:n],
+                              'BV': self.bv[:n],
+                              'CUM_UGLΔFV': self.cum_ugl[:n],
+                              'Asset_class': self.asset_classes},
+                             columns=self.is_cols + ['Asset_class'])
+        if not include_closed:
+            IS_df = IS_df[IS_df['Unitsheld'] != 0].reset_index(drop=True)
+        return IS_df
+
+    def update(self, IS_df):
+        ## overwrites the positions listed in IS_df (is_cols layout, plus Asset_class if it has one); new positions are added in IS_df's order
+        asset_classes = IS_df['Asset_class'] if 'Asset_class' in IS_df.columns else pd.Series(None, index=IS_df.index, dtype=object)
+        for (sec_code, curr, unitsheld, avgbp, bv, cum_ugl), asset_class in zip(IS_df[self.is_cols].itertuples(index=False), asset_classes):
+            slot = self._slot(sec_code, curr)
+            self.unitsheld[slot], self.avgbp[slot], self.bv[slot], self.cum_ugl[slot] = unitsheld, avgbp, bv, cum_ugl
+            if not pd.isna(asset_class):
+                self.asset_classes[slot] = asset_class
+
+    @classmethod
+    def from_df(cls, IS_df):
+        IS = cls(capacity=max(len(IS_df), 64))
+        IS.update(IS_df)
+        return IS
@@ -0,0 +1,31 @@
+## Display and plotting settings for notebooks and reports ## 显示与绘图设置
+## kept out of TransactionJEM so mapping jobs do not import matplotlib or change global pandas options
+import pandas as pd
+
+pandas_options = {'display.max_colwidth': 400,
+                  'display.max_columns': 50,
+                  'display.max_rows': 20,
+                  }
+
+
+def apply_display_settings(plots=True):
+    """
+    Use as:
+        import JEMDisplay
+        JEMDisplay.apply_display_settings() ## at the top of a notebook or reporting script
+
+    sets the pandas display options the ledgers are read with; plots=True also sets up matplotlib for Chinese labels
+    """
+    for option, value in pandas_options.items():
+        pd.set_option(option, value)
+    if plots:
+        plt = pyplot()
+        ## plt中文显示不乱码
+        plt.rcParams['font.sans-serif'] = ['SimHei']
+        plt.rcParams['axes.unicode_minus'] = False
+
+
+def pyplot():
+    """matplotlib.pyplot, imported on first use"""
+    import matplotlib.pyplot as plt
+    return plt
@@ -0,0 +1,151 @@
+## Mapping profiler ## 分录映射性能剖析
+import contextlib
+import datetime
+import json
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+percentiles = [50, 95, 99]
+
+
+class JEMProfiler:
+    """
+    Opt-in instrumentation of one TransactionJEM; nothing is wrapped until it is entered, so a TransactionJEM that is not
+    being profiled runs its plain methods (the only leftover cost is a no-op context around a few batch-level steps)
+
+    Use as:
+        with tjem.profile(memory=True, label='2024-03 close') as prof:
+            je_df = tjem.map_batch('Trxn_type', curr_tf={'presentation_curr': 'HKD'})
+            transaction_df = tjem.concat_je_rows(je_df)
+        prof.report() ## DataFrame: one row per mapper and per stage
+        prof.to_json('profiles/2024-03.json') ## machine-readable, to compare runs
+
+    Records call counts, total and percentile latencies (and, with memory=True, bytes allocated and still held after
+    each call, through tracemalloc, which slows the run down) for:
+        mappers  every func_* and batch_* method (batch_template per transaction type), map_batch, concat_je_rows
+        stages   row_access (df.iloc inside func_*), row_build (the rest of each func_* call: its one-row DataFrames,
+                 concat and Investment Schedule update), concat and rounding (concat_je_rows), IS_stream and assemble (map_batch)
+    Times are inclusive: a mapper's time contains its stages, and concat_je_rows contains concat and rounding
+    Only this instance is instrumented (its own methods and its _row/_stage hooks), so other TransactionJEMs mapping at the
+    same time are not counted and nothing is left behind if profilers exit out of order; map_parallel workers are not profiled
+    """
+    def __init__(self, tjem, memory=False, label=None):
+        self.tjem = tjem
+        self.memory = memory
+        self.label = label
+        self.records = {} ## (kind, name): [[seconds, ...], [bytes, ...]]
+        self.started = None
+        self.seconds = 0.0
+        self._own_tracemalloc = False
+        self._row_seconds = 0.0 ## running total of row_access, taken out of row_build
+
+    def __enter__(self):
+        tjem = self.tjem
+        if tjem.profiler is not None:
+            raise RuntimeError("This TransactionJEM is already being profiled")
+        tjem.profiler = self
+        self._wrapped = [name for name in dir(type(tjem)) if name.startswith(('func_', 'batch_')) or name in ['map_batch', 'concat_je_rows']]
+        for name in self._wrapped:
+            setattr(tjem, name, self._timed('mapper', name, getattr(tjem, name), per_type=name == 'batch_template'))
+        tjem._row = self._timed('stage', 'row_access', tjem._row)
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._own_tracemalloc = True
+        self.started = datetime.datetime.now().isoformat(timespec='seconds')
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds += time.perf_counter() - self._start
+        if self._own_tracemalloc:
+            tracemalloc.stop()
+            self._own_tracemalloc = False
+        for name in self._wrapped + ['_row']: ## back to the class's own methods
+            self.tjem.__dict__.pop(name, None)
+        self.tjem.profiler = None
+        return False
+
+    def _record(self, kind, name, seconds, allocated):
+        record = self.records.get((kind, name))
+        if record is None:
+            record = self.records[(kind, name)] = [[], []]
+        record[0].append(seconds)
+        if allocated is not None:
+            record[1].append(allocated)
+
+    def _timed(self, kind, name, method, per_type=False):
+        row_access, per_row = name == 'row_access', name.startswith('func_')
+        def timed(*args, **kwargs):
+            before = tracemalloc.get_traced_memory()[0] if self.memory else None
+            row_seconds = self._row_seconds
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                allocated = tracemalloc.get_traced_memory()[0] - before if self.memory else None
+                self._record(kind, f'{name}:{args[0]}' if per_type and args else name, seconds, allocated)
+                if row_access:
+                    self._row_seconds += seconds
+                elif per_row:
+                    self._record('stage', 'row_build', seconds - (self._row_seconds - row_seconds), None)
+        return timed
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        before = tracemalloc.get_traced_memory()[0] if self.memory else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self._record('stage', name, seconds, tracemalloc.get_traced_memory()[0] - before if self.memory else None)
+
+    def report(self):
+        """
+        DataFrame, one row per (kind, name): calls, total_s, mean_us, p50_us, p95_us, p99_us, max_us, share (of the profiled
+        wall time), and alloc_bytes / alloc_bytes_max with memory=True; sorted by total time within mappers and stages
+        """
+        rows = []
+        for (kind, name), (seconds, allocated) in self.records.items():
+            seconds = np.array(seconds)
+            row = {'kind': kind, 'name': name, 'calls': len(seconds), 'total_s': seconds.sum(), 'mean_us': seconds.mean() * 1e6}
+            row.update({f'p{q}_us': value * 1e6 for q, value in zip(percentiles, np.percentile(seconds, percentiles))})
+            row['max_us'] = seconds.max() * 1e6
+            row['share'] = seconds.sum() / self.seconds if self.seconds else np.nan
+            if allocated:
+                row['alloc_bytes'], row['alloc_bytes_max'] = int(np.sum(allocated)), int(np.max(allocated))
+            rows.append(row)
+        columns = ['kind', 'name', 'calls', 'total_s', 'mean_us'] + [f'p{q}_us' for q in percentiles] + ['max_us', 'share']
+        if self.memory:
+            columns += ['alloc_bytes', 'alloc_bytes_max']
+        report_df = pd.DataFrame(rows, columns=columns)
+        return report_df.sort_values(['kind', 'total_s'], ascending=[True, False], kind='stable').reset_index(drop=True)
+
+    def to_dict(self):
+        report_df = self.report()
+        records = json.loads(report_df.to_json(orient='records')) ## plain floats/ints, NaN as null
+        return {'label': self.label,
+                'started': self.started,
+                'seconds': self.seconds,
+                'rows': len(self.tjem.df),
+                'memory': self.memory,
+                'python': platform.python_version(),
+                'pandas': pd.__version__,
+                'numpy': np.__version__,
+                'mappers': [record for record in records if record['kind'] == 'mapper'],
+                'stages': [record for record in records if record['kind'] == 'stage'],
+                }
+
+    def to_json(self, path=None):
+        """the report as JSON text; written to path if given"""
+        text = json.dumps(self.to_dict(), indent=1, ensure_ascii=False)
+        if path is not None:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+        return text
+
@@ -0,0 +1,195 @@
+## Double-entry integrity checks ## 复式记账完整性校验
+import numpy as np
+import pandas as pd
+
+from FSTemplate import FSTemplate, template_path
+from FXRates import FXRates
+import Money
+
+slots = [(side, n) for n in range(3) for side in ['DR', 'CR']]
+checks = ['slot', 'value', 'account', 'fx', 'balance']
+violation_cols = ['idx', 'Trxn_type', 'Check', 'Slot', 'Account', 'Value', 'Detail']
+
+
+class JEValidator:
+    """
+    Checks whole ledgers of journal entries (the map_batch / concat_je_rows layout, one transaction per row) at once and
+    returns every problem as one row of a violations DataFrame instead of raising on the first:
+        slot     an account without a value or a value without an account; a transaction with no postings, or with
+                 postings on one side only
+        value    a value that is not a finite number, or is negative (amounts are entered positive, the side gives the sign)
+        account  an account that is not in the chart: every posting account must be an entered ('DR/CR, Entered Accounts')
+                 account of Regular_FSs_template.csv, or one with a security code (or currency) after it,
+                 eg SFP_A_FA_E_USD_BV_ABC.XNYS, SCI_XRPLFXC_HKD; totals (SFP_A_FA_E_USD, ...) are calculated, not posted to
+        fx       a posting in a currency that cannot be translated (no rate, or no currency in the account name or Trxn_value_curr)
+        balance  DR != CR. Entries in one currency are compared exactly, in integer minor units (cents);
+                 entries across currencies (curr_tf) after translating every leg to the presentation currency at XR_df,
+                 within tolerance (default: one minor unit of the presentation currency per leg)
+    Each distinct account is checked once and the verdict kept, so validating a ledger chunk by chunk costs the same
+
+    Use as:
+        validator = JEValidator(XR0_df) ## the rates the entries were mapped at (curr_tf gains are struck at XR0)
+        violations_df = validator.validate(tjem.concat_je_rows(je_df)) ## empty when the ledger is clean
+        validator.summary(violations_df) ## counts per check and transaction type
+    map_batch's je_df checks faster than the concat_je_rows layout (float value columns, no fillempty '' to parse):
+        violations_df = validator.validate(je_df, trxn_currs=tjem.df['Trxn_value_curr'].to_numpy()[je_df.index])
+    values are amounts, not concat_je_rows(minor_units=True)'s integer minor units
+    """
+    def __init__(self, XR_df=None, presentation_curr=None, path=template_path, tolerance=None):
+        self.fst = FSTemplate.load(path)
+        self.presentation_curr = presentation_curr or self.fst.presentation_curr
+        self.FX = XR_df if isinstance(XR_df, FXRates) or XR_df is None else FXRates.from_frame(XR_df, self.presentation_curr)
+        self.tolerance = tolerance
+        self.templates = set(self.fst.accounts[:self.fst.n_template])
+        self.account_verdicts = {} ## account: None if it is in the chart, else why not
+
+    def account_verdict(self, account):
+        verdict = self.account_verdicts.get(account, False)
+        if verdict is False:
+            if account in self.fst.entered:
+                verdict = None
+            elif account in self.templates:
+                verdict = 'calculated account; post to the accounts below it'
+            elif self.fst.entered_account(account) is None:
+                segments = account.split('_')
+                prefix = next((prefix for prefix in ('_'.join(segments[:n]) for n in range(len(segments) - 1, 0, -1))
+                               if prefix in self.templates), None)
+                verdict = f'not in the chart (nearest: {prefix})' if prefix is not None else 'not in the chart'
+            else:
+                verdict = None
+            self.account_verdicts[account] = verdict
+        return verdict
+
+    def _rate(self, curr):
+        ## presentation currency per unit of curr, NaN where it cannot be translated
+        if curr == self.presentation_curr:
+            return 1.0
+        try:
+            return self.FX.rate(None, self.presentation_curr, curr, self.presentation_curr)
+        except (KeyError, AttributeError, TypeError): ## currency not in the rates, no rates given, or no currency
+            return np.nan
+
+    def validate(self, ledger_df, trxn_currs=None, trxn_type_col='Trxn_type'):
+        """
+        violations DataFrame, one row per problem: idx (ledger_df's index label), Trxn_type, Check, Slot (eg DR_1), Account,
+        Value, Detail; sorted by row. Amounts of accounts without a currency in their name are taken to be in trxn_currs
+        (scalar or per row), by default the ledger's Trxn_value_curr
+        """
+        n, n_slots = len(ledger_df), len(slots)
+        if trxn_currs is None and 'Trxn_value_curr' in ledger_df.columns:
+            trxn_currs = ledger_df['Trxn_value_curr'].to_numpy(dtype=object)
+        labels = ledger_df.index.to_numpy()
+        trxn_types = ledger_df[trxn_type_col].to_numpy(dtype=object) if trxn_type_col in ledger_df.columns else np.full(n, None, dtype=object)
+        empty = np.full(n, None, dtype=object)
+        found = [] ## (row positions, check, slot, accounts, values, details), the last three at those rows (or one for all)
+
+        ## all account columns factorized together: chart verdict and currency are worked out once per distinct account
+        accounts = np.array([ledger_df[f'{side}_account_{n_slot}'].to_numpy(dtype=object) if f'{side}_account_{n_slot}' in ledger_df.columns else empty
+                             for side, n_slot in slots])
+        account_codes, uniques = pd.factorize(accounts.ravel(), use_na_sentinel=True)
+        account_codes = account_codes.reshape(n_slots, n)
+        uniques = [str(account) for account in uniques]
+        has_account = np.array([account != '' for account in uniques] + [False])[account_codes] ## code -1 (NaN/None) picks the trailing False
+        verdicts = np.array([self.account_verdict(account) if account else None for account in uniques] + [None], dtype=object)[account_codes]
+
+        ## currencies as codes into one vocabulary: the account's own, else the transaction's
+        account_currs = [Money._account_currency(account) for account in uniques]
+        trxn_curr_codes, trxn_curr_uniques = pd.factorize(pd.Series(np.broadcast_to(np.asarray(trxn_currs, dtype=object), n) if trxn_currs is not None else empty,
+                                                                    dtype=object), use_na_sentinel=True)
+        currs = list(dict.fromkeys([curr for curr in account_currs if curr is not None] + list(trxn_curr_uniques)))
+        curr_pos = {curr: pos for pos, curr in enumerate(currs)}
+        no_curr = len(currs) ## code for 'currency unknown'
+        own_codes = np.array([curr_pos.get(curr, -1) if curr is not None else -1 for curr in account_currs] + [-1])[account_codes]
+        trxn_codes = np.array([curr_pos[curr] for curr in trxn_curr_uniques] + [no_curr])[trxn_curr_codes]
+        curr_codes = np.where(own_codes >= 0, own_codes, trxn_codes[None, :])
+        curr_names = np.array(currs + [None], dtype=object)
+        curr_places = np.append(Money.digits(currs) if currs else np.array([], dtype=np.int64), Money.default_digits)
+        curr_rates = np.array([self._rate(curr) for curr in currs] + [np.nan])
+
+        values = np.zeros((n_slots, n))
+        posted = np.zeros((n_slots, n), dtype=bool) ## account and a finite value
+        minor = np.zeros((n_slots, n), dtype=np.int64)
+        for k, (side, n_slot) in enumerate(slots):
+            slot, value_col = f'{side}_{n_slot}', f'{side}_value_{n_slot}'
+            raw = ledger_df[value_col].to_numpy() if value_col in ledger_df.columns else np.full(n, np.nan)
+            if raw.dtype.kind in 'fiu':
+                value = raw.astype(float)
+                has_value = ~np.isnan(value)
+            else: ## object column, eg concat_je_rows' fillempty ''
+                value = pd.to_numeric(pd.Series(raw, dtype=object), errors='coerce').to_numpy(dtype=float)
+                has_value = ~np.isnan(value)
+                unparsed = np.flatnonzero(~has_value)
+                has_value[unparsed] = ~pd.isna(raw[unparsed]) & (raw[unparsed] != '')
+            account = accounts[k]
+            for check, mask, detail in [('slot', has_account[k] & ~has_value, 'account without a value'),
+                                        ('slot', has_value & ~has_account[k], 'value without an account'),
+                                        ('value', has_value & ~np.isfinite(value), 'not a finite number'),
+                                        ('value', has_value & (value < 0), 'negative amount'),
+                                        ('account', has_account[k] & ~pd.isna(verdicts[k]), verdicts[k])]:
+                rows = np.flatnonzero(mask)
+                found.append((rows, check, slot, account[rows], raw[rows], detail[rows] if isinstance(detail, np.ndarray) else detail))
+            posted[k] = has_account[k] & has_value & np.isfinite(value)
+            values[k] = np.where(posted[k], value, 0.0)
+            minor[k] = Money.to_minor(values[k], places=curr_places[curr_codes[k]]).to_numpy(dtype=np.int64, na_value=0)
+
+        is_dr = np.array([side == 'DR' for side, _ in slots])
+        any_dr, any_cr = posted[is_dr].any(axis=0), posted[~is_dr].any(axis=0)
+        for mask, detail in [(~any_dr & ~any_cr, 'no postings'), (any_dr & ~any_cr, 'DR postings only'), (~any_dr & any_cr, 'CR postings only')]:
+            found.append((np.flatnonzero(mask), 'slot', None, None, None, detail))
+
+        ## one currency per entry -> exact integer check; several -> translated check
+        lowest = np.where(posted, curr_codes, np.iinfo(np.int64).max).min(axis=0)
+        highest = np.where(posted, curr_codes, -1).max(axis=0)
+        single = any_dr & any_cr & (lowest == highest)
+        mixed = any_dr & any_cr & (lowest != highest)
+
+        dr_minor, cr_minor = minor[is_dr].sum(axis=0), minor[~is_dr].sum(axis=0)
+        unbalanced = np.flatnonzero(single & (dr_minor != cr_minor))
+        if len(unbalanced):
+            places = curr_places[lowest[unbalanced]]
+            dr_total, cr_total = Money.from_minor(dr_minor[unbalanced], places=places), Money.from_minor(cr_minor[unbalanced], places=places)
+            details = np.array([f'DR {dr:,.{p}f} != CR {cr:,.{p}f} {curr or ""}'.rstrip()
+                                for dr, cr, p, curr in zip(dr_total, cr_total, places, curr_names[lowest[unbalanced]])], dtype=object)
+            found.append((unbalanced, 'balance', None, None, dr_total - cr_total, details))
+
+        mixed_pos = np.flatnonzero(mixed)
+        if len(mixed_pos):
+            legs, leg_codes = posted[:, mixed_pos], curr_codes[:, mixed_pos]
+            rates = curr_rates[leg_codes]
+            missing = legs & np.isnan(rates)
+            for k, (side, n_slot) in enumerate(slots):
+                rows = mixed_pos[missing[k]]
+                if len(rows):
+                    found.append((rows, 'fx', f'{side}_{n_slot}', accounts[k][rows], values[k][rows],
+                                  np.array([f'no {self.presentation_curr} rate for {curr}' for curr in curr_names[leg_codes[k][missing[k]]]], dtype=object)))
+            translated = np.where(legs, values[:, mixed_pos] * np.nan_to_num(rates), 0.0)
+            dr_pres, cr_pres = translated[is_dr].sum(axis=0), translated[~is_dr].sum(axis=0)
+            tolerance = self.tolerance if self.tolerance is not None else legs.sum(axis=0) * 10.0 ** -Money.digits(self.presentation_curr)
+            off = ~missing.any(axis=0) & (np.abs(dr_pres - cr_pres) > tolerance)
+            if off.any():
+                details = np.array([f'DR {dr:,.2f} != CR {cr:,.2f} {self.presentation_curr} translated'
+                                    for dr, cr in zip(dr_pres[off], cr_pres[off])], dtype=object)
+                found.append((mixed_pos[off], 'balance', None, None, dr_pres[off] - cr_pres[off], details))
+
+        frames = []
+        for rows, check, slot, account, value, detail in found:
+            if not len(rows):
+                continue
+            frames.append(pd.DataFrame({'pos': rows, 'idx': labels[rows], 'Trxn_type': trxn_types[rows], 'Check': check, 'Slot': slot,
+                                        'Account': account, 'Value': value, 'Detail': detail}))
+        if not frames:
+            return pd.DataFrame(columns=violation_cols)
+        violations_df = pd.concat(frames, ignore_index=True)
+        violations_df['Check'] = pd.Categorical(violations_df['Check'], categories=checks)
+        violations_df = violations_df.sort_values(['pos', 'Check'], kind='stable')
+        return violations_df[violation_cols].reset_index(drop=True)
+
+    def summary(self, violations_df):
+        """violation counts per check (rows) and transaction type (columns), with the number of transactions affected"""
+        if not len(violations_df):
+            return pd.DataFrame(columns=['violations', 'transactions'])
+        summary_df = violations_df.pivot_table(index='Check', columns=violations_df['Trxn_type'].fillna('(none)'), values='idx',
+                                               aggfunc='size', fill_value=0, observed=True)
+        summary_df['violations'] = summary_df.sum(axis=1)
+        summary_df['transactions'] = violations_df.groupby('Check', observed=True)['idx'].nunique()
+        return summary_df
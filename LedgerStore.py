@@ -0,0 +1,153 @@
+## Ledger storage: Parquet files partitioned by fund and period ## 分基金、分期间的列式账本存储
+import os
+import shutil
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from TransactionJEM import TransactionJEM
+
+date_col = 'Settle_date'
+
+
+class LedgerStore:
+    """
+    Mapped ledgers (the concat_je_rows layout: transactions + DR/CR columns) on disk as Parquet, one directory per fund and
+    month, instead of whole-ledger pickles:
+        root/fund=<fund>/period=<YYYY-MM>/part-<id>.parquet
+    Every append adds new part files, nothing is rewritten; rows are sorted by Settle_date inside each file so the row group
+    statistics let reads skip most of a month too. Reads only open the partitions, row groups and columns they need
+
+    Use as:
+        store = LedgerStore('ledgers')
+        store.append(transaction_df, fund='Fund1')
+        for mapped_chunk in map_transactions_stream(read_transactions('trxns.csv'), XR0_df, XR1_df):
+            store.append(mapped_chunk, fund='Fund1')
+
+        ledger_df = store.read(fund='Fund1', start='2024-03-01', end='2024-03-31')
+        fees_df = store.read(columns=['Settle_date', 'DR_account_0', 'DR_value_0'], account_prefix='SCI_E_')
+        abc_df = store.read(securities=['ABC.XNYS'], start='2024-01-01')
+
+    pyarrow is only needed here, so it is imported when a store is first used
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def _partitioning(self):
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        return ds.partitioning(pa.schema([('fund', pa.string()), ('period', pa.string())]), flavor='hive')
+
+    def append(self, ledger_df, fund='default'):
+        """writes ledger_df's rows under their fund/month partitions; returns the paths of the files written"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        ledger_df = self._normalize(ledger_df)
+        periods = ledger_df[date_col].dt.strftime('%Y-%m').fillna('NaT')
+        paths = []
+        for period, period_df in ledger_df.groupby(periods.to_numpy(), sort=True):
+            period_dir = os.path.join(self.root, f'fund={fund}', f'period={period}')
+            os.makedirs(period_dir, exist_ok=True)
+            path = os.path.join(period_dir, f'part-{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.parquet') ## names sort in append order
+            table = pa.Table.from_pandas(period_df.sort_values(date_col, kind='stable'), preserve_index=False)
+            table = table.cast(pa.schema([pa.field(field.name, pa.float64() if 'value' in field.name else pa.string())
+                                          if field.name in TransactionJEM.je_col_names else field for field in table.schema]))
+            pq.write_table(table, path, row_group_size=64_000)
+            paths.append(path)
+        return paths
+
+    def _normalize(self, ledger_df):
+        ## one schema for every part file: concat_je_rows fills empty DR/CR slots with fillempty (eg '') and only has the
+        ## slots its transaction types used, so the full slot set is written with nulls, values as floats, accounts as strings
+        ledger_df = ledger_df.copy()
+        for col in TransactionJEM.je_col_names:
+            if col not in ledger_df.columns:
+                ledger_df[col] = np.nan
+            if 'value' in col:
+                ledger_df[col] = pd.to_numeric(ledger_df[col].replace('', np.nan), errors='coerce').astype(float)
+            else:
+                ledger_df[col] = ledger_df[col].replace('', np.nan).astype(object).where(ledger_df[col].notna(), None)
+        ledger_df[date_col] = pd.to_datetime(ledger_df[date_col]).astype('datetime64[ns]')
+        for col in ledger_df.columns:
+            if ledger_df[col].dtype == object and pd.api.types.infer_dtype(ledger_df[col], skipna=True) not in ['string', 'empty']:
+                ledger_df[col] = ledger_df[col].map(lambda x: x if pd.isna(x) else str(x)) ## mixed types, eg codes read as int and str
+        return ledger_df[[col for col in ledger_df.columns if col not in TransactionJEM.je_col_names] + TransactionJEM.je_col_names]
+
+    def dataset(self):
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        dataset = ds.dataset(self.root, format='parquet', partitioning=self._partitioning())
+        ## columns can be all-null in one part file (null type) and typed in another; unify so every file reads the same
+        schemas = [fragment.physical_schema for fragment in dataset.get_fragments()]
+        if not schemas:
+            return dataset
+        schema = pa.unify_schemas(schemas, promote_options='permissive')
+        for name in ['fund', 'period']:
+            schema = schema.append(pa.field(name, pa.string()))
+        return ds.dataset(self.root, format='parquet', partitioning=self._partitioning(), schema=schema)
+
+    def read(self, columns=None, fund=None, start=None, end=None, securities=None, account_prefix=None):
+        """
+        columns = columns to load (None for all); fund = one fund or a list of funds
+        start/end = Settle_date range, both inclusive; securities = Security_code values to keep
+        account_prefix = keep rows where any DR/CR account starts with it (or with any of a list of prefixes)
+        the filters are pushed down to the partition directories and the Parquet row group statistics
+        """
+        import pyarrow.compute as pc
+        import pyarrow.dataset as ds
+        if not os.path.isdir(self.root):
+            return pd.DataFrame(columns=columns)
+        dataset = self.dataset()
+        conditions = []
+        if fund is not None:
+            conditions.append(ds.field('fund').isin([fund] if isinstance(fund, str) else list(fund)))
+        if start is not None:
+            start = pd.Timestamp(start)
+            conditions += [ds.field('period') >= start.strftime('%Y-%m'), ds.field(date_col) >= start]
+        if end is not None:
+            end = pd.Timestamp(end)
+            end_exclusive = end + pd.Timedelta(days=1) if end == end.normalize() else end + pd.Timedelta(1, 'ns') ## whole end day
+            conditions += [ds.field('period') <= end.strftime('%Y-%m'), ds.field(date_col) < end_exclusive]
+        if securities is not None:
+            conditions.append(ds.field('Security_code').isin(list(securities)))
+        if account_prefix is not None:
+            prefixes = [account_prefix] if isinstance(account_prefix, str) else list(account_prefix)
+            account_cols = [col for col in TransactionJEM.je_col_names if 'account' in col and col in dataset.schema.names]
+            matches = [pc.starts_with(ds.field(col), pattern=prefix) for col in account_cols for prefix in prefixes]
+            if matches:
+                conditions.append(_any(matches))
+            else:
+                conditions.append(ds.scalar(False))
+        table = dataset.to_table(columns=columns, filter=_all(conditions) if conditions else None)
+        ledger_df = table.to_pandas()
+        sort_cols = [col for col in ['fund', date_col] if col in ledger_df.columns]
+        if sort_cols: ## part files are read in append order; stable sort keeps same-day rows in that order
+            ledger_df = ledger_df.sort_values(sort_cols, kind='stable').reset_index(drop=True)
+        return ledger_df
+
+    def drop(self, fund, periods):
+        """deletes the fund's files for these months ('YYYY-MM'), eg before re-writing a re-run period"""
+        for period in periods:
+            shutil.rmtree(os.path.join(self.root, f'fund={fund}', f'period={period}'), ignore_errors=True)
+
+    def periods(self, fund=None):
+        """the months on disk, per fund"""
+        funds = [fund] if fund is not None else sorted(name[len('fund='):] for name in os.listdir(self.root) if name.startswith('fund='))
+        return {fund: sorted(name[len('period='):] for name in os.listdir(os.path.join(self.root, f'fund={fund}')) if name.startswith('period='))
+                for fund in funds if os.path.isdir(os.path.join(self.root, f'fund={fund}'))}
+
+
+def _all(conditions):
+    condition = conditions[0]
+    for other in conditions[1:]:
+        condition = condition & other
+    return condition
+
+
+def _any(conditions):
+    condition = conditions[0]
+    for other in conditions[1:]:
+        condition = condition | other
+    return condition
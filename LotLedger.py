@@ -0,0 +1,158 @@
+## Lot-level cost basis ## 按批次计算持仓成本
+from collections import deque
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from InvestmentSchedule import InvestmentSchedule
+
+methods = ['FIFO', 'LIFO', 'specific']
+
+
+class LotLedger(InvestmentSchedule):
+    """
+    An Investment Schedule that keeps every buy as its own tax lot and relieves closes lot by lot, FIFO, LIFO or by
+    specific lot, instead of at the average book price. Drop-in for InvestmentSchedule:
+        IS = LotLedger('FIFO')
+        tjem = TransactionJEM(df, XR0_df, XR1_df, IS=IS)
+        je_df = tjem.map_batch('Trxn_type') ## or the func_* calls
+    close() returns the relieved lots' cost per unit as avgbp_t0, so func_FAE_close / batch_FAE_close book exactly the lots'
+    cost to SFP_A_FA_E_<curr>_BV_<sec> and the rest to SCI_I_RGLFA_<curr>, with no change to the mapping code;
+    Avgbp/BV of the schedule are those of the lots still held
+
+    Lots of a position sit in a deque in buy order: FIFO relieves from the left, LIFO from the right, each in amortized O(1)
+    per lot touched, however many lots the position has. Specific lots are found through a lot ID index in O(1); a lot
+    emptied out of the middle of the deque stays as a zero lot until it reaches an end (lazy deletion)
+    Specific relief: queue the lot choice before the close is mapped, eg from the broker's lot election,
+        IS.select('ABC.XNYS', 'USD', {'L17': 300, 'L42': 200})
+    each close of that position takes the next queued choice (any units beyond it come off by method; no choice, by method)
+
+    relieved_df() lists every lot relief (close number, lot, units, cost, open date) for tax-lot reporting; TransactionJEM
+    opens lots at the transaction's Settle_date (no open date if df has no Settle_date column, or for positions read by from_df)
+    to_df() / from_df() keep the InvestmentSchedule layout (a position read from it becomes one lot at its average cost);
+    map_parallel rebuilds plain InvestmentSchedules in its workers, so map lot ledgers with map_batch
+    """
+    def __init__(self, method='FIFO', capacity=64):
+        if method not in methods:
+            raise ValueError(f"Invalid lot relief method: {method}; one of {methods}")
+        super().__init__(capacity)
+        self.method = method
+        self.lots = [] ## slot: deque of lots [lot_id, units, cost, date]
+        self.lot_index = {} ## lot_id: (slot, lot)
+        self.selections = {} ## slot: deque of pending {lot_id: units} choices
+        self.relieved = [] ## (close_no, Security_code, Currency, Lot_id, Units, Cost, Open_date)
+        self.n_closes = 0
+        self._lot_ids = itertools.count(1)
+
+    def _slot(self, sec_code, curr):
+        slot = super()._slot(sec_code, curr)
+        while len(self.lots) <= slot:
+            self.lots.append(deque())
+        return slot
+
+    def open(self, sec_code, curr, units, value, lot_id=None, date=None, asset_class=None):
+        """buy; adds a lot and returns its ID ('L1', 'L2', ... unless given)"""
+        super().open(sec_code, curr, units, value, date, asset_class)
+        slot = self.slots[(sec_code, curr)]
+        lot_id = lot_id if lot_id is not None else f'L{next(self._lot_ids)}'
+        if lot_id in self.lot_index:
+            raise ValueError(f"Lot ID already used: {lot_id}")
+        lot = [lot_id, float(units), float(value), date]
+        self.lots[slot].append(lot)
+        self.lot_index[lot_id] = (slot, lot)
+        return lot_id
+
+    def select(self, sec_code, curr, lots):
+        """queues a specific lot choice {lot_id: units} (or a list of lot IDs, taken whole) for the next close of the position"""
+        slot = self._slot(sec_code, curr)
+        if not isinstance(lots, dict):
+            lots = {lot_id: None for lot_id in lots}
+        for lot_id in lots:
+            if self.lot_index.get(lot_id, (None,))[0] != slot:
+                raise KeyError(f"No lot {lot_id} in {sec_code} ({curr})")
+        self.selections.setdefault(slot, deque()).append(lots)
+
+    def close(self, sec_code, curr, units, method=None):
+        """
+        sell; relieves lots for units (method defaults to the ledger's) and the pro rata portion of CUM_UGLΔFV
+        returns (relieved cost per unit, unitsheld_t0, CUM_UGLΔFV_t0), ie the inputs of func_FAE_close
+        """
+        if (sec_code, curr) not in self.slots:
+            raise KeyError(f"No open position in the Investment Schedule: {sec_code} ({curr})")
+        slot = self.slots[(sec_code, curr)]
+        unitsheld_t0, cum_ugl_t0 = float(self.unitsheld[slot]), float(self.cum_ugl[slot])
+        if units > unitsheld_t0 + 1e-9:
+            raise ValueError(f"Closing {units} units of {sec_code} ({curr}) with {unitsheld_t0} held")
+        self.n_closes += 1
+        method = method or self.method
+        cost, remaining = 0.0, float(units)
+        pending = self.selections.get(slot)
+        if pending:
+            for lot_id, lot_units in pending.popleft().items():
+                if lot_id not in self.lot_index: ## emptied since it was queued, eg by an earlier choice of the same lot
+                    raise ValueError(f"Lot {lot_id} of {sec_code} ({curr}) is already closed")
+                _, lot = self.lot_index[lot_id]
+                take = min(lot[1] if lot_units is None else lot_units, lot[1], remaining)
+                if take > 0:
+                    cost += self._relieve(slot, lot, take)
+                    remaining -= take
+        lots = self.lots[slot]
+        from_right = method == 'LIFO' ## 'specific' beyond the queued choice (or without one) relieves FIFO
+        while remaining > 1e-12 and lots:
+            lot = lots[-1] if from_right else lots[0]
+            if lot[1] > 1e-12: ## zero lots left by specific relief are only dropped; they were relieved already
+                take = min(lot[1], remaining)
+                cost += self._relieve(slot, lot, take)
+                remaining -= take
+            if lot[1] <= 1e-12:
+                lots.pop() if from_right else lots.popleft()
+        while lots and lots[0][1] <= 1e-12: ## lazy deletion of lots emptied by specific relief
+            lots.popleft()
+        while lots and lots[-1][1] <= 1e-12:
+            lots.pop()
+
+        if not lots: ## fully closed; zero out instead of leaving float residue
+            self.unitsheld[slot] = self.bv[slot] = self.avgbp[slot] = self.cum_ugl[slot] = 0.0
+        else:
+            self.unitsheld[slot] -= units
+            self.bv[slot] -= cost
+            self.avgbp[slot] = self.bv[slot] / self.unitsheld[slot]
+            self.cum_ugl[slot] -= (units / unitsheld_t0) * cum_ugl_t0
+        return (cost / units if units else 0.0), unitsheld_t0, cum_ugl_t0
+
+    def _relieve(self, slot, lot, units):
+        cost = lot[2] * units / lot[1] if units < lot[1] else lot[2]
+        lot[1] -= units
+        lot[2] -= cost
+        if lot[1] <= 1e-12:
+            lot[1] = lot[2] = 0.0
+            del self.lot_index[lot[0]]
+        sec_code, curr = self.keys[slot]
+        self.relieved.append((self.n_closes, sec_code, curr, lot[0], units, cost, lot[3]))
+        return cost
+
+    def update(self, IS_df):
+        ## positions read in the InvestmentSchedule layout become one lot each, at their BV
+        super().update(IS_df)
+        for sec_code, curr, unitsheld, bv in IS_df[['Security_code', 'Currency', 'Unitsheld', 'BV']].itertuples(index=False):
+            slot = self._slot(sec_code, curr)
+            for lot in self.lots[slot]:
+                self.lot_index.pop(lot[0], None)
+            self.lots[slot].clear()
+            if unitsheld:
+                lot = [f'L{next(self._lot_ids)}', float(unitsheld), float(bv), None]
+                self.lots[slot].append(lot)
+                self.lot_index[lot[0]] = (slot, lot)
+
+    def lots_df(self):
+        """open lots: Security_code, Currency, Lot_id, Units, Cost, Unit_cost, Open_date, in buy order per position"""
+        rows = [(sec_code, curr, lot[0], lot[1], lot[2], lot[3])
+                for (sec_code, curr), lots in zip(self.keys, self.lots) for lot in lots if lot[1] > 1e-12]
+        lots_df = pd.DataFrame(rows, columns=['Security_code', 'Currency', 'Lot_id', 'Units', 'Cost', 'Open_date'])
+        lots_df.insert(5, 'Unit_cost', lots_df['Cost'] / lots_df['Units'].replace(0, np.nan))
+        return lots_df
+
+    def relieved_df(self):
+        """every lot relief so far: Close_no (1 for the first close, ...), Security_code, Currency, Lot_id, Units, Cost, Open_date"""
+        return pd.DataFrame(self.relieved, columns=['Close_no', 'Security_code', 'Currency', 'Lot_id', 'Units', 'Cost', 'Open_date'])
@@ -0,0 +1,83 @@
+## Money amounts as integer minor units ## 金额：按币种最小单位的整数表示
+import re
+
+import numpy as np
+import pandas as pd
+
+## ISO 4217 minor unit digits; every other currency has 2 (cents)
+currency_digits = {
+    'BIF': 0, 'CLP': 0, 'DJF': 0, 'GNF': 0, 'ISK': 0, 'JPY': 0, 'KMF': 0, 'KRW': 0, 'PYG': 0, 'RWF': 0,
+    'UGX': 0, 'VND': 0, 'VUV': 0, 'XAF': 0, 'XOF': 0, 'XPF': 0,
+    'BHD': 3, 'IQD': 3, 'JOD': 3, 'KWD': 3, 'LYD': 3, 'OMR': 3, 'TND': 3,
+}
+default_digits = 2
+## currencies recognised inside account names (SFP_A_FA_E_USD_BV_ABC.XNYS, SCI_I_DI_CNY, ...)
+known_currencies = set(currency_digits) | {
+    'AED', 'AUD', 'BRL', 'CAD', 'CHF', 'CNH', 'CNY', 'CZK', 'DKK', 'EUR', 'GBP', 'HKD', 'HUF', 'IDR', 'ILS', 'INR',
+    'MOP', 'MXN', 'MYR', 'NOK', 'NZD', 'PHP', 'PLN', 'RUB', 'SAR', 'SEK', 'SGD', 'THB', 'TRY', 'TWD', 'USD', 'ZAR',
+}
+_pair_re = re.compile(r'([A-Z]{3})2([A-Z]{3})$') ## SCNAV_ΔNAXR_USD2HKD is stated in HKD
+
+
+def digits(currs):
+    """minor unit digits per currency; scalar or array-like"""
+    if np.ndim(currs) == 0:
+        return currency_digits.get(currs, default_digits)
+    codes, uniques = pd.factorize(pd.Series(currs, dtype=object), use_na_sentinel=False)
+    return np.array([currency_digits.get(curr, default_digits) for curr in uniques], dtype=np.int64)[codes]
+
+
+def to_minor(values, currs=None, places=None):
+    """
+    amounts -> integer minor units (cents, yen, fils, ...), rounded half away from zero, the usual rule for money;
+    NaN (and non-numbers such as fillempty '') become <NA>. Returns a pandas Int64 array
+    places = digits(currs), if already known
+    Use as:
+        to_minor([1650.0, 2748.485, -0.125], 'USD') ## <IntegerArray> [165000, 274849, -13]
+    """
+    array = np.asarray(values) if np.ndim(values) else np.asarray([values])
+    if array.dtype.kind in 'fiu': ## already numbers; no object round trip
+        values = array.astype(float)
+    else:
+        values = pd.to_numeric(pd.Series(array.astype(object)), errors='coerce').to_numpy(dtype=float)
+    scaled = values * 10.0 ** (places if places is not None else digits(currs))
+    ## the 1e-9 absorbs binary representation error, so 2748.485 (stored as 2748.48499...) rounds as the decimal it stands for
+    return pd.array(np.sign(scaled) * np.floor(np.abs(scaled) + 0.5 + 1e-9), dtype='Int64')
+
+
+def from_minor(minor, currs=None, places=None):
+    """integer minor units -> float amounts (NaN where <NA>)"""
+    minor = pd.array(minor, dtype='Int64').to_numpy(dtype=float, na_value=np.nan)
+    return minor / 10.0 ** (places if places is not None else digits(currs))
+
+
+def round_money(values, currs):
+    """amounts rounded to their currency's minor unit, as floats"""
+    places = digits(currs)
+    return from_minor(to_minor(values, places=places), places=places)
+
+
+def account_currencies(accounts, default=None):
+    """
+    currency an account's amounts are stated in, read from the account name: the first segment that is a currency code,
+    or the second currency of a <CUR>2<CUR> pair; default (scalar or per row) where the name has none
+    Parsed once per distinct account
+    """
+    codes, uniques = pd.factorize(pd.Series(accounts, dtype=object), use_na_sentinel=True)
+    parsed = np.array([_account_currency(account) for account in uniques] + [None], dtype=object)
+    currs = parsed[codes] ## code -1 (missing account) picks the trailing None
+    if default is not None:
+        currs = np.where(pd.isna(currs), np.broadcast_to(np.asarray(default, dtype=object), currs.shape), currs)
+    return currs
+
+
+def _account_currency(account):
+    if not isinstance(account, str):
+        return None
+    for segment in account.split('_'):
+        if segment in known_currencies:
+            return segment
+        pair = _pair_re.match(segment)
+        if pair and pair.group(2) in known_currencies:
+            return pair.group(2)
+    return None
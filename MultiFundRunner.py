@@ -0,0 +1,177 @@
+## Multi-fund batch runs ## 多基金批量映射与结账
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+
+from ChartOfAccounts import ChartOfAccounts
+from FSTemplate import FSTemplate, template_path, _plan_cache
+from FXRates import FXRates
+from InvestmentSchedule import InvestmentSchedule
+from PeriodClose import close_balances, empty_balances
+from TransactionJEM import TransactionJEM
+
+## statement accounts whose natural balance is a credit, entered as CR - DR; the rest (assets, expenses, cash flows,
+## redemptions) as DR - CR, so every entered value is positive in the usual case, as the template formulas expect
+credit_prefixes = ('SFP_L', 'SCI_I', 'SCI_OCI', 'SCI_XRPLFXC', 'SCNAV_SUB')
+stock_prefixes = ('SFP_',) ## closing balances; every other statement takes the period's movement
+
+_worker = {} ## per worker process: the shared rates, template and chart, attached once by _init_worker
+
+
+class SharedArtifacts:
+    """
+    The read-only inputs every fund maps with, placed once in shared memory for the worker processes:
+        rates     XR0_df and XR1_df as one float array [2, currency, currency]; workers read it in place (DataFrames over
+                  the shared buffer, no copy per worker or per fund)
+        template  the parsed and compiled FSTemplate and the template ChartOfAccounts, pickled once; each worker unpickles
+                  them once at start (the compiled plan is re-executed from its source, the csv is not read again) and
+                  every fund it runs uses them
+    Use as a context manager; the blocks are unlinked on exit
+    """
+    def __init__(self, XR0_df, XR1_df, path=template_path, coa=None):
+        self.currencies = sorted(set(XR0_df.index) | set(XR0_df.columns) | set(XR1_df.index) | set(XR1_df.columns))
+        rates = np.stack([XR_df.reindex(index=self.currencies, columns=self.currencies).to_numpy(dtype=float) for XR_df in [XR0_df, XR1_df]])
+        fst = FSTemplate.load(path)
+        stat = os.stat(path)
+        blob = pickle.dumps({'fst': fst, 'fst_key': (os.path.abspath(path), stat.st_mtime_ns, stat.st_size),
+                             'coa': coa if coa is not None else ChartOfAccounts.from_template(path), 'currencies': self.currencies},
+                            protocol=pickle.HIGHEST_PROTOCOL)
+        self.rates_shm = shared_memory.SharedMemory(create=True, size=rates.nbytes)
+        np.ndarray(rates.shape, dtype=rates.dtype, buffer=self.rates_shm.buf)[:] = rates
+        self.blob_shm = shared_memory.SharedMemory(create=True, size=len(blob))
+        self.blob_shm.buf[:len(blob)] = blob
+        self.handle = (self.rates_shm.name, rates.shape, self.blob_shm.name, len(blob))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def close(self):
+        for shm in [self.rates_shm, self.blob_shm]:
+            shm.close()
+            shm.unlink()
+
+
+def _attach(handle):
+    ## rates as DataFrames over the shared buffer; template and chart unpickled once, the template put in FSTemplate.load's cache
+    rates_name, shape, blob_name, blob_size = handle
+    rates_shm = shared_memory.SharedMemory(name=rates_name)
+    blob_shm = shared_memory.SharedMemory(name=blob_name)
+    state = pickle.loads(blob_shm.buf[:blob_size])
+    rates = np.ndarray(shape, dtype=np.float64, buffer=rates_shm.buf)
+    rates.flags.writeable = False
+    currencies = state['currencies']
+    _plan_cache[state['fst_key']] = state['fst']
+    return {'shm': [rates_shm, blob_shm], 'fst': state['fst'], 'coa': state['coa'],
+            'XR0_df': pd.DataFrame(rates[0], index=currencies, columns=currencies, copy=False),
+            'XR1_df': pd.DataFrame(rates[1], index=currencies, columns=currencies, copy=False)}
+
+
+def statement_inputs(opening_df, closing_df, XR_df, fst, presentation_curr=None, period='t1'):
+    """
+    entered template accounts for one period, from opening and closing balances (Account, Currency, Balance, eg close_balances'):
+    SFP accounts at their closing balance, SCI/SCF/SCNAV accounts at the period's movement, sub-accounts summed into the
+    entered account they post into (fst.entered_account), XR_<curr>2<presentation curr> from XR_df
+    SFP_A_CCE_<curr> is entered as the closing cash (cash_balances), which the template keeps over its formula (the
+    period's SCF movement only)
+    returns (inputs_df: entered accounts x [period], accounts that post into no entered account)
+    """
+    presentation_curr = presentation_curr or fst.presentation_curr
+    movement = pd.concat([closing_df[['Account', 'Balance']], opening_df[['Account', 'Balance']].assign(Balance=-opening_df['Balance'])])
+    accounts = movement['Account'].astype(str).to_numpy(dtype=object)
+    stock = np.array([account.startswith(stock_prefixes) for account in accounts], dtype=bool)
+    keep = ~stock | (np.arange(len(accounts)) < len(closing_df)) ## stocks: closing rows only
+    entered = pd.Series({account: fst.entered_account(account) for account in pd.unique(accounts)})
+    targets = entered.reindex(accounts).to_numpy(dtype=object)
+    signs = np.where([account.startswith(credit_prefixes) for account in accounts], -1.0, 1.0)
+    values = pd.Series(movement['Balance'].to_numpy(dtype=float) * signs, index=targets)[keep & pd.notna(targets)]
+    inputs = values.groupby(level=0).sum()
+    if len(fst.currencies):
+        FX = FXRates.from_frame(XR_df, presentation_curr)
+        xr_accounts = [f'XR_{curr}2{presentation_curr}' for curr in fst.currencies if curr != presentation_curr]
+        inputs = pd.concat([inputs, pd.Series(FX.rates(None, presentation_curr, [account[3:6] for account in xr_accounts]), index=xr_accounts)])
+    cash_accounts = [f'SFP_A_CCE_{curr}' for curr in fst.currencies if f'SFP_A_CCE_{curr}' in fst.entered]
+    cash = cash_balances(closing_df).reindex([account[len('SFP_A_CCE_'):] for account in cash_accounts]).fillna(0)
+    inputs = pd.concat([inputs.drop(cash_accounts, errors='ignore'), pd.Series(cash.to_numpy(), index=cash_accounts)])
+    unmapped = sorted(set(accounts[pd.isna(targets)]))
+    return inputs.to_frame(period), unmapped
+
+
+def cash_balances(balances_df):
+    """
+    closing cash per currency from balances (Account, Currency, Balance with DR positive): the SCF accounts cash moves are
+    booked through, plus anything posted straight to SFP_A_CCE_<curr> (eg curr_tf)
+    """
+    accounts = balances_df['Account'].astype(str)
+    cash = accounts.str.startswith(('SCF_', 'SFP_A_CCE_')) & ~accounts.str.endswith('_S')
+    return balances_df[cash].groupby('Currency')['Balance'].sum()
+
+
+def run_funds(funds, XR0_df, XR1_df, n_workers=None, trxn_type_col='Trxn_type', type_kwargs=None, period='t1',
+              fillempty='', path=template_path):
+    """
+    Use as:
+        results = run_funds({'Fund A': trxn_a_df,
+                             'Fund B': {'trxn_df': trxn_b_df, 'IS': IS_b_df, 'opening': balances_b_df},
+                             ...},
+                            XR0_df, XR1_df, n_workers=8, period='2024-03', type_kwargs={'curr_tf': {'presentation_curr': 'HKD'}})
+        results['Fund A']['SFP'], results['Fund A']['IS'], results['Fund B']['balances']
+
+    Maps and closes one period for every fund in a process pool, largest funds first. The rates, template and chart of
+    accounts are loaded once and shared with the workers (SharedArtifacts), not copied or re-read per fund
+    A fund is its transaction frame, or a dict of:
+        trxn_df       the period's transactions
+        IS            Investment Schedule at the start (InvestmentSchedule.to_df layout), default empty
+        opening       closing balances of last period (Account, Currency, Debit, Credit, Balance), default none
+        opening_values  last period's evaluated template values (values column of its result), for the {t0} terms;
+                      default: evaluated from opening and XR0_df
+        type_kwargs   per fund mapping arguments, replacing the shared type_kwargs (eg per-row FAOL_close terms)
+    Each fund's result: ledger (concat_je_rows layout), balances (closing, as PeriodClose keeps them), IS, values (every
+    template account), SFP, SCI, SCF, SCNAV (fst.statements), unmapped (ledger accounts outside the template), seconds
+    """
+    type_kwargs = type_kwargs or {}
+    tasks = []
+    for fund, spec in funds.items():
+        spec = spec if isinstance(spec, dict) else {'trxn_df': spec}
+        tasks.append((fund, spec['trxn_df'], spec.get('IS'), spec.get('opening'), spec.get('opening_values'),
+                      spec.get('type_kwargs', type_kwargs)))
+    tasks.sort(key=lambda task: -len(task[1])) ## largest first
+    n_workers = min(n_workers or os.cpu_count(), max(len(tasks), 1))
+    with SharedArtifacts(XR0_df, XR1_df, path) as shared:
+        settings = (shared.handle, trxn_type_col, period, fillempty)
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=settings) as pool:
+            results = dict(pool.map(_run_fund, tasks))
+    return {fund: results[fund] for fund in funds}
+
+
+def _init_worker(handle, trxn_type_col, period, fillempty):
+    _worker.update(_attach(handle), trxn_type_col=trxn_type_col, period=period, fillempty=fillempty)
+
+
+def _run_fund(task):
+    fund, trxn_df, IS_df, opening_df, opening_values, type_kwargs = task
+    start = time.perf_counter()
+    fst, coa, XR0_df, XR1_df = _worker['fst'], _worker['coa'], _worker['XR0_df'], _worker['XR1_df']
+    IS = InvestmentSchedule.from_df(IS_df) if IS_df is not None else InvestmentSchedule()
+    opening_df = opening_df if opening_df is not None else empty_balances()
+    tjem = TransactionJEM(trxn_df.reset_index(drop=True), XR0_df, XR1_df, fillempty=_worker['fillempty'], IS=IS)
+    ledger_df = tjem.concat_je_rows(tjem.map_batch(_worker['trxn_type_col'], **type_kwargs))
+    closing_df = close_balances(opening_df, ledger_df, coa)
+
+    inputs_df, unmapped = statement_inputs(opening_df, closing_df, XR1_df, fst, period=_worker['period'])
+    if opening_values is None: ## last period's SFP and rates, from the opening balances
+        opening_inputs, _ = statement_inputs(empty_balances(), opening_df, XR0_df, fst)
+        opening_inputs = opening_inputs[opening_inputs.index.str.startswith(stock_prefixes + ('XR_',))]
+        opening_values = fst.evaluate(opening_inputs).iloc[:, 0]
+    values_df = fst.evaluate(inputs_df, opening_values)
+    result = {'ledger': ledger_df, 'balances': closing_df, 'IS': IS.to_df(), 'values': values_df[_worker['period']],
+              **fst.statements(values_df), 'unmapped': unmapped, 'seconds': time.perf_counter() - start}
+    return fund, result
@@ -0,0 +1,99 @@
+## Parallel journal entry mapping ## 多进程分录映射
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import numpy as np
+import pandas as pd
+
+from InvestmentSchedule import InvestmentSchedule
+from TransactionJEM import TransactionJEM
+
+_worker = {} ## per worker process: the transaction frame, XR0_df/XR1_df and mapping arguments, handed over once by _init_worker
+
+
+def partition_transactions(df, n_partitions, linked=None):
+    """
+    Partition number of every row. All rows of one Security_code land in the same partition, because its Investment Schedule
+    position has to be replayed in order; rows without a security (fees, subscriptions, currency transfers) spread by Account_num
+    linked = {Security_code: Security_code it is partitioned with}, eg an option whose exercise takes up its underlying
+    Uses pandas' stable hashing, so the partitioning (and therefore the result) is the same on every run and every host
+    """
+    key = df['Security_code'] if 'Security_code' in df.columns else pd.Series(np.nan, index=df.index)
+    if linked:
+        key = key.map(lambda sec_code: linked.get(sec_code, sec_code))
+    if 'Account_num' in df.columns:
+        key = key.where(key.notna(), df['Account_num'])
+    key = key.where(key.notna(), pd.Series(np.arange(len(df)), index=df.index)) ## nothing to group on; spread by row
+    return (pd.util.hash_array(key.astype(str).to_numpy(dtype=object)) % n_partitions).astype(np.int64)
+
+
+def map_parallel(tjem, trxn_type_col, n_workers=None, n_partitions=None, **type_kwargs):
+    """
+    Use as:
+        je_df = map_parallel(tjem, 'Trxn_type', n_workers=32, curr_tf={'presentation_curr': 'HKD'})
+        transaction_df = tjem.concat_je_rows(je_df)
+
+    Same result as tjem.map_batch(trxn_type_col, **type_kwargs), including the updates to tjem.IS, computed by a process pool
+    over partitions of tjem.df (see partition_transactions); partition results are merged back in original idx order
+    n_partitions defaults to 4 per worker so a few large securities do not leave the other workers idle
+    """
+    if type(tjem.IS) is not InvestmentSchedule: ## workers rebuild plain schedules from IS.to_df(); lots and the like would be lost
+        raise TypeError(f"map_parallel works on an InvestmentSchedule, not {type(tjem.IS).__name__}; use map_batch")
+    n_workers = n_workers or os.cpu_count()
+    n_partitions = n_partitions or 4 * n_workers
+    df = tjem.df
+    trxn_types = df[trxn_type_col].to_numpy()
+    linked = None
+    if 'FAOL_close' in type_kwargs and 'avgbp_t0' not in type_kwargs['FAOL_close']: ## equity settled calls open their underlying
+        FAOL_idxs = np.flatnonzero(trxn_types == 'FAOL_close')
+        terms = tjem._FAOL_terms(FAOL_idxs, **type_kwargs['FAOL_close'])
+        acquires = terms['exe'] & ~terms['cs'] & terms['call']
+        linked = dict(zip(df['Security_code'].to_numpy()[FAOL_idxs[acquires]], terms['underlying'][acquires]))
+    partitions = partition_transactions(df, n_partitions, linked)
+    IS_df = tjem.IS.to_df(include_closed=True)
+    IS_partitions = partition_transactions(IS_df, n_partitions, linked) if len(IS_df) else np.array([], dtype=np.int64)
+
+    tasks = []
+    for partition in np.unique(partitions):
+        idxs = np.flatnonzero(partitions == partition)
+        part_kwargs = {}
+        for trxn_type, kwargs in type_kwargs.items(): ## per-row arrays follow their rows into the partition
+            type_idxs = np.flatnonzero(trxn_types == trxn_type)
+            in_part = np.isin(type_idxs, idxs)
+            part_kwargs[trxn_type] = {name: (np.asarray(value)[in_part] if np.ndim(value) and len(value) == len(type_idxs) else value)
+                                      for name, value in kwargs.items()}
+        tasks.append((idxs, IS_df[IS_partitions == partition], part_kwargs))
+    tasks.sort(key=lambda task: -len(task[0])) ## largest first
+
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                             initargs=(df, tjem.XR0_df, tjem.XR1_df, tjem.fillempty, trxn_type_col)) as pool:
+        results = list(pool.map(_map_partition, tasks))
+
+    je_frames = [je_df for je_df, _ in results if len(je_df.columns)]
+    if not je_frames:
+        je_df = pd.DataFrame(index=pd.Index([], dtype=np.int64))
+    else:
+        je_df = pd.concat(je_frames, axis=0, sort=False)
+        je_df = je_df[[col for col in TransactionJEM.je_col_names if col in je_df.columns]].sort_index().astype(object)
+
+    ## positions new to the Investment Schedule are added in the order the serial run would first have touched them
+    IS_t1_df = pd.concat([IS_part_df for _, IS_part_df in results], axis=0, ignore_index=True)
+    stream_idxs = np.flatnonzero(pd.Series(trxn_types).isin(TransactionJEM.is_open_types + ['FAE_close', 'FAOL_close']).to_numpy())
+    first_seen = (df.iloc[stream_idxs][['Security_code', 'Trxn_value_curr']].drop_duplicates()
+                  .set_axis(['Security_code', 'Currency'], axis=1).reset_index(drop=True).reset_index(names='first_seen'))
+    IS_t1_df = IS_t1_df.merge(first_seen, on=['Security_code', 'Currency'], how='left').sort_values('first_seen', kind='stable')
+    tjem.IS.update(IS_t1_df)
+    return je_df
+
+
+def _init_worker(df, XR0_df, XR1_df, fillempty, trxn_type_col):
+    _worker.update(df=df, XR0_df=XR0_df, XR1_df=XR1_df, fillempty=fillempty, trxn_type_col=trxn_type_col)
+
+
+def _map_partition(task):
+    idxs, IS_df, type_kwargs = task
+    tjem = TransactionJEM(_worker['df'].iloc[idxs].reset_index(drop=True), _worker['XR0_df'], _worker['XR1_df'],
+                          fillempty=_worker['fillempty'], IS=InvestmentSchedule.from_df(IS_df))
+    je_df = tjem.map_batch(_worker['trxn_type_col'], **type_kwargs)
+    je_df.index = idxs[je_df.index.to_numpy(dtype=np.int64)]
+    return je_df, tjem.IS.to_df(include_closed=True)
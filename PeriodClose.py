@@ -0,0 +1,182 @@
+## Incremental period close with checkpoints ## 增量期末结账与检查点
+import hashlib
+import json
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from ChartOfAccounts import ChartOfAccounts
+from InvestmentSchedule import InvestmentSchedule
+from TransactionJEM import TransactionJEM
+from TrialBalance import TrialBalance
+
+date_col = 'Settle_date'
+balance_cols = ['Account', 'Currency', 'Debit', 'Credit', 'Balance']
+
+
+class PeriodClose:
+    """
+    Closes the books period by period and keeps a checkpoint at every period end, so a new month only maps that month:
+        checkpoint_dir/manifest.json          period: content hash of its inputs (transactions, rates, mapping arguments), in period order
+        checkpoint_dir/close-<period>.pkl     closing balances to date (posting accounts, per currency),
+                                              the Investment Schedule, and the period-end rates (next period's XR0_df)
+    run() hashes every period of the transaction history it is given and compares with the manifest: periods with the
+    same hash are taken from their checkpoints, and mapping restarts at the earliest period that is new or was edited
+    after it was closed (late or back-dated entries, restated rates), carrying on through every later period
+
+    Use as:
+        close = PeriodClose('closes', rates={'2024-01': XR_jan_df, '2024-02': XR_feb_df, ...}, opening_rates=XR_dec_df,
+                            type_kwargs={'curr_tf': {'presentation_curr': 'HKD'}})
+        result = close.run(trxn_df) ## the whole history; only new or changed periods are mapped
+        result['periods_run'], result['balances'], result['IS']
+    rates = period-end exchange rates per period (XR1_df of that period); opening_rates = XR0_df of the first period
+    type_kwargs as for map_batch; per-row arrays line up with that type's rows in the whole of trxn_df, and each period
+    is mapped with its own rows' share of them
+    store = optional LedgerStore; the mapped ledger of every period run replaces that period in the store (monthly periods)
+    """
+    def __init__(self, checkpoint_dir, rates, opening_rates, freq='M', trxn_type_col='Trxn_type', type_kwargs=None,
+                 coa=None, store=None, fund='default', fillempty=''):
+        self.checkpoint_dir = checkpoint_dir
+        self.freq = freq
+        self.rates = {str(pd.Period(period, freq=freq)): XR_df for period, XR_df in rates.items()}
+        self.opening_rates = opening_rates
+        self.trxn_type_col = trxn_type_col
+        self.type_kwargs = type_kwargs or {}
+        self.coa = coa if coa is not None else ChartOfAccounts.from_template()
+        self.store = store
+        self.fund = fund
+        self.fillempty = fillempty
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def _manifest_path(self):
+        return os.path.join(self.checkpoint_dir, 'manifest.json')
+
+    def _checkpoint_path(self, period):
+        return os.path.join(self.checkpoint_dir, f'close-{period}.pkl')
+
+    def manifest(self):
+        if not os.path.exists(self._manifest_path()):
+            return {}
+        with open(self._manifest_path()) as f:
+            return json.load(f)
+
+    def checkpoint(self, period):
+        """{'period', 'digest', 'balances', 'IS', 'rates'} as saved at the end of period"""
+        with open(self._checkpoint_path(str(pd.Period(period, freq=self.freq))), 'rb') as f:
+            return pickle.load(f)
+
+    def period_digests(self, trxn_df):
+        """
+        period: SHA-256 over the content hashes of its rows in order (every column except the DR/CR journal entry columns),
+        its period-end rates (and the opening rates, for the first period) and its share of type_kwargs, so any edited,
+        added, removed or reordered row, or restated rate, changes the digest of its period and only that period
+        """
+        periods = self._periods(trxn_df)
+        input_cols = [col for col in trxn_df.columns if col not in TransactionJEM.je_col_names]
+        row_hashes = pd.util.hash_pandas_object(trxn_df[input_cols], index=False).to_numpy()
+        digests = {}
+        for n, period in enumerate(sorted(pd.unique(periods))):
+            digest = hashlib.sha256(row_hashes[periods == period].tobytes())
+            digest.update(_rates_hash(self.rates.get(period)))
+            if n == 0:
+                digest.update(_rates_hash(self.opening_rates))
+            digest.update(pickle.dumps(self._period_kwargs(trxn_df, periods, period), protocol=4))
+            digests[period] = digest.hexdigest()
+        return digests
+
+    def _period_kwargs(self, trxn_df, row_periods, period):
+        ## type_kwargs for one period's rows: per-row arrays cut down to the rows of their type in that period
+        trxn_types = trxn_df[self.trxn_type_col].to_numpy()
+        period_kwargs = {}
+        for trxn_type, kwargs in self.type_kwargs.items():
+            type_periods = row_periods[trxn_types == trxn_type]
+            period_kwargs[trxn_type] = {}
+            for name, value in kwargs.items():
+                if np.ndim(value) and not isinstance(value, dict):
+                    if len(value) != len(type_periods):
+                        raise ValueError(f"type_kwargs['{trxn_type}']['{name}'] has {len(value)} values for {len(type_periods)} "
+                                         f"{trxn_type} rows; per-row arguments must line up with that type's rows in trxn_df")
+                    value = np.asarray(value)[type_periods == period]
+                period_kwargs[trxn_type][name] = value
+        return period_kwargs
+
+    def _periods(self, trxn_df):
+        return pd.PeriodIndex(pd.to_datetime(trxn_df[date_col]), freq=self.freq).astype(str).to_numpy()
+
+    def run(self, trxn_df):
+        """
+        maps the new and changed periods of trxn_df (the whole transaction history, in Settle_date order) from their
+        last good checkpoint; returns {'periods_run', 'reused', 'balances', 'IS', 'rates', 'ledgers'} for the last period,
+        ledgers being the mapped ledger of every period run
+        """
+        digests = self.period_digests(trxn_df)
+        manifest = self.manifest()
+        periods = sorted(set(digests) | set(manifest))
+        start = next((i for i, period in enumerate(periods) if digests.get(period) != manifest.get(period)), len(periods))
+        reused = [period for period in periods[:start] if period in digests]
+
+        if start > 0:
+            state = self.checkpoint(periods[start - 1])
+            balances_df, IS, XR0_df = state['balances'], InvestmentSchedule.from_df(state['IS']), state['rates']
+        else:
+            balances_df, IS, XR0_df = empty_balances(), InvestmentSchedule(), self.opening_rates
+        manifest = {period: manifest[period] for period in periods[:start] if period in manifest}
+
+        row_periods = self._periods(trxn_df)
+        periods_run, ledgers = [], {}
+        for period in periods[start:]:
+            if period not in digests: ## no transactions left in this period; its old checkpoint no longer applies
+                if os.path.exists(self._checkpoint_path(period)):
+                    os.remove(self._checkpoint_path(period))
+                if self.store is not None:
+                    self.store.drop(self.fund, [period])
+                continue
+            if period not in self.rates:
+                raise KeyError(f"No period-end exchange rates for {period}")
+            XR1_df = self.rates[period]
+            period_df = trxn_df[row_periods == period].reset_index(drop=True)
+            tjem = TransactionJEM(period_df, XR0_df, XR1_df, fillempty=self.fillempty, IS=IS)
+            ledger_df = tjem.concat_je_rows(tjem.map_batch(self.trxn_type_col, **self._period_kwargs(trxn_df, row_periods, period)))
+            balances_df = close_balances(balances_df, ledger_df, self.coa)
+            state = {'period': period, 'digest': digests[period], 'balances': balances_df,
+                     'IS': IS.to_df(include_closed=True), 'rates': XR1_df}
+            with open(self._checkpoint_path(period), 'wb') as f:
+                pickle.dump(state, f)
+            manifest[period] = digests[period]
+            with open(self._manifest_path(), 'w') as f: ## after every period, so an interrupted run resumes from there
+                json.dump(manifest, f, indent=1)
+            if self.store is not None:
+                self.store.drop(self.fund, [period])
+                self.store.append(ledger_df, fund=self.fund)
+            XR0_df = XR1_df
+            periods_run.append(period)
+            ledgers[period] = ledger_df
+        with open(self._manifest_path(), 'w') as f:
+            json.dump(manifest, f, indent=1)
+        return {'periods_run': periods_run, 'reused': reused, 'balances': balances_df, 'IS': IS.to_df(),
+                'rates': XR0_df, 'ledgers': ledgers}
+
+
+def _rates_hash(XR_df):
+    if XR_df is None:
+        return b''
+    return pd.util.hash_pandas_object(XR_df).to_numpy().tobytes() + repr(list(XR_df.columns)).encode()
+
+
+def empty_balances():
+    """balances with nothing in them, Debit/Credit/Balance as floats"""
+    return pd.DataFrame({'Account': pd.Series(dtype=object), 'Currency': pd.Series(dtype=object),
+                         'Debit': pd.Series(dtype=float), 'Credit': pd.Series(dtype=float), 'Balance': pd.Series(dtype=float)})
+
+
+def close_balances(opening_df, ledger_df, coa=None):
+    """closing balances = opening + the ledger's movement, per posting account and currency (Account, Currency, Debit, Credit, Balance)"""
+    movement_df = TrialBalance.from_ledger(ledger_df, coa=coa).trial_balance(cumulative=False)
+    movement_df = movement_df.groupby(['Account', 'Currency'], sort=False, dropna=False)[['Debit', 'Credit']].sum().reset_index()
+    closing_df = pd.concat([opening_df[['Account', 'Currency', 'Debit', 'Credit']], movement_df], ignore_index=True)
+    closing_df = closing_df.groupby(['Account', 'Currency'], sort=True, dropna=False)[['Debit', 'Credit']].sum().reset_index()
+    closing_df = closing_df.astype({'Debit': float, 'Credit': float}) ## float even when opening_df is an untyped empty frame
+    closing_df['Balance'] = closing_df['Debit'] - closing_df['Credit']
+    return closing_df[balance_cols]
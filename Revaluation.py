@@ -0,0 +1,108 @@
+## Mark-to-market revaluation of open positions ## 持仓按公允价值重估
+import numpy as np
+import pandas as pd
+
+from FXRates import FXRates
+
+
+def revalue(IS, prices, XR0_df, XR1_df, presentation_curr, date=None, price_currs=None, asset_classes=None,
+            net_assets_t0=None, errors='raise', update=True):
+    """
+    Use as:
+        reval_df, naxr = revalue(tjem.IS, prices, XR0_df, XR1_df, 'HKD', date='2024-02-29') ## prices: Series by Security_code
+        ledger_df = pd.concat([ledger_df, reval_df], ignore_index=True)
+
+    FVOCI revaluation of every open position in the Investment Schedule IS, as whole arrays:
+        CUM_UGLΔFV_t1 = Unitsheld * price - BV; ΔFV = CUM_UGLΔFV_t1 - CUM_UGLΔFV_t0
+        gain: DR SFP_A_FA_<class>_<curr>_CUM_UGLΔFV_<sec> / CR SCI_OCI_UGLFA_ΔFV_<curr>_<sec>; a loss the other way round
+    (the README's month 1 and 2 entries). IS's CUM_UGLΔFV is updated to the new values unless update=False
+
+    reval_df = one row per position with a non-zero ΔFV, in the transaction + DR/CR layout (Trxn_type 'reval'),
+               so it appends to a concat_je_rows ledger, TrialBalance or LedgerStore
+    naxr = Series of the NAV translation adjustments SCNAV_ΔNAXR_<curr>2<presentation curr> = (XR_t1 - XR_t0) * NA_t0
+           per foreign currency, stated in the presentation currency (FSTemplate input accounts)
+
+    prices = Series indexed by Security_code, in the position's currency unless price_currs (Series by Security_code)
+             says otherwise, in which case it is translated at XR1; options are priced per contract (the premium per
+             underlying share times the option multiplier), as their Unitsheld are contracts
+    asset_classes = Series/dict Security_code: 'E', 'D', 'O' or 'FI', picking the SFP_A_FA_<class> account; defaults to the
+                    position's Asset_class in IS ('O' for options opened by FAOL_open, whose UGL FAOL_close closes out; else 'E')
+    net_assets_t0 = net assets per currency at the end of last period, eg net_assets_by_currency(closing balances);
+                    defaults to the Investment Schedule positions alone (BV + CUM_UGLΔFV_t0)
+    errors = 'raise' if an open position has no price, 'ignore' to leave it unrevalued
+    """
+    n = len(IS)
+    sec_codes = np.array([key[0] for key in IS.keys], dtype=object)
+    currs = np.array([key[1] for key in IS.keys], dtype=object)
+    unitsheld, bv, cum_ugl_t0 = IS.unitsheld[:n], IS.bv[:n], IS.cum_ugl[:n].copy()
+    is_open = unitsheld != 0
+
+    price = pd.Series(prices, dtype=float).reindex(sec_codes).to_numpy(copy=True)
+    if price_currs is not None:
+        price_curr = pd.Series(price_currs, dtype=object).reindex(sec_codes).to_numpy(dtype=object)
+        foreign = is_open & ~pd.isna(price_curr) & (price_curr != currs)
+        if foreign.any():
+            FX1 = FXRates.from_frame(XR1_df, presentation_curr)
+            price[foreign] = price[foreign] * FX1.rates(None, currs[foreign], price_curr[foreign])
+    unpriced = is_open & np.isnan(price)
+    if unpriced.any() and errors == 'raise':
+        raise KeyError(f"No price for open positions: {sorted(set(sec_codes[unpriced]))[:10]}")
+    revalued = is_open & ~unpriced
+    cum_ugl_t1 = np.where(revalued, unitsheld * np.nan_to_num(price) - bv, cum_ugl_t0)
+    delta = np.round(cum_ugl_t1 - cum_ugl_t0, 10)
+    posted = np.flatnonzero(revalued & (delta != 0))
+
+    classes = np.array(IS.asset_classes, dtype=object)[posted]
+    if asset_classes is not None:
+        given = pd.Series(asset_classes, dtype=object).reindex(sec_codes[posted]).to_numpy(dtype=object)
+        classes = np.where(pd.isna(given), classes, given)
+    adjunct = np.array([f'SFP_A_FA_{cls}_{curr}_CUM_UGLΔFV_{sec}' for cls, curr, sec in zip(classes, currs[posted], sec_codes[posted])], dtype=object)
+    oci = np.array([f'SCI_OCI_UGLFA_ΔFV_{curr}_{sec}' for curr, sec in zip(currs[posted], sec_codes[posted])], dtype=object)
+    gain = delta[posted] > 0
+    amount = np.abs(delta[posted])
+    reval_df = pd.DataFrame({'Settle_date': pd.Timestamp(date) if date is not None else pd.NaT,
+                             'Description': 'Revaluation to fair value 公允价值重估',
+                             'Security_code': sec_codes[posted],
+                             'Trxn_value': amount,
+                             'Trxn_value_curr': currs[posted],
+                             'Trxn_quantity': unitsheld[posted],
+                             'Trxn_price': price[posted],
+                             'Trxn_price_curr': currs[posted],
+                             'Trxn_type': 'reval',
+                             'DR_account_0': np.where(gain, adjunct, oci),
+                             'DR_value_0': amount,
+                             'CR_account_0': np.where(gain, oci, adjunct),
+                             'CR_value_0': amount,
+                             })
+
+    if net_assets_t0 is None: ## positions only, valued as at last period end
+        net_assets_t0 = pd.Series(bv + cum_ugl_t0, index=currs).groupby(level=0).sum()
+    naxr = naxr_adjustments(net_assets_t0, XR0_df, XR1_df, presentation_curr)
+
+    if update:
+        IS.cum_ugl[:n] = cum_ugl_t1
+    return reval_df, naxr
+
+
+def naxr_adjustments(net_assets_t0, XR0_df, XR1_df, presentation_curr):
+    """
+    SCNAV_ΔNAXR_<curr>2<presentation curr> = (XR_t1 - XR_t0) * NA_t0 for every foreign currency in net_assets_t0
+    (Series currency: net assets in that currency), eg (7.3 - 7.1 HKD/USD) * 1650 USD = 330 HKD
+    """
+    net_assets_t0 = pd.Series(net_assets_t0, dtype=float)
+    net_assets_t0 = net_assets_t0[net_assets_t0.index != presentation_curr]
+    currs = net_assets_t0.index.to_numpy(dtype=object)
+    FX0, FX1 = FXRates.from_frame(XR0_df, presentation_curr), FXRates.from_frame(XR1_df, presentation_curr)
+    delta_xr = FX1.rates(None, presentation_curr, currs) - FX0.rates(None, presentation_curr, currs)
+    return pd.Series(delta_xr * net_assets_t0.to_numpy(), index=[f'SCNAV_ΔNAXR_{curr}2{presentation_curr}' for curr in currs], dtype=float)
+
+
+def net_assets_by_currency(balances_df):
+    """
+    net assets per currency from closing balances (Account, Currency, Balance with DR positive, eg PeriodClose's or
+    TrialBalance.trial_balance): every SFP asset minus every SFP liability, plus the SCF accounts cash is booked through
+    (as BalanceIndex.net_assets), posting accounts only; share counts (*_S) left out
+    """
+    accounts = balances_df['Account'].astype(str)
+    net = accounts.str.startswith(('SFP_', 'SCF_')) & ~accounts.str.endswith('_S')
+    return balances_df[net].groupby('Currency')['Balance'].sum()
@@ -0,0 +1,131 @@
+## Concurrent statement loading ## 多机构对账单并发读取
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import io
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+## input spreadsheet columns (README template, minus the DR/CR journal entry columns)
+template_cols = ['Init_date', 'Settle_date', 'Institution', 'Account_name', 'Account_num', 'Description', 'Asset_type',
+                 'Security_code', 'Security_name', 'Trxn_value', 'Trxn_value_curr', 'Trxn_quantity', 'Trxn_price', 'Trxn_price_curr']
+date_cols = ['Init_date', 'Settle_date']
+number_cols = ['Trxn_value', 'Trxn_quantity', 'Trxn_price']
+account_fields = ['Institution', 'Account_name', 'Account_num']
+## kept after the template columns when a source has them (mapping inputs such as Trxn_type, curr_tf's Trxn_quantity_unit)
+extra_cols = ['Trxn_type', 'Trxn_quantity_unit']
+excel_exts = ['.xlsx', '.xlsm', '.xls']
+
+
+def load_statements(sources, max_workers=None, max_pending=8, progress=None, errors='raise'):
+    """
+    Use as:
+        trxn_df, report = load_statements([
+            {'path': 'exports/ibkr_2024-03.csv', 'Institution': 'Interactive Brokers', 'Account_num': 'U1234567'},
+            {'path': 'exports/招商银行_2024-03.xlsx', 'Institution': '招商银行', 'rename': {'交易日期': 'Settle_date', '摘要': 'Description'}},
+            'exports/hsbc_2024-03.csv', ## already in the template layout
+        ], progress=print)
+        tjem = TransactionJEM(trxn_df, XR0_df, XR1_df)
+
+    Reads every source concurrently and returns (trxn_df, report):
+        trxn_df = all sources in the template columns (plus extra_cols where present), in Settle_date order; rows of the same
+                  date keep source order, then file order
+        report = one row per source: path, Institution, status, rows, bytes, read_s, parse_s, error
+    File reads run on the asyncio loop (in threads); parsing (csv or spreadsheet) and normalize_statement run in a process
+    pool of max_workers. At most max_pending sources are read or parsed at once, so memory holds max_pending raw files,
+    not all of them
+    progress(line) is called with a short status line as each source finishes (eg progress=print)
+    errors = 'raise' stops at the first bad source; 'skip' leaves it out and records the error in the report
+    """
+    return asyncio.run(load_statements_async(sources, max_workers, max_pending, progress, errors))
+
+
+async def load_statements_async(sources, max_workers=None, max_pending=8, progress=None, errors='raise'):
+    """load_statements for callers already inside an event loop"""
+    sources = [source if isinstance(source, dict) else {'path': source} for source in sources]
+    semaphore = asyncio.Semaphore(max_pending)
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        results = await asyncio.gather(*[_load_source(source, pool, semaphore, progress, errors) for source in sources])
+    frames = [frame for frame, _ in results if frame is not None]
+    report = pd.DataFrame([stats for _, stats in results])
+    if not frames:
+        return pd.DataFrame(columns=template_cols), report
+    trxn_df = pd.concat(frames, ignore_index=True, sort=False)
+    trxn_df = trxn_df.sort_values('Settle_date', kind='stable', na_position='last').reset_index(drop=True)
+    return trxn_df, report
+
+
+async def _load_source(source, pool, semaphore, progress, errors):
+    path = source['path']
+    stats = {'path': path, 'Institution': source.get('Institution'), 'status': 'ok', 'rows': 0, 'bytes': 0,
+             'read_s': 0.0, 'parse_s': 0.0, 'error': None}
+    async with semaphore:
+        try:
+            start = time.perf_counter()
+            data = await asyncio.to_thread(_read_bytes, path)
+            stats['bytes'], stats['read_s'] = len(data), time.perf_counter() - start
+            start = time.perf_counter()
+            trxn_df = await asyncio.get_running_loop().run_in_executor(pool, _parse_source, data, source)
+            del data
+            stats['rows'], stats['parse_s'] = len(trxn_df), time.perf_counter() - start
+        except Exception as error:
+            if errors == 'raise':
+                raise
+            trxn_df = None
+            stats['status'], stats['error'] = 'error', f'{type(error).__name__}: {error}'
+    if progress is not None:
+        progress(f"{path}: {stats['status']}, {stats['rows']:,} rows, {stats['bytes'] / 2**20:.1f} MB, "
+                 f"read {stats['read_s']:.2f} s, parse {stats['parse_s']:.2f} s" + (f" ({stats['error']})" if stats['error'] else ''))
+    return trxn_df, stats
+
+
+def _read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _parse_source(data, source): ## runs in a worker process: parsing and normalizing are CPU bound
+    read_kwargs = source.get('read_kwargs', {})
+    if os.path.splitext(source['path'])[1].lower() in excel_exts:
+        raw_df = pd.read_excel(io.BytesIO(data), sheet_name=source.get('sheet_name', 0), **read_kwargs)
+    else:
+        raw_df = pd.read_csv(io.BytesIO(data), **{'encoding': 'utf-8-sig', **read_kwargs}) ## utf-8-sig drops the BOM of Excel-saved csv
+    return normalize_statement(raw_df, source)
+
+
+def normalize_statement(raw_df, source=None):
+    """
+    one institution's export -> the template columns:
+        source['rename'] maps its own headers to template names; source['Institution'/'Account_name'/'Account_num'] fill
+        those columns where the export does not have them (or leaves them empty)
+        dates are parsed (source['date_format'], source['dayfirst']), amounts read as numbers with thousands separators
+        and currency symbols stripped, text columns trimmed; rows without a Settle_date (totals, blank lines) are dropped
+    sorted by Settle_date, keeping file order within a date
+    """
+    source = source or {}
+    trxn_df = raw_df.rename(columns=lambda col: str(col).strip()).rename(columns=source.get('rename', {}))
+    trxn_df = trxn_df.loc[:, ~trxn_df.columns.duplicated()]
+    for field in account_fields:
+        if source.get(field) is not None:
+            if field not in trxn_df.columns:
+                trxn_df[field] = source[field]
+            else:
+                trxn_df[field] = trxn_df[field].where(trxn_df[field].notna() & (trxn_df[field].astype(str).str.strip() != ''), source[field])
+    trxn_df = trxn_df.reindex(columns=template_cols + [col for col in extra_cols if col in trxn_df.columns])
+
+    for col in date_cols:
+        trxn_df[col] = pd.to_datetime(trxn_df[col], format=source.get('date_format'), dayfirst=source.get('dayfirst', False), errors='coerce')
+    for col in number_cols:
+        if not pd.api.types.is_numeric_dtype(trxn_df[col]):
+            text = trxn_df[col].astype(str).str.replace(r'HK\$|US\$|[,\s$¥￥€£]', '', regex=True)
+            text = text.str.replace(r'^\((.*)\)$', r'-\1', regex=True) ## (1,234.00) is a negative amount
+            trxn_df[col] = pd.to_numeric(text.replace({'': np.nan, 'nan': np.nan, 'None': np.nan}), errors='coerce')
+    for col in trxn_df.columns.difference(date_cols + number_cols):
+        if trxn_df[col].dtype == object or pd.api.types.is_string_dtype(trxn_df[col]): ## stripped once per distinct value
+            codes, uniques = pd.factorize(trxn_df[col], use_na_sentinel=True)
+            stripped = np.array([value.strip() if isinstance(value, str) else value for value in uniques] + [np.nan], dtype=object)
+            trxn_df[col] = stripped[codes]
+    trxn_df = trxn_df[trxn_df['Settle_date'].notna()]
+    return trxn_df.sort_values('Settle_date', kind='stable').reset_index(drop=True)
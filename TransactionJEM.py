@@ -1,47 +1,29 @@
 ## Importing packages ## 导入相关模块，顺序有所调整
-from collections import Counter
-import datetime as dt
-from datetime import datetime, timedelta
-from dateutil.relativedelta import relativedelta
-from importlib import reload
-import itertools
-from itertools import combinations as combo_func
-import json
-import math
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
+## core mapping only needs NumPy/pandas; plotting and notebook display settings live in JEMDisplay (import it yourself)
+import contextlib
+
 import numpy as np
 import pandas as pd
-from pandas.tseries.offsets import WeekOfMonth
-import pickle
-import plotly.graph_objects as go
-import requests
-import scipy
-import statistics
-import time
-
-###########################################################################################
-##
-## plt中文显示不乱码
-plt.rcParams['font.sans-serif']=['SimHei']
-plt.rcParams['axes.unicode_minus'] = False
-
-pd.set_option('display.max_colwidth', 400)
-pd.set_option('display.max_columns', 50)
-pd.set_option('display.max_rows', 20)
+
+from FXRates import FXRates
+from InvestmentSchedule import InvestmentSchedule
+import Money
+
+_no_stage = contextlib.nullcontext()
 
 # class TransactionLedgerIntegration:
 # class TransactionLedgerMapping:
 
 class TransactionJEM:
-    def __init__(self, df, XR0_df, XR1_df, fillempty=''):
+    def __init__(self, df, XR0_df, XR1_df, fillempty='', IS=None):
         """
             🚀 include variables for exchange rates?
             🚀 use iterrows? for i,row in df.iterrows(): i becomes dfi row becomes dfrow
             🚀 review if, elif logic of the selling FAE function, can use HM's code as a reference
-            ⚠️ must import avg book price of each security for when calculating g/l during sell-out
             ⚠️ using average cost method to account for average book price per share; LIFO/FIFO too complex at this stage
-            ⚠️ edit open FAE function to include IS changes (avgbp, unitsheld)
+            IS = InvestmentSchedule carried over from last period (avgbp, unitsheld, BV, CUM_UGLΔFV per security); 
+            opens and closes update it as they are mapped, so closes no longer need the t0 inputs passed in
+            XR0_df/XR1_df are also held as dense FXRates (FX0/FX1); pairs missing from them are triangulated through the presentation currency
         """
         ## df implies the dataframe of transactions, hence 'TransactionLedgerMapping'
         self.df = df
@@ -49,26 +31,96 @@ class TransactionJEM:
         self.fillempty = fillempty ## empty string '' or None
         self.XR0_df = XR0_df
         self.XR1_df = XR1_df
+        self.FX0 = FXRates.from_frame(XR0_df)
+        self.FX1 = FXRates.from_frame(XR1_df)
+        self.IS = IS if IS is not None else InvestmentSchedule()
+        self.profiler = None ## JEMProfiler while profiling (see profile()), else None
         
-    def concat_je_rows(*je_rows): ## variable-length arguments, *args 
+    def _row(self, idx): ## one transaction; its own method so a profiler can time row access
+        return self.df.iloc[idx]
+
+    def _stage(self, name): ## timed pipeline stage when profiling, else a no-op context
+        return self.profiler.stage(name) if self.profiler is not None else _no_stage
+
+    def profile(self, memory=False, label=None):
+        """
+        Use as:
+            with tjem.profile() as prof:
+                je_df = tjem.map_batch('Trxn_type', curr_tf={'presentation_curr': 'HKD'})
+                transaction_df = tjem.concat_je_rows(je_df)
+            prof.report() ## or prof.to_json('profile.json'), to track across runs
+        opt-in instrumentation of this instance; see JEMProfiler
+        """
+        from JEMProfiler import JEMProfiler
+        return JEMProfiler(self, memory=memory, label=label)
+
+    def concat_je_rows(self, *je_rows, minor_units=False): ## variable-length arguments, *args 
         """
         Use as: 
             df_combined = concat_je_rows(df1, df2, df3, df4, ...)
                 or
             df_list = [df1, df2, df3]
             df_combined = concat_je_rows(*df_list)
+
+        This is the one place journal entry values are rounded: each value to the minor unit (eg cents) of the currency in its
+        account name (Trxn_value_curr if the account has none), column at a time. Entries in one currency then balance to the
+        minor unit: the realized g/l leg (else the largest leg), which the mappers derive from the others, is re-derived as
+        the integer difference of the others' rounded amounts (see _balance_minor)
+        minor_units=True returns the values as integer minor units (Int64) instead of rounded floats, eg for exact DR == CR checks;
+        Money.from_minor converts them back
         """
-        merged_debits_credits = pd.concat(je_rows, axis=0, sort=False)
+        with self._stage('concat'):
+            merged_debits_credits = pd.concat(je_rows, axis=0, sort=False)
         value_cols = [col for col in merged_debits_credits.columns if 'value' in col]
-        merged_debits_credits[value_cols] = merged_debits_credits[value_cols].applymap(
-            lambda x: float(f"{x:.2f}") if isinstance(x, (int, float)) else x
-        )
-        merged_debits_credits = merged_debits_credits.fillna(self.fillempty)
-        transaction_df = pd.concat([self.df, merged_debits_credits], axis=1)
+        with self._stage('rounding'):
+            trxn_currs = (self.df['Trxn_value_curr'].reindex(merged_debits_credits.index).to_numpy(dtype=object)
+                          if 'Trxn_value_curr' in self.df.columns else None)
+            minors, currs, places = {}, {}, {}
+            for value_col in value_cols:
+                account_col = value_col.replace('value', 'account')
+                currs[value_col] = (Money.account_currencies(merged_debits_credits[account_col], default=trxn_currs)
+                                    if account_col in merged_debits_credits.columns else trxn_currs)
+                places[value_col] = Money.digits(currs[value_col])
+                minors[value_col] = Money.to_minor(merged_debits_credits[value_col], places=places[value_col])
+            minors = self._balance_minor(merged_debits_credits, minors, currs)
+            for value_col, minor in minors.items():
+                merged_debits_credits[value_col] = (pd.Series(minor, index=merged_debits_credits.index) if minor_units
+                                                    else Money.from_minor(minor, places=places[value_col]))
+        merged_debits_credits = merged_debits_credits.astype({col: object for col in value_cols}).fillna(self.fillempty)
+        with self._stage('concat'):
+            transaction_df = pd.concat([self.df, merged_debits_credits], axis=1)
         return transaction_df
     
+    def _balance_minor(self, je_df, minors, currs):
+        ## each leg is rounded on its own, so a single-currency entry can come out a minor unit or so unbalanced (eg BV and
+        ## proceeds each rounded, and their difference rounded again); the realized g/l leg (SCI_I_RGLFA_*), or the largest
+        ## leg of an entry without one (eg the underlying's BV of an equity settled call), takes the difference so DR == CR
+        ## exactly. Larger differences (over half a minor unit per leg) are not rounding, and are left for JEValidator to report
+        value_cols = list(minors)
+        if not value_cols or not len(je_df):
+            return minors
+        n = len(je_df)
+        sides = np.array([1 if value_col.startswith('DR') else -1 for value_col in value_cols])
+        minor = np.vstack([minors[value_col].to_numpy(dtype=np.int64, na_value=0) for value_col in value_cols])
+        posted = np.vstack([~minors[value_col].isna() for value_col in value_cols])
+        residual = (minor * sides[:, None]).sum(axis=0)
+        rows = np.flatnonzero((residual != 0) & (2 * np.abs(residual) <= posted.sum(axis=0)))
+        if not len(rows):
+            return minors
+        leg_currs = np.vstack([np.broadcast_to(np.asarray(currs[value_col], dtype=object), n)[rows] for value_col in value_cols])
+        first_curr = leg_currs[posted[:, rows].argmax(axis=0), np.arange(len(rows))]
+        single = pd.notna(first_curr) & ~(posted[:, rows] & (leg_currs != first_curr)).any(axis=0) ## every leg in one known currency
+        rows = rows[single]
+        rgl = np.vstack([je_df[value_col.replace('value', 'account')].to_numpy(dtype=object)[rows].astype(str)
+                         if value_col.replace('value', 'account') in je_df.columns else np.full(len(rows), '')
+                         for value_col in value_cols])
+        rgl = np.char.startswith(rgl.astype(str), 'SCI_I_RGLFA_') & posted[:, rows]
+        leg = np.where(rgl.any(axis=0), rgl.argmax(axis=0), np.where(posted[:, rows], minor[:, rows], -1).argmax(axis=0))
+        minor[leg, rows] -= sides[leg] * residual[rows]
+        return {value_col: pd.arrays.IntegerArray(minor[k], ~posted[k]) for k, value_col in enumerate(value_cols)}
+
     def func_div_cash_rcvd(self, idx): ## dividend cash received ## 股息现金存入
-        transaction = self.df.iloc[idx]
+        transaction = self._row(idx)
         trxn_val = transaction['Trxn_value']
         trxn_curr = transaction['Trxn_value_curr']
         je_dfrow = pd.DataFrame(index=[idx],
@@ -78,7 +130,7 @@ class TransactionJEM:
         return je_dfrow
         
     def func_int_cash_rcvd(self, idx): ## interest cash received ## 利息现金存入
-        transaction = self.df.iloc[idx]
+        transaction = self._row(idx)
         trxn_val = transaction['Trxn_value']
         trxn_curr = transaction['Trxn_value_curr']
         je_dfrow = pd.DataFrame(index=[idx],
@@ -88,7 +140,7 @@ class TransactionJEM:
         return je_dfrow
 
     def func_FAE_open(self, idx): ## open financial asset equity ## 建仓金融资产权益
-        transaction = self.df.iloc[idx]
+        transaction = self._row(idx)
         trxn_val = transaction['Trxn_value']
         trxn_curr = transaction['Trxn_value_curr']
         sec_code = transaction['Security_code']
@@ -98,20 +150,24 @@ class TransactionJEM:
                                 data=[[f'SFP_A_FA_E_{trxn_curr}_BV_{sec_code}', trxn_val, 
                                        f'SCF_OA_PPI_{trxn_curr}_{sec_code}',trxn_val]]
                                 )
+        self.IS.open(sec_code, trxn_curr, transaction['Trxn_quantity'], trxn_val, date=transaction.get('Settle_date'))
         return je_dfrow      
 
-    def func_FAE_close(self, idx, avgbp_t0, unitsheld_t0, SFP_A_FA_E_curr_CUM_UGLΔFV_t0): ## close financial asset equity ## 平仓金融资产权益
+    def func_FAE_close(self, idx, avgbp_t0=None, unitsheld_t0=None, SFP_A_FA_E_curr_CUM_UGLΔFV_t0=None): ## close financial asset equity ## 平仓金融资产权益
         ## avgbp_t0 = average book price (per share) from last period; this is also specific to the exact security
         ## unitsheld_t0 = number of units of security (shares) held on the books in the last period; this is also specific to the exact security
         ## SFP_A_FA_E_curr_CUM_UGLΔFV_t0 = cumulative unrealized gain or loss at fair value from last period (this is an adjunct asset account); this is also specific to the exact security
         ### we need to close this account out by the pro rata portion; positive value implies a DR balance and negative value implies a CR balance
-        ## the 3 inputs avgbp_t0, unitsheld_t0, SFP_A_FA_E_curr_CUM_UGLΔFV_t0 must be sourced from the previous period's Investment Schedule
+        ## the 3 inputs default to the position in self.IS, which is then relieved by this close; 
+        ## if passed in (eg from an external Investment Schedule) self.IS is left untouched
 
-        transaction = self.df.iloc[idx]
+        transaction = self._row(idx)
         trxn_val = transaction['Trxn_value']
         trxn_curr = transaction['Trxn_value_curr']
         sec_code = transaction['Security_code']
         trxn_quan = transaction['Trxn_quantity']
+        if avgbp_t0 is None and unitsheld_t0 is None and SFP_A_FA_E_curr_CUM_UGLΔFV_t0 is None:
+            avgbp_t0, unitsheld_t0, SFP_A_FA_E_curr_CUM_UGLΔFV_t0 = self.IS.close(sec_code, trxn_curr, trxn_quan)
         
         ugl_t0 = 0 ## unrealized g/l for period t0 (last period); 1 for gain DR, -1 for loss CR, 0 for breakeven
         if SFP_A_FA_E_curr_CUM_UGLΔFV_t0 > 0:
@@ -131,16 +187,16 @@ class TransactionJEM:
             je_dfrow_0 = pd.DataFrame(  index=[idx],
                                         columns=['DR_account_0', 'DR_value_0', 
                                                 'CR_account_0', 'CR_value_0'],
-                                        data=[[f'SCI_OCI_UGLFA_ΔFV_{trxn_curr}_{sec_code}', (trxn_quan / unitsheld_t0) * SFP_A_FA_E_curr_CUM_UGLΔFV_t0,
-                                            f'SFP_A_FA_E_{trxn_curr}_CUM_UGLΔFV_{sec_code}', (trxn_quan / unitsheld_t0) * SFP_A_FA_E_curr_CUM_UGLΔFV_t0]]
+                                        data=[[f'SCI_OCI_UGLFA_ΔFV_{trxn_curr}_{sec_code}', abs((trxn_quan / unitsheld_t0) * SFP_A_FA_E_curr_CUM_UGLΔFV_t0),
+                                            f'SFP_A_FA_E_{trxn_curr}_CUM_UGLΔFV_{sec_code}', abs((trxn_quan / unitsheld_t0) * SFP_A_FA_E_curr_CUM_UGLΔFV_t0)]]
                                       )
 
         elif ugl_t0 == -1: ## implies a CR balance, so we must have SFP_A_FA_E_curr_CUM_UGLΔFV on DR to close out the CR balance
             je_dfrow_0 = pd.DataFrame(  index=[idx],
                                         columns=['DR_account_0', 'DR_value_0', 
                                                 'CR_account_0', 'CR_value_0'],
-                                        data=[[f'SFP_A_FA_E_{trxn_curr}_CUM_UGLΔFV_{sec_code}', (trxn_quan / unitsheld_t0) * SFP_A_FA_E_curr_CUM_UGLΔFV_t0,
-                                                f'SCI_OCI_UGLFA_ΔFV_{trxn_curr}_{sec_code}', (trxn_quan / unitsheld_t0) * SFP_A_FA_E_curr_CUM_UGLΔFV_t0]]
+                                        data=[[f'SFP_A_FA_E_{trxn_curr}_CUM_UGLΔFV_{sec_code}', abs((trxn_quan / unitsheld_t0) * SFP_A_FA_E_curr_CUM_UGLΔFV_t0),
+                                                f'SCI_OCI_UGLFA_ΔFV_{trxn_curr}_{sec_code}', abs((trxn_quan / unitsheld_t0) * SFP_A_FA_E_curr_CUM_UGLΔFV_t0)]]
                                       )        
         ################
         ################
@@ -163,7 +219,7 @@ class TransactionJEM:
                                              'CR_account_2', 'CR_value_2',],
                                     data=[[f'SCF_OA_PSI_{trxn_curr}_{sec_code}', trxn_val, 
                                            f'SFP_A_FA_E_{trxn_curr}_BV_{sec_code}', (trxn_quan * avgbp_t0),
-                                            f'SCI_I_RGLFA_{trxn_curr}', (trxn_val - (trxn_quan * avgbp_t0)), 
+                                            f'SCI_I_RGLFA_{trxn_curr}', ((trxn_quan * avgbp_t0) - trxn_val), 
                                            self.fillempty, self.fillempty]]
                                     )
         else: ## rgl_t1 == 0; ## breakeven, so we do not need to record a realized gain/loss
@@ -174,11 +230,13 @@ class TransactionJEM:
                                            f'SFP_A_FA_E_{trxn_curr}_BV_{sec_code}', (trxn_quan * avgbp_t0)]]
                                     )
 
+        if ugl_t0 == 0: ## nothing to close out of the unrealized g/l account
+            return je_dfrow_1
         merged_je_rows = pd.concat([je_dfrow_0,je_dfrow_1],axis=1)
         return merged_je_rows
     
     def func_FAOL_open(self, idx):
-        transaction = self.df.iloc[idx]
+        transaction = self._row(idx)
         trxn_val = transaction['Trxn_value']
         trxn_curr = transaction['Trxn_value_curr']
         sec_code = transaction['Security_code']
@@ -187,239 +245,217 @@ class TransactionJEM:
         je_dfrow = pd.DataFrame(index=[idx],
                                 columns=['DR_account_0', 'DR_value_0', 
                                          'CR_account_0', 'CR_value_0'],
-                                data=[[f'SFP_A_FA_D_{transcurr}_BV_{sec_code}', transval, 
-                                       f'SCF_OA_PPI_{transcurr}_{sec_code}', transval]]
+                                data=[[f'SFP_A_FA_D_{trxn_curr}_BV_{sec_code}', trxn_val, 
+                                       f'SCF_OA_PPI_{trxn_curr}_{sec_code}', trxn_val]]
                                 )
+        self.IS.open(sec_code, trxn_curr, trxn_quan, trxn_val, date=transaction.get('Settle_date'), asset_class='O')
         return je_dfrow    
         
-def func_FAOL_close(self, idx, exp, ae, exe, cs, cp, 
-                    avgbp_t0, unitsheld_t0, SFP_A_FA_O_curr_CUM_UGLΔFV_t0, 
-                    underlying_sec_code, underlying_Price, underlying_K, option_multiplier):
-    '''
-    avgbp_t0: average book price for ONE CONTRACT (NOT SAME AS CONTRACT PRICE, because contract price does not include fees
-    and only corresponds to the price of one underlying share, whereas the BOOK PRICE of ONE CONTRACT includes fees and corresponds
-    to the price of 100 (option_multiplier) underlying shares, which is the contract size for most options)
-    '''
-    if not isinstance(cp, str):
-        raise TypeError(f"'cp' must be a string, got {type(cp).__name__}")
-    cp = cp.lower()  # Normalize
-    if cp in ['c', 'call','认购','购']:
-        cp = 'call'
-    elif cp in ['p', 'put','认沽','沽']:
-        cp = 'put'
-    else:
-        raise ValueError(f"Invalid cp value: {cp}")   
-    ##################################################``
-    if not isinstance(ae, str):
-        raise TypeError(f"'ae' must be a string, got {type(ae).__name__}")
-    ae = ae.lower() ## https://www.schwab.com/learn/story/options-expiration-definitions-checklist-more ## https://licai.cofool.com/ask/qa_1414653.html
-    if ae in ['a', 'american','美式','美']: ## Standard U.S. equity options (options on single-name stocks) are American-style. 
-        ae = 'american' ## 属于美式期权的品种有橡胶期权、铝期权、锌期权、豆粕期权、玉米期权、铁矿石期权、石油气期权、聚丙烯期权、聚氯乙烯期权、聚乙烯期权、白糖期权、棉花期权、PTA期权、甲醇期权、菜籽粕期权和动力煤期权。
-    elif ae in ['e', 'european','euro','欧式','欧']: ## Most options on stock indexes, such as the Nasdaq-100® (NDX), S&P 500® (SPX), and Russell 2000® (RUT), are European-style.
-        ae = 'european' ## 欧式期权中包括的就是中金所股指期货期权为欧式，50ETF期权、沪市300ETF期权、深市300ETF期权、沪深300股指期权、黄金期权、铜期权
-    else:
-        raise ValueError(f"Invalid ae value: {ae}")    
-    ##################################################
-    if not isinstance(cs, bool): ## cash settlement; standard equity options are not cash-settled——actual shares are transferred in an exercise/assignment. 
-        ## Options on broad-based indexes, however, are cash-settled in an amount equal to the difference between the settlement price of the index and the strike price of the option times the contract multiplier.
-        raise TypeError(f"'exp' must be a boolean, got {type(cs).__name__}")
-    ##################################################
-    if not isinstance(exp, bool):
-        raise TypeError(f"'exp' must be a boolean, got {type(exp).__name__}")
-    ##################################################
-    if not isinstance(exe, bool):
-        raise TypeError(f"'exp' must be a boolean, got {type(exe).__name__}")
-    ##################################################
-    ##################################################
-    transaction = self.df.iloc[idx]
-    trxn_val = transaction['Trxn_value']
-    trxn_curr = transaction['Trxn_value_curr']
-    sec_code = transaction['Security_code']
-    trxn_quan = transaction['Trxn_quantity']
-
-    ugl_t0 = 0 ## unrealized g/l for period t0 (last period); 1 for gain DR, -1 for loss CR, 0 for breakeven
-    if SFP_A_FA_O_curr_CUM_UGLΔFV_t0 > 0:
-        ugl_t0 = 1 
-    elif SFP_A_FA_O_curr_CUM_UGLΔFV_t0 < 0:
-        ugl_t0 = -1
-
-    if not exp:
-        if ae == 'american':
-            if exe:
-                if cs: ## cash settlement; similar to func_close_FAE() but without the need for a new long equity position
-                    pass
-                else: ## cs == 0; equity settlement; we actually get stock 
-                    pass
-            else: ## exe == 0; long option position closed but due to neither expiration nor execution; similar to closing of a long equity position
+    def func_FAOL_close(self, idx, exp, ae, exe, cs, cp, 
+                        avgbp_t0=None, unitsheld_t0=None, SFP_A_FA_O_curr_CUM_UGLΔFV_t0=None, 
+                        underlying_sec_code=None, underlying_Price=None, underlying_K=None, option_multiplier=None):
+        '''
+        avgbp_t0: average book price for ONE CONTRACT (NOT SAME AS CONTRACT PRICE, because contract price does not include fees
+        and only corresponds to the price of one underlying share, whereas the BOOK PRICE of ONE CONTRACT includes fees and corresponds
+        to the price of 100 (option_multiplier) underlying shares, which is the contract size for most options)
+        avgbp_t0, unitsheld_t0, SFP_A_FA_O_curr_CUM_UGLΔFV_t0 default to the contract position in self.IS (as in func_FAE_close)
+        '''
+        if not isinstance(cp, str):
+            raise TypeError(f"'cp' must be a string, got {type(cp).__name__}")
+        cp = cp.lower()  # Normalize
+        if cp in ['c', 'call','认购','购']:
+            cp = 'call'
+        elif cp in ['p', 'put','认沽','沽']:
+            cp = 'put'
+        else:
+            raise ValueError(f"Invalid cp value: {cp}")   
+        ##################################################``
+        if not isinstance(ae, str):
+            raise TypeError(f"'ae' must be a string, got {type(ae).__name__}")
+        ae = ae.lower() ## https://www.schwab.com/learn/story/options-expiration-definitions-checklist-more ## https://licai.cofool.com/ask/qa_1414653.html
+        if ae in ['a', 'american','美式','美']: ## Standard U.S. equity options (options on single-name stocks) are American-style. 
+            ae = 'american' ## 属于美式期权的品种有橡胶期权、铝期权、锌期权、豆粕期权、玉米期权、铁矿石期权、石油气期权、聚丙烯期权、聚氯乙烯期权、聚乙烯期权、白糖期权、棉花期权、PTA期权、甲醇期权、菜籽粕期权和动力煤期权。
+        elif ae in ['e', 'european','euro','欧式','欧']: ## Most options on stock indexes, such as the Nasdaq-100® (NDX), S&P 500® (SPX), and Russell 2000® (RUT), are European-style.
+            ae = 'european' ## 欧式期权中包括的就是中金所股指期货期权为欧式，50ETF期权、沪市300ETF期权、深市300ETF期权、沪深300股指期权、黄金期权、铜期权
+        else:
+            raise ValueError(f"Invalid ae value: {ae}")    
+        ##################################################
+        if not isinstance(cs, bool): ## cash settlement; standard equity options are not cash-settled——actual shares are transferred in an exercise/assignment. 
+            ## Options on broad-based indexes, however, are cash-settled in an amount equal to the difference between the settlement price of the index and the strike price of the option times the contract multiplier.
+            raise TypeError(f"'exp' must be a boolean, got {type(cs).__name__}")
+        ##################################################
+        if not isinstance(exp, bool):
+            raise TypeError(f"'exp' must be a boolean, got {type(exp).__name__}")
+        ##################################################
+        if not isinstance(exe, bool):
+            raise TypeError(f"'exp' must be a boolean, got {type(exe).__name__}")
+        if exe and not exp and ae == 'european': ## as _FAOL_terms, before the position is touched
+            raise ValueError("European options can only be exercised at expiry")
+        ##################################################
+        ##################################################
+        transaction = self._row(idx)
+        trxn_val = transaction['Trxn_value']
+        trxn_curr = transaction['Trxn_value_curr']
+        sec_code = transaction['Security_code']
+        trxn_quan = transaction['Trxn_quantity']
+        if avgbp_t0 is None and unitsheld_t0 is None and SFP_A_FA_O_curr_CUM_UGLΔFV_t0 is None:
+            avgbp_t0, unitsheld_t0, SFP_A_FA_O_curr_CUM_UGLΔFV_t0 = self.IS.close(sec_code, trxn_curr, trxn_quan)
+
+        ugl_t0 = 0 ## unrealized g/l for period t0 (last period); 1 for gain DR, -1 for loss CR, 0 for breakeven
+        if SFP_A_FA_O_curr_CUM_UGLΔFV_t0 > 0:
+            ugl_t0 = 1 
+        elif SFP_A_FA_O_curr_CUM_UGLΔFV_t0 < 0:
+            ugl_t0 = -1
+        ## pro rata portion of CUM_UGLΔFV closed out by this close, as in func_FAE_close and IS.close
+        ugl_val = abs((trxn_quan / unitsheld_t0) * SFP_A_FA_O_curr_CUM_UGLΔFV_t0) if ugl_t0 else 0.0
+
+        if not exp:
+            if ae == 'american':
+                if exe: ## cash settlement is similar to func_close_FAE() but without the need for a new long equity position;
+                    ## equity settlement, we actually get stock; both are settled by batch_FAOL_close
+                    return self._FAOL_exercise(idx, exp, ae, exe, cs, cp, avgbp_t0, unitsheld_t0, SFP_A_FA_O_curr_CUM_UGLΔFV_t0,
+                                               underlying_sec_code, underlying_Price, underlying_K, option_multiplier)
+                else: ## exe == 0; long option position closed but due to neither expiration nor execution; similar to closing of a long equity position
+                    rgl_t1 = 0 ## realized g/l for period t1 (current period); 1 for gain, -1 for loss, 0 for breakeven
+                    if trxn_val > (trxn_quan * avgbp_t0):
+                        rgl_t1 = 1 ## realized a gain upon closing this position
+                    elif trxn_val < (trxn_quan * avgbp_t0):
+                        rgl_t1 = -1 ## realized a loss upon closing this position
+                    je_dfrow_0 = pd.DataFrame(index=[idx]) ## ugl_t0 == 0; nothing to close out
+                    if ugl_t0 == 1: ## close out unrealized gain
+                        je_dfrow_0 = pd.DataFrame(  index=[idx],
+                                                    columns=[   'DR_account_0', 'DR_value_0', 
+                                                                'CR_account_0', 'CR_value_0',],
+                                                    data=[[ f'SCI_OCI_UGLFA_ΔFV_{trxn_curr}_{sec_code}', ugl_val,
+                                                            f'SFP_A_FA_O_{trxn_curr}_CUM_UGLΔFV_{sec_code}', ugl_val]]
+                                              )
+                    elif ugl_t0 == -1: ## close out unrealized loss
+                        je_dfrow_0 = pd.DataFrame(  index=[idx],
+                                                    columns=[   'DR_account_0', 'DR_value_0', 
+                                                                'CR_account_0', 'CR_value_0',],
+                                                    data=[[ f'SFP_A_FA_O_{trxn_curr}_CUM_UGLΔFV_{sec_code}', ugl_val,
+                                                            f'SCI_OCI_UGLFA_ΔFV_{trxn_curr}_{sec_code}', ugl_val,]]
+                                              )
+                    if rgl_t1 == 1: ## realized gain, so we credit the realized gain
+                        je_dfrow_1 = pd.DataFrame(index=[idx],
+                                        columns=['DR_account_1', 'DR_value_1', 
+                                                 'CR_account_1', 'CR_value_1', 
+                                                'DR_account_2', 'DR_value_2', 
+                                                 'CR_account_2', 'CR_value_2',],
+                                        data=[[f'SCF_OA_PSI_{trxn_curr}_{sec_code}', trxn_val, 
+                                               f'SFP_A_FA_O_{trxn_curr}_BV_{sec_code}', (trxn_quan * avgbp_t0),
+                                                self.fillempty, self.fillempty, 
+                                               f'SCI_I_RGLFA_{trxn_curr}', (trxn_val - (trxn_quan * avgbp_t0))]]
+                                        )
+                    elif rgl_t1 == -1: ## realized loss, so we debit the realized loss
+                        je_dfrow_1 = pd.DataFrame(index=[idx],
+                                        columns=['DR_account_1', 'DR_value_1', 
+                                                 'CR_account_1', 'CR_value_1', 
+                                                 'DR_account_2', 'DR_value_2', 
+                                                 'CR_account_2', 'CR_value_2',],
+                                        data=[[f'SCF_OA_PSI_{trxn_curr}_{sec_code}', trxn_val, 
+                                               f'SFP_A_FA_O_{trxn_curr}_BV_{sec_code}', (trxn_quan * avgbp_t0),
+                                                f'SCI_I_RGLFA_{trxn_curr}', ((trxn_quan * avgbp_t0) - trxn_val), 
+                                               self.fillempty, self.fillempty]]
+                                        )
+                    else: ## rgl_t1 == 0; ## breakeven, so we do not need to record a realized gain/loss
+                        je_dfrow_1 = pd.DataFrame(index=[idx],
+                                        columns=['DR_account_1', 'DR_value_1', 
+                                                 'CR_account_1', 'CR_value_1'],
+                                        data=[[f'SCF_OA_PSI_{trxn_curr}_{sec_code}', trxn_val, 
+                                               f'SFP_A_FA_O_{trxn_curr}_BV_{sec_code}', (trxn_quan * avgbp_t0)]]
+                                        )
+                    je_dfrow = pd.concat([je_dfrow_0, je_dfrow_1], axis=1) ## combine the two JE rows into one DataFrame
+                    return je_dfrow
+            else: ## ae == 'european'; if long option position closed but due to neither expiration nor execution;
+                ## then we must've sold it; similar to closing of a long equity position
                 rgl_t1 = 0 ## realized g/l for period t1 (current period); 1 for gain, -1 for loss, 0 for breakeven
                 if trxn_val > (trxn_quan * avgbp_t0):
                     rgl_t1 = 1 ## realized a gain upon closing this position
                 elif trxn_val < (trxn_quan * avgbp_t0):
                     rgl_t1 = -1 ## realized a loss upon closing this position
-                if ugl_t0 == 0: ## close out unrealized gain
+                je_dfrow_0 = pd.DataFrame(index=[idx]) ## ugl_t0 == 0; nothing to close out
+                if ugl_t0 == 1: ## close out unrealized gain
                     je_dfrow_0 = pd.DataFrame(  index=[idx],
                                                 columns=[   'DR_account_0', 'DR_value_0', 
                                                             'CR_account_0', 'CR_value_0',],
-                                                data=[[ f'SCI_OCI_UGLFA_ΔFV_{trxn_curr}_{sec_code}', SFP_A_FA_O_curr_CUM_UGLΔFV_t0,
-                                                        f'SFP_A_FA_O_{trxn_curr}_CUM_UGLΔFV_{sec_code}', SFP_A_FA_O_curr_CUM_UGLΔFV_t0]]
-                                          )
+                                                data=[[ f'SCI_OCI_UGLFA_ΔFV_{trxn_curr}_{sec_code}', ugl_val,
+                                                        f'SFP_A_FA_O_{trxn_curr}_CUM_UGLΔFV_{sec_code}', ugl_val]]
+                                            )
                 elif ugl_t0 == -1: ## close out unrealized loss
                     je_dfrow_0 = pd.DataFrame(  index=[idx],
                                                 columns=[   'DR_account_0', 'DR_value_0', 
                                                             'CR_account_0', 'CR_value_0',],
-                                                data=[[ f'SFP_A_FA_O_{trxn_curr}_CUM_UGLΔFV_{sec_code}', SFP_A_FA_O_curr_CUM_UGLΔFV_t0,
-                                                        f'SCI_OCI_UGLFA_ΔFV_{trxn_curr}_{sec_code}', SFP_A_FA_O_curr_CUM_UGLΔFV_t0,]]
-                                          )
+                                                data=[[ f'SFP_A_FA_O_{trxn_curr}_CUM_UGLΔFV_{sec_code}', ugl_val,
+                                                        f'SCI_OCI_UGLFA_ΔFV_{trxn_curr}_{sec_code}', ugl_val,]]
+                                            )
                 if rgl_t1 == 1: ## realized gain, so we credit the realized gain
                     je_dfrow_1 = pd.DataFrame(index=[idx],
                                     columns=['DR_account_1', 'DR_value_1', 
-                                             'CR_account_1', 'CR_value_1', 
+                                                'CR_account_1', 'CR_value_1', 
                                             'DR_account_2', 'DR_value_2', 
-                                             'CR_account_2', 'CR_value_2',],
+                                                'CR_account_2', 'CR_value_2',],
                                     data=[[f'SCF_OA_PSI_{trxn_curr}_{sec_code}', trxn_val, 
-                                           f'SFP_A_FA_O_{trxn_curr}_BV_{sec_code}', (trxn_quan * avgbp_t0),
+                                            f'SFP_A_FA_O_{trxn_curr}_BV_{sec_code}', (trxn_quan * avgbp_t0),
                                             self.fillempty, self.fillempty, 
-                                           f'SCI_I_RGLFA_{trxn_curr}', (trxn_val - (trxn_quan * avgbp_t0))]]
+                                            f'SCI_I_RGLFA_{trxn_curr}', (trxn_val - (trxn_quan * avgbp_t0))]]
                                     )
                 elif rgl_t1 == -1: ## realized loss, so we debit the realized loss
                     je_dfrow_1 = pd.DataFrame(index=[idx],
                                     columns=['DR_account_1', 'DR_value_1', 
-                                             'CR_account_1', 'CR_value_1', 
-                                             'DR_account_2', 'DR_value_2', 
-                                             'CR_account_2', 'CR_value_2',],
+                                                'CR_account_1', 'CR_value_1', 
+                                                'DR_account_2', 'DR_value_2', 
+                                                'CR_account_2', 'CR_value_2',],
                                     data=[[f'SCF_OA_PSI_{trxn_curr}_{sec_code}', trxn_val, 
-                                           f'SFP_A_FA_O_{trxn_curr}_BV_{sec_code}', (trxn_quan * avgbp_t0),
-                                            f'SCI_I_RGLFA_{trxn_curr}', (trxn_val - (trxn_quan * avgbp_t0)), 
-                                           self.fillempty, self.fillempty]]
+                                            f'SFP_A_FA_O_{trxn_curr}_BV_{sec_code}', (trxn_quan * avgbp_t0),
+                                            f'SCI_I_RGLFA_{trxn_curr}', ((trxn_quan * avgbp_t0) - trxn_val), 
+                                            self.fillempty, self.fillempty]]
                                     )
                 else: ## rgl_t1 == 0; ## breakeven, so we do not need to record a realized gain/loss
                     je_dfrow_1 = pd.DataFrame(index=[idx],
                                     columns=['DR_account_1', 'DR_value_1', 
-                                             'CR_account_1', 'CR_value_1'],
+                                                'CR_account_1', 'CR_value_1'],
                                     data=[[f'SCF_OA_PSI_{trxn_curr}_{sec_code}', trxn_val, 
-                                           f'SFP_A_FA_O_{trxn_curr}_BV_{sec_code}', (trxn_quan * avgbp_t0)]]
+                                            f'SFP_A_FA_O_{trxn_curr}_BV_{sec_code}', (trxn_quan * avgbp_t0)]]
                                     )
                 je_dfrow = pd.concat([je_dfrow_0, je_dfrow_1], axis=1) ## combine the two JE rows into one DataFrame
-                return je_dfrow
-        else: ## ae == 'european'; if long option position closed but due to neither expiration nor execution;
-            ## then we must've sold it; similar to closing of a long equity position
-            rgl_t1 = 0 ## realized g/l for period t1 (current period); 1 for gain, -1 for loss, 0 for breakeven
-            if trxn_val > (trxn_quan * avgbp_t0):
-                rgl_t1 = 1 ## realized a gain upon closing this position
-            elif trxn_val < (trxn_quan * avgbp_t0):
-                rgl_t1 = -1 ## realized a loss upon closing this position
-            if ugl_t0 == 0: ## close out unrealized gain
-                je_dfrow_0 = pd.DataFrame(  index=[idx],
-                                            columns=[   'DR_account_0', 'DR_value_0', 
-                                                        'CR_account_0', 'CR_value_0',],
-                                            data=[[ f'SCI_OCI_UGLFA_ΔFV_{trxn_curr}_{sec_code}', SFP_A_FA_O_curr_CUM_UGLΔFV_t0,
-                                                    f'SFP_A_FA_O_{trxn_curr}_CUM_UGLΔFV_{sec_code}', SFP_A_FA_O_curr_CUM_UGLΔFV_t0]]
-                                        )
-            elif ugl_t0 == -1: ## close out unrealized loss
-                je_dfrow_0 = pd.DataFrame(  index=[idx],
-                                            columns=[   'DR_account_0', 'DR_value_0', 
-                                                        'CR_account_0', 'CR_value_0',],
-                                            data=[[ f'SFP_A_FA_O_{trxn_curr}_CUM_UGLΔFV_{sec_code}', SFP_A_FA_O_curr_CUM_UGLΔFV_t0,
-                                                    f'SCI_OCI_UGLFA_ΔFV_{trxn_curr}_{sec_code}', SFP_A_FA_O_curr_CUM_UGLΔFV_t0,]]
-                                        )
-            if rgl_t1 == 1: ## realized gain, so we credit the realized gain
-                je_dfrow_1 = pd.DataFrame(index=[idx],
-                                columns=['DR_account_1', 'DR_value_1', 
-                                            'CR_account_1', 'CR_value_1', 
-                                        'DR_account_2', 'DR_value_2', 
-                                            'CR_account_2', 'CR_value_2',],
-                                data=[[f'SCF_OA_PSI_{trxn_curr}_{sec_code}', trxn_val, 
-                                        f'SFP_A_FA_O_{trxn_curr}_BV_{sec_code}', (trxn_quan * avgbp_t0),
-                                        self.fillempty, self.fillempty, 
-                                        f'SCI_I_RGLFA_{trxn_curr}', (trxn_val - (trxn_quan * avgbp_t0))]]
-                                )
-            elif rgl_t1 == -1: ## realized loss, so we debit the realized loss
-                je_dfrow_1 = pd.DataFrame(index=[idx],
-                                columns=['DR_account_1', 'DR_value_1', 
-                                            'CR_account_1', 'CR_value_1', 
-                                            'DR_account_2', 'DR_value_2', 
-                                            'CR_account_2', 'CR_value_2',],
-                                data=[[f'SCF_OA_PSI_{trxn_curr}_{sec_code}', trxn_val, 
-                                        f'SFP_A_FA_O_{trxn_curr}_BV_{sec_code}', (trxn_quan * avgbp_t0),
-                                        f'SCI_I_RGLFA_{trxn_curr}', (trxn_val - (trxn_quan * avgbp_t0)), 
-                                        self.fillempty, self.fillempty]]
-                                )
-            else: ## rgl_t1 == 0; ## breakeven, so we do not need to record a realized gain/loss
-                je_dfrow_1 = pd.DataFrame(index=[idx],
-                                columns=['DR_account_1', 'DR_value_1', 
-                                            'CR_account_1', 'CR_value_1'],
-                                data=[[f'SCF_OA_PSI_{trxn_curr}_{sec_code}', trxn_val, 
-                                        f'SFP_A_FA_O_{trxn_curr}_BV_{sec_code}', (trxn_quan * avgbp_t0)]]
-                                )
-            je_dfrow = pd.concat([je_dfrow_0, je_dfrow_1], axis=1) ## combine the two JE rows into one DataFrame
-            return je_dfrow 
+                return je_dfrow 
             
-    if exp:
-        if exe: 
-            if cs: ## cash settlement;
-                if ugl_t0 == 1: ## close out unrealized gain
-                    pass
-                elif ugl_t0 == -1: ## close out unrealized loss
-                    pass
-                if cp == 'call':
-                    if underlying_Price > (underlying_K + avgbp_t0/option_multiplier): ## condition for a realized gain on an ITM call option
-                        rgl_t1_val = (underlying_Price - (underlying_K + avgbp_t0/option_multiplier)) * option_multiplier * trxn_quan
-                        rgl_t1_val = np.abs(rgl_t1_val)
-                        pass
-                    else: ## underlying price > underlying K but the difference < avgbp_t0/option_multiplier ## condition for a realized loss on an ITM call option
-                        rgl_t1_val = (underlying_Price - (underlying_K + avgbp_t0/option_multiplier)) * option_multiplier * trxn_quan
-                        rgl_t1_val = np.abs(rgl_t1_val)
-                        pass
-                else: ## cp == 'put'
-                    if underlying_Price < (underlying_K - avgbp_t0/option_multiplier): ## condition for a realized gain on an ITM put option
-                        rgl_t1_val = (underlying_K - (underlying_Price + avgbp_t0/option_multiplier)) * option_multiplier * trxn_quan
-                        rgl_t1_val = np.abs(rgl_t1_val)
-                        pass
-                    else: ## underlying price < underlying K but the difference < avgbp_t0/option_multiplier ## condition for a realized loss on an ITM put option
-                        rgl_t1_val = (underlying_K - (underlying_Price + avgbp_t0/option_multiplier)) * option_multiplier * trxn_quan
-                        rgl_t1_val = np.abs(rgl_t1_val)
-                        pass
-
-            else: ## cs == 0; equity settlement; we actually get stock
-                if ugl_t0 == 1: ## close out unrealized gain
-                    pass
-                elif ugl_t0 == -1: ## close out unrealized loss
-                    pass
-                if cp == 'call':
-                    pass
-                else: ## cp == 'put'
-                    pass
-        else: ## exe == 0; long option position closed because of expiration; OTM; no exercise, option expires worthless
-            if SFP_A_FA_O_curr_CUM_UGLΔFV_t0 > 0: ## close out unrealized gain
-                je_dfrow = pd.DataFrame(  index=[idx],
-                                            columns=[   'DR_account_0', 'DR_value_0', 
-                                                        'CR_account_0', 'CR_value_0',
-                                                        'DR_account_1', 'DR_value_1',
-                                                        'CR_account_1', 'CR_value_1'],
-                                            data=[[ f'SCI_OCI_UGLFA_ΔFV_{trxn_curr}_{sec_code}', SFP_A_FA_O_curr_CUM_UGLΔFV_t0,
-                                                    f'SFP_A_FA_O_{trxn_curr}_CUM_UGLΔFV_{sec_code}', SFP_A_FA_O_curr_CUM_UGLΔFV_t0,
-                                                    f'SCI_I_RGLFA_{trxn_curr}', avgbp_t0 * trxn_quan,
-                                                    f'SFP_A_FA_O_{trxn_curr}_BV_{sec_code}', avgbp_t0 * trxn_quan]]
-                                      )
-            elif SFP_A_FA_O_curr_CUM_UGLΔFV_t0 < 0: ## close out unrealized loss
-                je_dfrow = pd.DataFrame(  index=[idx],
-                                            columns=[   'DR_account_0', 'DR_value_0', 
-                                                        'CR_account_0', 'CR_value_0',
-                                                        'DR_account_1', 'DR_value_1',
-                                                        'CR_account_1', 'CR_value_1'],
-                                            data=[[ f'SFP_A_FA_O_{trxn_curr}_CUM_UGLΔFV_{sec_code}', SFP_A_FA_O_curr_CUM_UGLΔFV_t0,
-                                                    f'SCI_OCI_UGLFA_ΔFV_{trxn_curr}_{sec_code}', SFP_A_FA_O_curr_CUM_UGLΔFV_t0,
-                                                    f'SCI_I_RGLFA_{trxn_curr}', avgbp_t0 * trxn_quan,
-                                                    f'SFP_A_FA_O_{trxn_curr}_BV_{sec_code}', avgbp_t0 * trxn_quan]]
-                                      )
-            else: ## SFP_A_FA_O_curr_CUM_UGLΔFV_t0 == 0; we do not need to close out any unrealized gain/loss
-                je_dfrow = pd.DataFrame(  index=[idx],
-                                            columns=[   'DR_account_0', 'DR_value_0', 
-                                                        'CR_account_0', 'CR_value_0'],
-                                            data=[[ f'SCI_I_RGLFA_{trxn_curr}', avgbp_t0 * trxn_quan,
-                                                    f'SFP_A_FA_O_{trxn_curr}_BV_{sec_code}', avgbp_t0 * trxn_quan]]
-                                      )
-            return je_dfrow
+        if exp:
+            if exe: ## cash settlement, or equity settlement (we actually get stock for a call); see batch_FAOL_close
+                return self._FAOL_exercise(idx, exp, ae, exe, cs, cp, avgbp_t0, unitsheld_t0, SFP_A_FA_O_curr_CUM_UGLΔFV_t0,
+                                           underlying_sec_code, underlying_Price, underlying_K, option_multiplier)
+            else: ## exe == 0; long option position closed because of expiration; OTM; no exercise, option expires worthless
+                if SFP_A_FA_O_curr_CUM_UGLΔFV_t0 > 0: ## close out unrealized gain
+                    je_dfrow = pd.DataFrame(  index=[idx],
+                                                columns=[   'DR_account_0', 'DR_value_0', 
+                                                            'CR_account_0', 'CR_value_0',
+                                                            'DR_account_1', 'DR_value_1',
+                                                            'CR_account_1', 'CR_value_1'],
+                                                data=[[ f'SCI_OCI_UGLFA_ΔFV_{trxn_curr}_{sec_code}', ugl_val,
+                                                        f'SFP_A_FA_O_{trxn_curr}_CUM_UGLΔFV_{sec_code}', ugl_val,
+                                                        f'SCI_I_RGLFA_{trxn_curr}', avgbp_t0 * trxn_quan,
+                                                        f'SFP_A_FA_O_{trxn_curr}_BV_{sec_code}', avgbp_t0 * trxn_quan]]
+                                          )
+                elif SFP_A_FA_O_curr_CUM_UGLΔFV_t0 < 0: ## close out unrealized loss
+                    je_dfrow = pd.DataFrame(  index=[idx],
+                                                columns=[   'DR_account_0', 'DR_value_0', 
+                                                            'CR_account_0', 'CR_value_0',
+                                                            'DR_account_1', 'DR_value_1',
+                                                            'CR_account_1', 'CR_value_1'],
+                                                data=[[ f'SFP_A_FA_O_{trxn_curr}_CUM_UGLΔFV_{sec_code}', ugl_val,
+                                                        f'SCI_OCI_UGLFA_ΔFV_{trxn_curr}_{sec_code}', ugl_val,
+                                                        f'SCI_I_RGLFA_{trxn_curr}', avgbp_t0 * trxn_quan,
+                                                        f'SFP_A_FA_O_{trxn_curr}_BV_{sec_code}', avgbp_t0 * trxn_quan]]
+                                          )
+                else: ## SFP_A_FA_O_curr_CUM_UGLΔFV_t0 == 0; we do not need to close out any unrealized gain/loss
+                    je_dfrow = pd.DataFrame(  index=[idx],
+                                                columns=[   'DR_account_0', 'DR_value_0', 
+                                                            'CR_account_0', 'CR_value_0'],
+                                                data=[[ f'SCI_I_RGLFA_{trxn_curr}', avgbp_t0 * trxn_quan,
+                                                        f'SFP_A_FA_O_{trxn_curr}_BV_{sec_code}', avgbp_t0 * trxn_quan]]
+                                          )
+                return je_dfrow
 
         
 
@@ -428,9 +464,10 @@ def func_FAOL_close(self, idx, exp, ae, exe, cs, cp,
     
     def func_FAOS_open(self, idx, cp):
         ## prepaid cash, future liability 
+        pass
 
     def func_misc_fee(self, idx): ## miscellaneous fees ## 杂费 ## bank fee, ADR fee, transfer fee, custodian fee
-        transaction = self.df.iloc[idx]
+        transaction = self._row(idx)
         trxn_val = transaction['Trxn_value']
         trxn_curr = transaction['Trxn_value_curr']
         description = transaction['Description']
@@ -444,24 +481,26 @@ def func_FAOL_close(self, idx, exp, ae, exe, cs, cp,
         return je_dfrow, description
         
     def func_curr_tf(self, idx, presentation_curr):
-        transaction = self.df.iloc[idx]
+        transaction = self._row(idx)
         quote_val = transaction['Trxn_value'] ## quote (end-result) currency value
         quote_curr = transaction['Trxn_value_curr'] ## quote (end-result) currency
         base_val = transaction['Trxn_quantity'] ## base (original) currency value
         base_curr = transaction['Trxn_quantity_unit'] ## base (original) currency
         xrate = transaction['Trxn_price'] ## exchange rate 
         xrate_curr = transaction['Trxn_price_curr'] ## exchange rate currency codes, QUOTE/BASE
-        xr_lastmonth = self.XR0_df.loc[quote_curr, base_curr]
+        xr_lastmonth = self.FX0.rate(None, quote_curr, base_curr, presentation_curr)
+        ## gain (loss) taken from the amounts themselves, so the entry balances even when the statement's rate is rounded
+        diff_in_Qcurr = quote_val - xr_lastmonth * base_val ## = (xrate - xr_lastmonth) * base_val
         
-        if xrate > xr_lastmonth: ## condition for gain in currency translation
-            gain_in_Qcurr = (xrate - xr_lastmonth) * base_val ## gain amount stated in the Quote currency
+        if diff_in_Qcurr > 0: ## condition for gain in currency translation
+            gain_in_Qcurr = diff_in_Qcurr ## gain amount stated in the Quote currency
             gain_in_Bcurr = gain_in_Qcurr / xr_lastmonth ## gain amount stated in the Base currency
             if quote_curr == presentation_curr:
                 gain_recorded = gain_in_Qcurr
             elif base_curr == presentation_curr:
                 gain_recorded = gain_in_Bcurr
             else: ## neither QUOTE nor BASE is in the presentation currency (HKD), eg. CNY/USD pair
-                gain_recorded = gain_in_Qcurr * self.XR0_df.loc[presentation_curr, quote_curr]
+                gain_recorded = gain_in_Qcurr * self.FX0.rate(None, presentation_curr, quote_curr, presentation_curr)
             je_dfrow = pd.DataFrame(index=[idx],
                                 columns=['DR_account_0', 'DR_value_0', 
                                          'CR_account_0', 'CR_value_0', 
@@ -470,24 +509,24 @@ def func_FAOL_close(self, idx, exp, ae, exe, cs, cp,
                                        f'SFP_A_CCE_{base_curr}', base_val,
                                        f'SCI_XRPLFXC_{presentation_curr}',gain_recorded]]
                                 )
-        if xrate < xr_lastmonth: ## condition for loss in currency translation    
-            loss_in_Qcurr = (xrate - xr_lastmonth) * base_val ## loss amount stated in the Quote currency
+        if diff_in_Qcurr < 0: ## condition for loss in currency translation    
+            loss_in_Qcurr = diff_in_Qcurr ## loss amount stated in the Quote currency
             loss_in_Bcurr = loss_in_Qcurr / xr_lastmonth ## loss amount stated in the Base currency
             if quote_curr == presentation_curr:
                 loss_recorded = loss_in_Qcurr
             elif base_curr == presentation_curr:
                 loss_recorded = loss_in_Bcurr
             else: ## neither QUOTE nor BASE is in the presentation currency (HKD), eg. CNY/USD pair
-                loss_recorded = loss_in_Qcurr * self.XR0_df.loc[presentation_curr, quote_curr]
+                loss_recorded = loss_in_Qcurr * self.FX0.rate(None, presentation_curr, quote_curr, presentation_curr)
             je_dfrow = pd.DataFrame(index=[idx],
                                     columns=['DR_account_0', 'DR_value_0', 
                                              'CR_account_0', 'CR_value_0', 
                                              'DR_account_1', 'DR_value_1'],
                                     data=[[f'SFP_A_CCE_{quote_curr}', quote_val,
                                            f'SFP_A_CCE_{base_curr}', base_val,
-                                           f'SCI_XRPLFXC_{presentation_curr}',loss_recorded]]
+                                           f'SCI_XRPLFXC_{presentation_curr}',abs(loss_recorded)]] ## loss debited as a positive amount
                                     )
-        if xrate == xr_lastmonth:
+        if diff_in_Qcurr == 0:
             je_dfrow = pd.DataFrame(index=[idx],
                         columns=['DR_account_0', 'DR_value_0', 
                                  'CR_account_0', 'CR_value_0'],
@@ -498,7 +537,7 @@ def func_FAOL_close(self, idx, exp, ae, exe, cs, cp,
         return je_dfrow      
         
     def func_accn_tf(self, idx):
-        transaction = self.df.iloc[idx]
+        transaction = self._row(idx)
         trxn_val = transaction['Trxn_value']
         trxn_curr = transaction['Trxn_value_curr']
         sec_code = transaction['Security_code']
@@ -511,7 +550,7 @@ def func_FAOL_close(self, idx, exp, ae, exe, cs, cp,
         return je_dfrow      
 
     def func_sub(self, idx):
-        transaction = self.df.iloc[idx]
+        transaction = self._row(idx)
         trxn_val = transaction['Trxn_value']
         trxn_curr = transaction['Trxn_value_curr']
         je_dfrow = pd.DataFrame(index=[idx],
@@ -523,7 +562,7 @@ def func_FAOL_close(self, idx, exp, ae, exe, cs, cp,
         return je_dfrow     
 
     def func_red(self, idx):
-        transaction = self.df.iloc[idx]
+        transaction = self._row(idx)
         trxn_val = transaction['Trxn_value']
         trxn_curr = transaction['Trxn_value_curr']
         je_dfrow = pd.DataFrame(index=[idx],
@@ -535,7 +574,7 @@ def func_FAOL_close(self, idx, exp, ae, exe, cs, cp,
         return je_dfrow  
 
     def func_bank_fee(self, idx):
-        transaction = self.df.iloc[idx]
+        transaction = self._row(idx)
         trxn_val = transaction['Trxn_value']
         trxn_curr = transaction['Trxn_value_curr']
         je_dfrow = pd.DataFrame(index=[idx],
@@ -547,7 +586,7 @@ def func_FAOL_close(self, idx, exp, ae, exe, cs, cp,
         return je_dfrow  
 
     def func_bank_rebate(self, idx):
-        transaction = self.df.iloc[idx]
+        transaction = self._row(idx)
         trxn_val = transaction['Trxn_value']
         trxn_curr = transaction['Trxn_value_curr']
         je_dfrow = pd.DataFrame(index=[idx],
@@ -559,7 +598,7 @@ def func_FAOL_close(self, idx, exp, ae, exe, cs, cp,
         return je_dfrow  
 
     def func_ADR_fee(self, idx): ## ADR 管理费
-        transaction = self.df.iloc[idx]
+        transaction = self._row(idx)
         trxn_val = transaction['Trxn_value']
         trxn_curr = transaction['Trxn_value_curr']
         je_dfrow = pd.DataFrame(index=[idx],
@@ -568,6 +607,341 @@ def func_FAOL_close(self, idx, exp, ae, exe, cs, cp,
                                 data=[[f'SCI_E_OF_{trxn_curr}', trxn_val, 
                                        f'SCF_OA_OEP_{trxn_curr}', trxn_val]]
                                 )
+        return je_dfrow
+
+    ###########################################################################################
+    ## Batch (columnar) journal entry mapping ## 批量分录映射
+    ## every batch_* method maps ALL transactions of one type in a single columnar pass instead of building one
+    ## pd.DataFrame per row; the DR/CR cells are the same as calling the matching func_* on each row and
+    ## concatenating the one-row DataFrames
+
+    je_col_names = [f'{side}_{field}_{n}' for n in range(3) for side in ['DR', 'CR'] for field in ['account', 'value']]
+
+    je_templates = { ## transaction type: (DR account, CR account); both legs are valued at Trxn_value
+        'div_cash_rcvd': ('SCF_OA_DRC_{trxn_curr}', 'SCI_I_DI_{trxn_curr}'),
+        'int_cash_rcvd': ('SCF_OA_IRC_{trxn_curr}', 'SCI_I_II_{trxn_curr}'),
+        'FAE_open': ('SFP_A_FA_E_{trxn_curr}_BV_{sec_code}', 'SCF_OA_PPI_{trxn_curr}_{sec_code}'),
+        'FAOL_open': ('SFP_A_FA_D_{trxn_curr}_BV_{sec_code}', 'SCF_OA_PPI_{trxn_curr}_{sec_code}'),
+        'misc_fee': ('SCI_E_OF_{trxn_curr}', 'SCF_OA_OEP_{trxn_curr}'),
+        'accn_tf': ('SCI_E_TF_{trxn_curr}', 'SCF_OA_OEP_{trxn_curr}'),
+        'sub': ('SCF_FA_SR_{trxn_curr}', 'SCNAV_SUB_{trxn_curr}'),
+        'red': ('SCNAV_RED_{trxn_curr}', 'SCF_FA_RP_{trxn_curr}'),
+        'bank_fee': ('SCI_E_AF_{trxn_curr}', 'SCF_OA_OEP_{trxn_curr}'),
+        'bank_rebate': ('SCF_OA_OEP_{trxn_curr}', 'SCI_E_AF_{trxn_curr}'),
+        'ADR_fee': ('SCI_E_OF_{trxn_curr}', 'SCF_OA_OEP_{trxn_curr}'),
+    }
+
+    def map_batch(self, trxn_type_col, **type_kwargs):
+        """
+        Use as:
+            je_df = tjem.map_batch('Trxn_type', 
+                                   curr_tf={'presentation_curr': 'HKD'},
+                                   )
+            transaction_df = tjem.concat_je_rows(je_df)
+
+        trxn_type_col holds the func_* name without the 'func_' prefix (eg 'div_cash_rcvd', 'FAE_open', 'curr_tf'); 
+        rows with an empty type (NaN or '') are left without journal entries
+        type_kwargs are passed to the batch function of that type; array arguments line up with that type's rows in df order
+        opens and closes update self.IS in df order, exactly as the func_* calls would; passing 
+        FAE_close={'avgbp_t0': ..., 'unitsheld_t0': ..., 'SFP_A_FA_E_curr_CUM_UGLΔFV_t0': ...} uses those instead and leaves closes out of self.IS
+        (likewise FAOL_close, whose contract terms exp, ae, exe, cs, cp, ... are always needed; see batch_FAOL_close)
+        """
+        trxn_types = self.df[trxn_type_col].to_numpy()
+        type_kwargs = dict(type_kwargs)
+        FAOL_kwargs = type_kwargs.get('FAOL_close', {})
+        FAOL_terms = None
+        if (trxn_types == 'FAOL_close').any() and 'avgbp_t0' not in FAOL_kwargs:
+            FAOL_terms = self._FAOL_terms(np.flatnonzero(trxn_types == 'FAOL_close'), **FAOL_kwargs)
+        with self._stage('IS_stream'):
+            IS_t0, FAOL_IS_t0 = self._batch_IS_stream(trxn_types, closes='FAE_close' not in type_kwargs, FAOL_terms=FAOL_terms)
+        type_kwargs.setdefault('FAE_close', IS_t0)
+        if FAOL_terms is not None:
+            type_kwargs['FAOL_close'] = {**FAOL_kwargs, **FAOL_IS_t0}
+        je_frames = []
+        for trxn_type in pd.unique(trxn_types):
+            if pd.isna(trxn_type) or trxn_type == '': ## unlabelled (StatementLoader leaves a blank type as '')
+                continue
+            idxs = np.flatnonzero(trxn_types == trxn_type)
+            if trxn_type in self.je_templates:
+                je_frames.append(self.batch_template(trxn_type, idxs))
+            elif hasattr(self, f'batch_{trxn_type}'):
+                je_frames.append(getattr(self, f'batch_{trxn_type}')(idxs, **type_kwargs.get(trxn_type, {})))
+            else:
+                raise ValueError(f"No batch mapping for transaction type: {trxn_type}")
+        if not je_frames:
+            return pd.DataFrame(index=pd.Index([], dtype=np.int64))
+        with self._stage('assemble'):
+            je_df = pd.concat(je_frames, axis=0, sort=False)
+            ## object columns whatever mix of types was mapped, so chunks and partitions of one ledger line up exactly
+            return je_df[[col for col in self.je_col_names if col in je_df.columns]].sort_index().astype(object)
+
+    def map_parallel(self, trxn_type_col, n_workers=None, n_partitions=None, **type_kwargs):
+        ## map_batch over a process pool, partitioned by security; same result (see ParallelJEM.map_parallel)
+        from ParallelJEM import map_parallel
+        return map_parallel(self, trxn_type_col, n_workers=n_workers, n_partitions=n_partitions, **type_kwargs)
+
+    def revalue(self, prices, presentation_curr, date=None, **kwargs):
+        ## period-end fair value revaluation of every open position in self.IS at this period's rates (see Revaluation.revalue)
+        from Revaluation import revalue
+        return revalue(self.IS, prices, self.XR0_df, self.XR1_df, presentation_curr, date=date, **kwargs)
+
+    is_open_types = ['FAE_open', 'FAOL_open']
+
+    def _batch_IS_stream(self, trxn_types, closes=True, FAOL_terms=None):
+        ## the running Investment Schedule is sequential (the average book price moves with every open), so opens and closes
+        ## are replayed in df order with plain array updates, no DataFrames; returns the t0 inputs of every FAE_close,
+        ## and of every FAOL_close when their contract terms are given (physically settled calls also take up the underlying)
+        stream_types = self.is_open_types + (['FAE_close'] if closes else []) + (['FAOL_close'] if FAOL_terms is not None else [])
+        idxs = np.flatnonzero(pd.Series(trxn_types).isin(stream_types).to_numpy())
+        IS_t0, FAOL_IS_t0 = [], []
+        if FAOL_terms is not None:
+            acquires = FAOL_terms['exe'] & ~FAOL_terms['cs'] & FAOL_terms['call']
+        for trxn_type, sec_code, trxn_curr, trxn_quan, trxn_val, date in zip(trxn_types[idxs],
+                                                                             self.df['Security_code'].to_numpy()[idxs],
+                                                                             self.df['Trxn_value_curr'].to_numpy()[idxs],
+                                                                             self.df['Trxn_quantity'].to_numpy()[idxs],
+                                                                             self.df['Trxn_value'].to_numpy()[idxs],
+                                                                             self._settle_dates(idxs)):
+            if trxn_type == 'FAE_close':
+                IS_t0.append(self.IS.close(sec_code, trxn_curr, trxn_quan))
+            elif trxn_type == 'FAOL_close':
+                i = len(FAOL_IS_t0)
+                FAOL_IS_t0.append(self._FAOL_close_IS(FAOL_terms, i, acquires[i], sec_code, trxn_curr, trxn_quan, date))
+            else:
+                self.IS.open(sec_code, trxn_curr, trxn_quan, trxn_val, date=date, asset_class='O' if trxn_type == 'FAOL_open' else None)
+        IS_t0 = np.array(IS_t0, dtype=float).reshape(-1, 3)
+        FAOL_IS_t0 = np.array(FAOL_IS_t0, dtype=float).reshape(-1, 3)
+        return ({'avgbp_t0': IS_t0[:, 0], 'unitsheld_t0': IS_t0[:, 1], 'SFP_A_FA_E_curr_CUM_UGLΔFV_t0': IS_t0[:, 2]},
+                {'avgbp_t0': FAOL_IS_t0[:, 0], 'unitsheld_t0': FAOL_IS_t0[:, 1], 'SFP_A_FA_O_curr_CUM_UGLΔFV_t0': FAOL_IS_t0[:, 2]})
+
+    def batch_template(self, trxn_type, idxs): ## every 1 DR / 1 CR mapping in je_templates
+        dr_template, cr_template = self.je_templates[trxn_type]
+        trxn_val = self.df['Trxn_value'].to_numpy()[idxs]
+        fields = {'trxn_curr': self.df['Trxn_value_curr'].to_numpy()[idxs]}
+        if 'sec_code' in dr_template + cr_template:
+            fields['sec_code'] = self.df['Security_code'].to_numpy()[idxs]
+        return pd.DataFrame(index=idxs,
+                            data={'DR_account_0': self._batch_accounts(dr_template, **fields), 'DR_value_0': trxn_val,
+                                  'CR_account_0': self._batch_accounts(cr_template, **fields), 'CR_value_0': trxn_val},
+                            )
+
+    def batch_FAE_close(self, idxs, avgbp_t0, unitsheld_t0, SFP_A_FA_E_curr_CUM_UGLΔFV_t0):
+        ## same inputs as func_FAE_close, as arrays (or scalars) lined up with idxs
+        trxn_val = self.df['Trxn_value'].to_numpy()[idxs]
+        trxn_curr = self.df['Trxn_value_curr'].to_numpy()[idxs]
+        sec_code = self.df['Security_code'].to_numpy()[idxs]
+        trxn_quan = self.df['Trxn_quantity'].to_numpy()[idxs]
+        cum_ugl_t0 = np.broadcast_to(np.asarray(SFP_A_FA_E_curr_CUM_UGLΔFV_t0, dtype=float), idxs.shape)
+        book_val = trxn_quan * np.asarray(avgbp_t0, dtype=float)
+        ugl_val = np.abs((trxn_quan / np.asarray(unitsheld_t0, dtype=float)) * cum_ugl_t0)
+        rgl_val = trxn_val - book_val
+
+        oci_acct = self._batch_accounts('SCI_OCI_UGLFA_ΔFV_{trxn_curr}_{sec_code}', trxn_curr=trxn_curr, sec_code=sec_code)
+        cum_ugl_acct = self._batch_accounts('SFP_A_FA_E_{trxn_curr}_CUM_UGLΔFV_{sec_code}', trxn_curr=trxn_curr, sec_code=sec_code)
+        rgl_acct = self._batch_accounts('SCI_I_RGLFA_{trxn_curr}', trxn_curr=trxn_curr)
+        ugl_gain, ugl_loss = cum_ugl_t0 > 0, cum_ugl_t0 < 0 ## DR balance closed out on the CR side, and vice versa
+        rgl_gain, rgl_loss = rgl_val > 0, rgl_val < 0
+        return pd.DataFrame(index=idxs,
+                            data={'DR_account_0': self._batch_select([ugl_gain, ugl_loss], [oci_acct, cum_ugl_acct]),
+                                  'DR_value_0': self._batch_select([ugl_gain | ugl_loss], [ugl_val]),
+                                  'CR_account_0': self._batch_select([ugl_gain, ugl_loss], [cum_ugl_acct, oci_acct]),
+                                  'CR_value_0': self._batch_select([ugl_gain | ugl_loss], [ugl_val]),
+                                  'DR_account_1': self._batch_accounts('SCF_OA_PSI_{trxn_curr}_{sec_code}', trxn_curr=trxn_curr, sec_code=sec_code),
+                                  'DR_value_1': trxn_val,
+                                  'CR_account_1': self._batch_accounts('SFP_A_FA_E_{trxn_curr}_BV_{sec_code}', trxn_curr=trxn_curr, sec_code=sec_code),
+                                  'CR_value_1': book_val,
+                                  'DR_account_2': self._batch_select([rgl_gain, rgl_loss], [self.fillempty, rgl_acct]),
+                                  'DR_value_2': self._batch_select([rgl_gain, rgl_loss], [self.fillempty, -rgl_val]),
+                                  'CR_account_2': self._batch_select([rgl_gain, rgl_loss], [rgl_acct, self.fillempty]),
+                                  'CR_value_2': self._batch_select([rgl_gain, rgl_loss], [rgl_val, self.fillempty])},
+                            )
+
+    cp_names = {'c': 'call', 'call': 'call', '认购': 'call', '购': 'call', 'p': 'put', 'put': 'put', '认沽': 'put', '沽': 'put'}
+    ae_names = {'a': 'american', 'american': 'american', '美式': 'american', '美': 'american',
+                'e': 'european', 'european': 'european', 'euro': 'european', '欧式': 'european', '欧': 'european'}
+
+    def _FAOL_terms(self, idxs, exp, ae, exe, cs, cp, underlying_sec_code=None, underlying_Price=None, underlying_K=None, option_multiplier=None):
+        ## func_FAOL_close's contract terms as arrays lined up with idxs (scalars are broadcast); exe=None exercises what is ITM at expiry
+        n = len(idxs)
+        column = lambda value, dtype: np.broadcast_to(np.asarray(value, dtype=dtype), (n,))
+        for name, value in [('exp', exp), ('cs', cs)] + ([('exe', exe)] if exe is not None else []):
+            if np.asarray(value).dtype != bool:
+                raise TypeError(f"'{name}' must be a boolean, got {np.asarray(value).dtype}")
+        cp_norm = pd.Series(column(cp, object)).astype(str).str.lower().map(self.cp_names).to_numpy(dtype=object)
+        if pd.isna(cp_norm).any():
+            raise ValueError(f"Invalid cp value: {column(cp, object)[pd.isna(cp_norm)][0]}")
+        ae_norm = pd.Series(column(ae, object)).astype(str).str.lower().map(self.ae_names).to_numpy(dtype=object)
+        if pd.isna(ae_norm).any():
+            raise ValueError(f"Invalid ae value: {column(ae, object)[pd.isna(ae_norm)][0]}")
+        terms = {'exp': column(exp, bool), 'cs': column(cs, bool), 'call': cp_norm == 'call',
+                 'underlying': column(underlying_sec_code, object),
+                 'S': column(np.nan if underlying_Price is None else underlying_Price, float),
+                 'K': column(np.nan if underlying_K is None else underlying_K, float),
+                 'multiplier': column(np.nan if option_multiplier is None else option_multiplier, float)}
+        ## intrinsic value per underlying share; NaN where the underlying price is not given
+        terms['intrinsic'] = np.maximum(np.where(terms['call'], terms['S'] - terms['K'], terms['K'] - terms['S']), 0)
+        terms['exe'] = column(exe, bool) if exe is not None else terms['exp'] & (terms['intrinsic'] > 0)
+        early = terms['exe'] & ~terms['exp']
+        if (early & (ae_norm == 'european')).any():
+            raise ValueError("European options can only be exercised at expiry")
+        cash, physical = terms['exe'] & terms['cs'], terms['exe'] & ~terms['cs']
+        missing = (cash & np.isnan(terms['intrinsic'])) | (physical & np.isnan(terms['K'])) | (terms['exe'] & np.isnan(terms['multiplier']))
+        missing |= physical & terms['call'] & pd.isna(terms['underlying'])
+        if missing.any():
+            raise ValueError(f"Exercised options need underlying_Price (cash settled) or underlying_K and underlying_sec_code "
+                             f"(equity settled) and option_multiplier; missing for row {idxs[np.argmax(missing)]}")
+        return terms
+
+    def _FAOL_exercise(self, idx, exp, ae, exe, cs, cp, avgbp_t0, unitsheld_t0, cum_ugl_t0,
+                       underlying_sec_code, underlying_Price, underlying_K, option_multiplier):
+        ## func_FAOL_close's exercise branches: the one-row batch, plus the underlying taken up by a physically settled call
+        idxs = np.array([idx])
+        terms = self._FAOL_terms(idxs, exp, ae, exe, cs, cp, underlying_sec_code, underlying_Price, underlying_K, option_multiplier)
+        je_dfrow = self.batch_FAOL_close(idxs, exp, ae, exe, cs, cp, avgbp_t0, unitsheld_t0, cum_ugl_t0,
+                                         underlying_sec_code, underlying_Price, underlying_K, option_multiplier)
+        if terms['exe'][0] and not terms['cs'][0] and terms['call'][0]: ## the underlying taken up; the premium paid is part of its cost
+            transaction = self._row(idx)
+            units = transaction['Trxn_quantity'] * option_multiplier
+            self.IS.open(underlying_sec_code, transaction['Trxn_value_curr'], units, units * underlying_K + transaction['Trxn_quantity'] * avgbp_t0,
+                         date=transaction.get('Settle_date'))
+        return je_dfrow.dropna(axis=1, how='all')
+
+    def batch_FAOL_close(self, idxs, exp, ae, exe, cs, cp, avgbp_t0=None, unitsheld_t0=None, SFP_A_FA_O_curr_CUM_UGLΔFV_t0=None,
+                         underlying_sec_code=None, underlying_Price=None, underlying_K=None, option_multiplier=None):
+        """
+        Use as:
+            je_df = tjem.map_batch('Trxn_type', FAOL_close={'exp': expired, 'ae': 'american', 'exe': None, 'cs': False, 'cp': cp,
+                                                            'underlying_sec_code': underlying, 'underlying_Price': S,
+                                                            'underlying_K': K, 'option_multiplier': 100})
+        Settles every FAOL_close row at once (eg all contracts of an expiry Friday); same arguments as func_FAOL_close,
+        as arrays lined up with idxs or scalars. exe=None exercises the contracts that are in the money at expiry
+        Every row closes out its share of CUM_UGLΔFV (DR_0/CR_0, as batch_FAE_close), then by settlement:
+            sold before expiry:     DR SCF_OA_PSI (Trxn_value) / CR SFP_A_FA_O BV, realized g/l on DR_2 or CR_2
+            cash settled:           the same with the payoff (intrinsic value * multiplier * contracts) as the proceeds
+            expired worthless:      DR SCI_I_RGLFA / CR SFP_A_FA_O BV (on DR_0/CR_0 when there is no CUM_UGLΔFV to close out)
+            call, equity settled:   DR SFP_A_FA_E BV of the underlying (strike * shares + premium book value) / CR SFP_A_FA_O BV,
+                                    CR_2 SCF_OA_PPI of the underlying (strike * shares paid); the shares go into self.IS
+            put, equity settled:    the premium is realized (DR SCI_I_RGLFA / CR SFP_A_FA_O BV); the shares delivered at the
+                                    strike are closed by the underlying's own FAE_close row from the statement
+        avgbp_t0, unitsheld_t0, SFP_A_FA_O_curr_CUM_UGLΔFV_t0 default to replaying the rows against self.IS in idxs order
+        """
+        terms = self._FAOL_terms(idxs, exp, ae, exe, cs, cp, underlying_sec_code, underlying_Price, underlying_K, option_multiplier)
+        trxn_val = self.df['Trxn_value'].to_numpy()[idxs]
+        trxn_curr = self.df['Trxn_value_curr'].to_numpy()[idxs]
+        sec_code = self.df['Security_code'].to_numpy()[idxs]
+        trxn_quan = self.df['Trxn_quantity'].to_numpy(dtype=float)[idxs]
+        if avgbp_t0 is None and unitsheld_t0 is None and SFP_A_FA_O_curr_CUM_UGLΔFV_t0 is None:
+            IS_t0 = self._FAOL_stream(idxs, terms)
+            avgbp_t0, unitsheld_t0, SFP_A_FA_O_curr_CUM_UGLΔFV_t0 = IS_t0['avgbp_t0'], IS_t0['unitsheld_t0'], IS_t0['SFP_A_FA_O_curr_CUM_UGLΔFV_t0']
+        cum_ugl_t0 = np.broadcast_to(np.asarray(SFP_A_FA_O_curr_CUM_UGLΔFV_t0, dtype=float), idxs.shape)
+        book_val = trxn_quan * np.asarray(avgbp_t0, dtype=float)
+        ugl_val = np.abs((trxn_quan / np.asarray(unitsheld_t0, dtype=float)) * cum_ugl_t0)
+
+        exe, cs, call = terms['exe'], terms['cs'], terms['call']
+        sold, expired = ~exe & ~terms['exp'], ~exe & terms['exp']
+        cash, call_shares, put_shares = exe & cs, exe & ~cs & call, exe & ~cs & ~call
+        proceeds = np.where(cash, terms['intrinsic'] * terms['multiplier'] * trxn_quan, trxn_val)
+        rgl_val = proceeds - book_val
+        strike_val = trxn_quan * terms['multiplier'] * terms['K'] ## cash paid for the shares of an equity settled call
+        shares_cost = strike_val + book_val
+
+        oci_acct = self._batch_accounts('SCI_OCI_UGLFA_ΔFV_{trxn_curr}_{sec_code}', trxn_curr=trxn_curr, sec_code=sec_code)
+        cum_ugl_acct = self._batch_accounts('SFP_A_FA_O_{trxn_curr}_CUM_UGLΔFV_{sec_code}', trxn_curr=trxn_curr, sec_code=sec_code)
+        bv_acct = self._batch_accounts('SFP_A_FA_O_{trxn_curr}_BV_{sec_code}', trxn_curr=trxn_curr, sec_code=sec_code)
+        rgl_acct = self._batch_accounts('SCI_I_RGLFA_{trxn_curr}', trxn_curr=trxn_curr)
+        psi_acct = self._batch_accounts('SCF_OA_PSI_{trxn_curr}_{sec_code}', trxn_curr=trxn_curr, sec_code=sec_code)
+        underlying = np.where(call_shares, terms['underlying'], '')
+        shares_acct = self._batch_accounts('SFP_A_FA_E_{trxn_curr}_BV_{sec_code}', trxn_curr=trxn_curr, sec_code=underlying)
+        ppi_acct = self._batch_accounts('SCF_OA_PPI_{trxn_curr}_{sec_code}', trxn_curr=trxn_curr, sec_code=underlying)
+
+        ugl_gain, ugl_loss = cum_ugl_t0 > 0, cum_ugl_t0 < 0 ## DR balance closed out on the CR side, and vice versa
+        disposed = sold | cash
+        written_off = expired | put_shares
+        rgl_gain, rgl_loss = disposed & (rgl_val > 0), disposed & (rgl_val < 0)
+        first_slot = written_off & ~(ugl_gain | ugl_loss) ## nothing to close out: the write-off takes DR_0/CR_0, as in func_FAOL_close
+        return pd.DataFrame(index=idxs,
+                            data={'DR_account_0': self._batch_select([ugl_gain, ugl_loss, first_slot], [oci_acct, cum_ugl_acct, rgl_acct]),
+                                  'DR_value_0': self._batch_select([ugl_gain | ugl_loss, first_slot], [ugl_val, book_val]),
+                                  'CR_account_0': self._batch_select([ugl_gain, ugl_loss, first_slot], [cum_ugl_acct, oci_acct, bv_acct]),
+                                  'CR_value_0': self._batch_select([ugl_gain | ugl_loss, first_slot], [ugl_val, book_val]),
+                                  'DR_account_1': self._batch_select([disposed, written_off & ~first_slot, call_shares], [psi_acct, rgl_acct, shares_acct]),
+                                  'DR_value_1': self._batch_select([disposed, written_off & ~first_slot, call_shares], [proceeds, book_val, shares_cost]),
+                                  'CR_account_1': self._batch_select([~first_slot], [bv_acct]),
+                                  'CR_value_1': self._batch_select([~first_slot], [book_val]),
+                                  'DR_account_2': self._batch_select([rgl_gain, rgl_loss], [self.fillempty, rgl_acct]),
+                                  'DR_value_2': self._batch_select([rgl_gain, rgl_loss], [self.fillempty, -rgl_val]),
+                                  'CR_account_2': self._batch_select([rgl_gain, rgl_loss, call_shares], [rgl_acct, self.fillempty, ppi_acct]),
+                                  'CR_value_2': self._batch_select([rgl_gain, rgl_loss, call_shares], [rgl_val, self.fillempty, strike_val])},
+                            )
+
+    def _FAOL_stream(self, idxs, terms):
+        ## option closes replayed against self.IS in idxs order, taking up the underlying of physically settled calls as they go
+        acquires = terms['exe'] & ~terms['cs'] & terms['call']
+        IS_t0 = [self._FAOL_close_IS(terms, i, acquires[i], sec_code, trxn_curr, trxn_quan, date)
+                 for i, (sec_code, trxn_curr, trxn_quan, date) in enumerate(zip(self.df['Security_code'].to_numpy()[idxs],
+                                                                                self.df['Trxn_value_curr'].to_numpy()[idxs],
+                                                                                self.df['Trxn_quantity'].to_numpy(dtype=float)[idxs],
+                                                                                self._settle_dates(idxs)))]
+        IS_t0 = np.array(IS_t0, dtype=float).reshape(-1, 3)
+        return {'avgbp_t0': IS_t0[:, 0], 'unitsheld_t0': IS_t0[:, 1], 'SFP_A_FA_O_curr_CUM_UGLΔFV_t0': IS_t0[:, 2]}
+
+    def _FAOL_close_IS(self, terms, i, acquires, sec_code, trxn_curr, trxn_quan, date=None):
+        position_t0 = self.IS.close(sec_code, trxn_curr, trxn_quan)
+        if acquires: ## the underlying taken up; the premium paid is part of its cost
+            units = trxn_quan * terms['multiplier'][i]
+            self.IS.open(terms['underlying'][i], trxn_curr, units, units * terms['K'][i] + trxn_quan * position_t0[0], date=date)
+        return position_t0
+
+    def _settle_dates(self, idxs): ## open dates for the Investment Schedule (a LotLedger keeps them per lot); None without Settle_date
+        return self.df['Settle_date'].to_numpy()[idxs] if 'Settle_date' in self.df.columns else np.full(len(idxs), None, dtype=object)
+
+    def batch_curr_tf(self, idxs, presentation_curr):
+        quote_val = self.df['Trxn_value'].to_numpy()[idxs]
+        quote_curr = self.df['Trxn_value_curr'].to_numpy()[idxs]
+        base_val = self.df['Trxn_quantity'].to_numpy()[idxs]
+        base_curr = self.df['Trxn_quantity_unit'].to_numpy()[idxs]
+        xr_lastmonth = self.FX0.rates(None, quote_curr, base_curr, via=presentation_curr)
+
+        diff_in_Qcurr = quote_val - xr_lastmonth * base_val ## gain (loss) amount stated in the Quote currency; see func_curr_tf
+        xr_gain, xr_loss = diff_in_Qcurr > 0, diff_in_Qcurr < 0
+        diff_in_Bcurr = diff_in_Qcurr / xr_lastmonth ## gain (loss) amount stated in the Base currency
+        diff_recorded = np.where(quote_curr == presentation_curr, diff_in_Qcurr, diff_in_Bcurr)
+        neither = (quote_curr != presentation_curr) & (base_curr != presentation_curr) & (xr_gain | xr_loss)
+        if neither.any(): ## neither QUOTE nor BASE is in the presentation currency (HKD), eg. CNY/USD pair
+            diff_recorded[neither] = diff_in_Qcurr[neither] * self.FX0.rates(None, presentation_curr, quote_curr[neither], via=presentation_curr)
+        xr_acct = np.full(len(idxs), f'SCI_XRPLFXC_{presentation_curr}', dtype=object)
+        return pd.DataFrame(index=idxs,
+                            data={'DR_account_0': self._batch_accounts('SFP_A_CCE_{curr}', curr=quote_curr), 'DR_value_0': quote_val,
+                                  'CR_account_0': self._batch_accounts('SFP_A_CCE_{curr}', curr=base_curr), 'CR_value_0': base_val,
+                                  'DR_account_1': self._batch_select([xr_loss], [xr_acct]),
+                                  'DR_value_1': self._batch_select([xr_loss], [np.abs(diff_recorded)]),
+                                  'CR_account_1': self._batch_select([xr_gain], [xr_acct]),
+                                  'CR_value_1': self._batch_select([xr_gain], [diff_recorded])},
+                            )
+
+    def _batch_accounts(self, template, **fields):
+        ## vectorized f-string; each distinct combination of field values is formatted once and broadcast back to its rows
+        codes, uniques = 0, []
+        for values in fields.values():
+            field_codes, field_uniques = pd.factorize(np.asarray(values, dtype=object), use_na_sentinel=False)
+            codes = codes * len(field_uniques) + field_codes
+            uniques.append(field_uniques)
+        combos, inverse = np.unique(codes, return_inverse=True)
+        accounts = []
+        for combo in combos:
+            values = {}
+            for name, field_uniques in reversed(list(zip(fields, uniques))):
+                combo, field_code = divmod(combo, len(field_uniques))
+                values[name] = field_uniques[field_code]
+            accounts.append(template.format(**values))
+        return np.array(accounts, dtype=object)[inverse]
+
+    def _batch_select(self, masks, choices):
+        ## np.select for object columns; rows matching no mask stay empty (NaN), as they do after concatenating one-row DataFrames
+        selected = np.full(len(masks[0]), np.nan, dtype=object)
+        for mask, choice in reversed(list(zip(masks, choices))):
+            selected[mask] = choice[mask] if isinstance(choice, np.ndarray) else choice
+        return selected
 
     
     
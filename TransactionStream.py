@@ -0,0 +1,70 @@
+## Streaming (chunked) journal entry mapping ## 分块读取并映射交易
+import itertools
+import os
+
+import pandas as pd
+
+from InvestmentSchedule import InvestmentSchedule
+from TransactionJEM import TransactionJEM
+
+
+def read_transactions(path, chunksize=100_000, sheet_name=None, **read_kwargs):
+    """
+    Yields the transaction spreadsheet as DataFrames of at most chunksize rows, without loading the whole file
+    .csv goes through pandas' chunked reader; .xlsx/.xlsm rows are streamed through openpyxl's read-only mode
+    """
+    if os.path.splitext(path)[1].lower() in ['.xlsx', '.xlsm']:
+        import openpyxl ## only needed for Excel sources
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = (workbook[sheet_name] if sheet_name is not None else workbook.active).iter_rows(values_only=True)
+            header = next(rows)
+            while True:
+                chunk_rows = list(itertools.islice(rows, chunksize))
+                if not chunk_rows:
+                    break
+                yield pd.DataFrame(chunk_rows, columns=header)
+        finally:
+            workbook.close()
+    else:
+        with pd.read_csv(path, chunksize=chunksize, **read_kwargs) as reader:
+            for chunk in reader:
+                yield chunk
+
+
+def map_transactions_stream(chunks, XR0_df, XR1_df, trxn_type_col='Trxn_type', IS=None, fillempty='', **type_kwargs):
+    """
+    Use as:
+        for mapped_chunk in map_transactions_stream(read_transactions('trxns.csv'), XR0_df, XR1_df, curr_tf={'presentation_curr': 'HKD'}):
+            ...
+
+    chunks = any iterable of transaction DataFrames (eg read_transactions), in Settle_date order
+    Each chunk is mapped with TransactionJEM.map_batch and yielded in the concat_je_rows layout, indexed by its row number in
+    the whole stream; the Investment Schedule carries across chunks, so only one chunk is held in memory at a time
+    type_kwargs are passed on to map_batch; per-row arrays do not apply across chunks, so closes read their t0 inputs from IS
+    """
+    IS = IS if IS is not None else InvestmentSchedule()
+    offset = 0
+    for chunk in chunks:
+        chunk = chunk.reset_index(drop=True)
+        tjem = TransactionJEM(chunk, XR0_df, XR1_df, fillempty=fillempty, IS=IS)
+        mapped_chunk = tjem.concat_je_rows(tjem.map_batch(trxn_type_col, **type_kwargs))
+        mapped_chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+        offset += len(chunk)
+        yield mapped_chunk
+
+
+def map_transactions_to_csv(path, out_path, XR0_df, XR1_df, chunksize=100_000, IS=None, **stream_kwargs):
+    """
+    Reads path chunk by chunk, maps it, and appends the mapped rows to out_path; returns the Investment Schedule at the end
+    of the stream. The DR/CR column set can grow between chunks (eg the first FAE_close adds _2 columns), so every chunk is
+    written with the full journal entry column set
+    """
+    IS = IS if IS is not None else InvestmentSchedule()
+    columns = None
+    for mapped_chunk in map_transactions_stream(read_transactions(path, chunksize), XR0_df, XR1_df, IS=IS, **stream_kwargs):
+        if columns is None:
+            columns = [col for col in mapped_chunk.columns if col not in TransactionJEM.je_col_names] + TransactionJEM.je_col_names
+        mapped_chunk.reindex(columns=columns).to_csv(out_path, mode='w' if mapped_chunk.index[0] == 0 else 'a',
+                                                     header=mapped_chunk.index[0] == 0, index=False)
+    return IS
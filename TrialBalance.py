@@ -0,0 +1,182 @@
+## Trial balance and hierarchical rollup ## 试算平衡表与科目汇总
+import numpy as np
+import pandas as pd
+
+from ChartOfAccounts import ChartOfAccounts
+from FSTemplate import FSTemplate
+
+date_col = 'Settle_date'
+slots = [(side, n) for n in range(3) for side in ['DR', 'CR']]
+
+
+def to_long(ledger_df, date_col=date_col):
+    """
+    wide journal entries (DR_account_0 .. CR_value_2, one transaction per row) -> one row per posting:
+        idx (the transaction's row), Settle_date, Side ('DR'/'CR'), Account, Value, Amount (DR positive, CR negative)
+    empty slots (NaN, None or fillempty '') are dropped
+    """
+    frames = []
+    for side, n in slots:
+        account_col, value_col = f'{side}_account_{n}', f'{side}_value_{n}'
+        if account_col not in ledger_df.columns:
+            continue
+        accounts = ledger_df[account_col].to_numpy(dtype=object)
+        posted = ~pd.isna(accounts) & (accounts != '')
+        if not posted.any():
+            continue
+        values = pd.to_numeric(pd.Series(ledger_df[value_col].to_numpy(dtype=object)[posted]).replace('', np.nan), errors='coerce').to_numpy(dtype=float)
+        frames.append(pd.DataFrame({'idx': np.flatnonzero(posted),
+                                    date_col: ledger_df[date_col].to_numpy()[posted] if date_col in ledger_df.columns else pd.NaT,
+                                    'Side': side,
+                                    'Account': accounts[posted],
+                                    'Value': values,
+                                    'Amount': values if side == 'DR' else -values}))
+    if not frames:
+        return pd.DataFrame(columns=['idx', date_col, 'Side', 'Account', 'Value', 'Amount'])
+    return pd.concat(frames, ignore_index=True).sort_values(['idx', 'Side'], ascending=[True, False], kind='stable').reset_index(drop=True)
+
+
+class TrialBalance:
+    """
+    DR and CR totals per account per period, kept as dense arrays [period, account ID] (IDs from a ChartOfAccounts),
+    so adding a day's entries is one scatter-add of just those entries into the arrays; history is never re-aggregated
+    Balances roll up the account hierarchy in one vectorized pass: each posting account adds into every ancestor
+    (SFP_A_FA_E_USD_BV_ABC.XNYS -> SFP_A_FA_E_USD_BV -> SFP_A_FA_E_USD -> SFP_A_FA_E -> ... -> SFP), kept apart per currency,
+    so SFP_A_FA_E shows one line per currency; share counts (*_S) are not added into their money parents
+
+    Use as:
+        tb = TrialBalance.from_ledger(transaction_df) ## or TrialBalance(coa) then tb.add(...) per day/chunk
+        tb.add(todays_transaction_df)
+        tb.balances() ## every account and level, per currency and period
+        tb.balances(accounts=['SFP_A_FA_E_USD_BV'], cumulative=True) ## closing balances to date
+        tb.trial_balance('2024-03') ## posting accounts only, with DR/CR totals per currency
+    """
+    def __init__(self, coa=None, freq='M'):
+        self.coa = coa if coa is not None else ChartOfAccounts.from_template()
+        self.freq = freq
+        self.periods = [] ## period index: Period
+        self.period_pos = {}
+        self.debits = np.zeros((12, max(len(self.coa), 256)))
+        self.credits = np.zeros_like(self.debits)
+        self._rollup = None ## (chart size, ancestor table, additive flags), rebuilt only when the chart grows
+
+    @classmethod
+    def from_ledger(cls, ledger_df, coa=None, freq='M'):
+        tb = cls(coa, freq)
+        tb.add(ledger_df)
+        return tb
+
+    def add(self, ledger_df, date_col=date_col):
+        """adds the postings of ledger_df (the concat_je_rows layout, or to_long's) to the totals"""
+        long_df = ledger_df if 'Amount' in ledger_df.columns else to_long(ledger_df, date_col)
+        if not len(long_df):
+            return self
+        if date_col not in long_df.columns or long_df[date_col].isna().any():
+            raise ValueError(f"Every posting needs a {date_col} to be put in a period")
+        account_ids = self.coa.encode(long_df['Account'])
+        period_codes, periods = pd.factorize(pd.PeriodIndex(pd.to_datetime(long_df[date_col]), freq=self.freq))
+        period_ids = np.array([self._period_id(period) for period in periods], dtype=np.int64)[period_codes]
+        self._grow(len(self.periods), len(self.coa))
+        n_accounts = self.debits.shape[1]
+        flat = period_ids * n_accounts + account_ids
+        values = long_df['Value'].to_numpy(dtype=float)
+        is_debit = (long_df['Side'] == 'DR').to_numpy()
+        values = np.nan_to_num(values)
+        ## in place on the flat views: the cost follows the entries added, not the size of the arrays
+        np.add.at(self.debits.reshape(-1), flat[is_debit], values[is_debit])
+        np.add.at(self.credits.reshape(-1), flat[~is_debit], values[~is_debit])
+        return self
+
+    def _period_id(self, period):
+        if period not in self.period_pos:
+            self.period_pos[period] = len(self.periods)
+            self.periods.append(period)
+        return self.period_pos[period]
+
+    def _grow(self, n_periods, n_accounts):
+        rows, cols = self.debits.shape
+        if n_periods > rows or n_accounts > cols:
+            shape = (max(rows * 2, n_periods) if n_periods > rows else rows, max(cols * 2, n_accounts) if n_accounts > cols else cols)
+            for name in ['debits', 'credits']:
+                grown = np.zeros(shape)
+                grown[:rows, :cols] = getattr(self, name)
+                setattr(self, name, grown)
+
+    def _leaf_totals(self):
+        ## non-zero (period, account) cells: period, account ID, debit, credit
+        n_periods, n_accounts = len(self.periods), len(self.coa)
+        debits, credits = self.debits[:n_periods, :n_accounts], self.credits[:n_periods, :n_accounts]
+        period_ids, account_ids = np.nonzero((debits != 0) | (credits != 0))
+        return period_ids, account_ids, debits[period_ids, account_ids], credits[period_ids, account_ids]
+
+    def balances(self, accounts=None, depth=None, cumulative=False):
+        """
+        long DataFrame: Period, Account, Currency, Depth, Debit, Credit, Balance (Debit - Credit)
+        every account that has postings at or below it, one row per currency it holds, per period
+        accounts = only these accounts (any level); depth = only this level of the hierarchy (0 = SFP, SCI, ...)
+        cumulative = running totals to the end of each period (closing balances) instead of the period's movement
+        """
+        period_ids, account_ids, debits, credits = self._leaf_totals()
+        ancestors, additive = self._rollup_tables()
+        currencies = np.array(self.coa.currencies + [None], dtype=object)
+
+        ## every posting cell once per level it rolls into
+        levels = [ancestors[account_ids, d] for d in range(ancestors.shape[1])]
+        rollup = np.concatenate(levels) if levels else np.array([], dtype=np.int32)
+        n = len(account_ids)
+        leaf = np.tile(account_ids, len(levels))
+        keep = (rollup >= 0) & ((rollup == leaf) | additive[leaf])
+        if accounts is not None:
+            keep &= np.isin(rollup, [self.coa.ids[account] for account in accounts if account in self.coa.ids])
+        if depth is not None:
+            keep &= np.repeat(np.arange(len(levels)), n) == depth
+        rolled = pd.DataFrame({'Period': np.tile(period_ids, len(levels))[keep],
+                               'Account': rollup[keep],
+                               'Currency': currencies[leaf[keep]],
+                               'Debit': np.tile(debits, len(levels))[keep],
+                               'Credit': np.tile(credits, len(levels))[keep]})
+        balances_df = rolled.groupby(['Account', 'Currency', 'Period'], sort=False, dropna=False)[['Debit', 'Credit']].sum().reset_index()
+
+        period_order = np.argsort(np.argsort([str(period) for period in self.periods])) if self.periods else np.array([], dtype=np.int64)
+        balances_df['Order'] = period_order[balances_df['Period'].to_numpy(dtype=np.int64)]
+        balances_df = balances_df.sort_values(['Account', 'Currency', 'Order'], kind='stable')
+        if cumulative:
+            balances_df = self._cumulate(balances_df)
+        balances_df['Balance'] = balances_df['Debit'] - balances_df['Credit']
+        account_ids = balances_df['Account'].to_numpy(dtype=np.int64)
+        balances_df['Depth'] = np.array(self.coa.depths, dtype=np.int64)[account_ids]
+        balances_df['Account'] = self.coa.decode(account_ids)
+        balances_df['Period'] = [str(self.periods[i]) for i in balances_df['Period']]
+        return balances_df[['Period', 'Account', 'Currency', 'Depth', 'Debit', 'Credit', 'Balance']].reset_index(drop=True)
+
+    def _rollup_tables(self):
+        ## ancestor table and additive flags of the chart; adding an account can re-parent others, so any growth rebuilds them
+        if self._rollup is None or self._rollup[0] != len(self.coa):
+            additive = ~np.array([any(code.endswith(suffix) for suffix in FSTemplate.non_additive_suffixes) for code in self.coa.codes], dtype=bool)
+            self._rollup = (len(self.coa), self.coa.ancestor_table(), additive)
+        return self._rollup[1], self._rollup[2]
+
+    def _cumulate(self, balances_df):
+        ## every (account, currency) carried through every period from its first posting
+        sorted_periods = sorted(range(len(self.periods)), key=lambda i: str(self.periods[i]))
+        keys = balances_df[['Account', 'Currency']].drop_duplicates()
+        grid = keys.merge(pd.DataFrame({'Period': sorted_periods, 'Order': range(len(sorted_periods))}), how='cross')
+        full = grid.merge(balances_df, on=['Account', 'Currency', 'Period', 'Order'], how='left').fillna({'Debit': 0.0, 'Credit': 0.0})
+        full = full.sort_values(['Account', 'Currency', 'Order'], kind='stable')
+        full[['Debit', 'Credit']] = full.groupby(['Account', 'Currency'], sort=False, dropna=False)[['Debit', 'Credit']].cumsum()
+        first = balances_df.groupby(['Account', 'Currency'], sort=False, dropna=False)['Order'].min().rename('First')
+        full = full.merge(first, left_on=['Account', 'Currency'], right_index=True)
+        return full[full['Order'] >= full['First']].drop(columns='First')
+
+    def trial_balance(self, period=None, cumulative=True):
+        """
+        posting accounts only (no rollup lines): DR/CR totals per account and currency, for one period ('2024-03')
+        or every period; cumulative=True gives balances to the end of the period
+        """
+        balances_df = self.balances(cumulative=cumulative)
+        posting = np.zeros(len(self.coa), dtype=bool)
+        posting[np.unique(self._leaf_totals()[1])] = True
+        balances_df = balances_df[posting[[self.coa.ids[account] for account in balances_df['Account']]]]
+        if period is not None:
+            balances_df = balances_df[balances_df['Period'] == str(pd.Period(period, freq=self.freq))]
+        return balances_df.reset_index(drop=True)
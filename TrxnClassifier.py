@@ -0,0 +1,89 @@
+## Transaction classification rules ## 交易分类规则
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+rule_fields = ['Description', 'Asset_type', 'Institution']
+
+## (transaction type, {field: regex}); first matching rule wins, so specific rules go above general ones
+## patterns are case-insensitive and matched against NFKC-normalised text (full-width ＡＤＲ　Ｆｅｅ reads as ADR Fee)
+## a field left out of a rule matches anything
+default_rules = [
+    ('FAOL_open', {'Asset_type': r'option|期权', 'Description': r'buy to open|\bbto\b|买入开仓|买开'}),
+    ('FAOL_close', {'Asset_type': r'option|期权', 'Description': r'sell to close|\bstc\b|卖出平仓|卖平|expir|到期|exercise|assign|行权|指派'}),
+    ('ADR_fee', {'Description': r'\badr\b.*fee|存托凭证.*费|adr费'}),
+    ('bank_rebate', {'Description': r'rebate|回赠|返还|返佣'}),
+    ('misc_fee', {'Description': r'custod|托管费|杂费|misc(ellaneous)? fee|other fee'}),
+    ('accn_tf', {'Description': r'transfer fee|wire fee|转账费|汇款(手续)?费|电汇费'}),
+    ('bank_fee', {'Description': r'bank charge|service charge|handling fee|account fee|银行手续费|手续费|年费'}),
+    ('div_cash_rcvd', {'Description': r'dividend|股息|红利|派息|分红'}),
+    ('int_cash_rcvd', {'Description': r'interest|利息|结息'}),
+    ('curr_tf', {'Description': r'currency conversion|fx conversion|forex|货币兑换|换汇|结汇|购汇'}),
+    ('sub', {'Description': r'subscription|认购|申购'}),
+    ('red', {'Description': r'redemption|赎回'}),
+    ('FAE_open', {'Asset_type': r'stock|equity|etf|股票|基金', 'Description': r'\bbuy\b|\bbought\b|买入'}),
+    ('FAE_close', {'Asset_type': r'stock|equity|etf|股票|基金', 'Description': r'\bsell\b|\bsold\b|卖出'}),
+]
+
+
+class TrxnClassifier:
+    """
+    Labels raw statement rows (Institution, Description, Asset_type) with the func_*/batch_* transaction type that maps them
+    The rule table is compiled once; classify() then evaluates every rule once per DISTINCT value of each field,
+    not per row (statements repeat the same few hundred descriptions), and picks each row's first matching rule
+    with array gathers, so hundreds of thousands of lines label in one pass
+
+    Use as:
+        clf = TrxnClassifier() ## or TrxnClassifier([('bank_fee', {'Institution': '招商银行', 'Description': '短信服务费'})] + default_rules)
+        trxn_df['Trxn_type'] = clf.classify(trxn_df) ## None where no rule matches
+        je_df = clf.map_batch(tjem, curr_tf={'presentation_curr': 'HKD'}) ## labels tjem.df, then one batch_* call per type
+    """
+    def __init__(self, rules=default_rules):
+        self.rules = list(rules)
+        self.trxn_types = np.array([trxn_type for trxn_type, _ in self.rules] + [None], dtype=object)
+        self.patterns = [{field: re.compile(pattern, re.IGNORECASE) for field, pattern in conditions.items()}
+                         for _, conditions in self.rules]
+        unknown = {field for conditions in self.patterns for field in conditions} - set(rule_fields)
+        if unknown:
+            raise ValueError(f"Rules on unknown fields: {sorted(unknown)}; rules can test {rule_fields}")
+
+    def matches(self, df):
+        """boolean array [rule, row]: which rules match which rows"""
+        hits = np.ones((len(self.rules), len(df)), dtype=bool)
+        for field in rule_fields:
+            rule_pos = [pos for pos, conditions in enumerate(self.patterns) if field in conditions]
+            if not rule_pos:
+                continue
+            if field not in df.columns: ## a rule on a column the statement does not have never matches
+                hits[rule_pos] = False
+                continue
+            codes, uniques = pd.factorize(df[field], use_na_sentinel=True)
+            texts = [unicodedata.normalize('NFKC', str(value)) for value in uniques]
+            for pos in rule_pos:
+                pattern = self.patterns[pos][field]
+                unique_hits = np.array([pattern.search(text) is not None for text in texts] + [False], dtype=bool)
+                hits[pos] &= unique_hits[codes] ## code -1 (missing) picks the trailing False
+        return hits
+
+    def classify(self, df):
+        """transaction type of every row as an object array, None where no rule matches"""
+        hits = self.matches(df)
+        first = np.where(hits.any(axis=0), hits.argmax(axis=0), len(self.rules)) if len(self.rules) else np.zeros(len(df), dtype=np.int64)
+        return self.trxn_types[first]
+
+    def label(self, df, trxn_type_col='Trxn_type', overwrite=False):
+        """copy of df with trxn_type_col filled in; rows already labelled keep their type unless overwrite"""
+        df = df.copy()
+        labels = self.classify(df)
+        if trxn_type_col in df.columns and not overwrite:
+            existing = df[trxn_type_col].to_numpy(dtype=object)
+            labels = np.where(pd.isna(existing) | (existing == ''), labels, existing)
+        df[trxn_type_col] = labels
+        return df
+
+    def map_batch(self, tjem, trxn_type_col='Trxn_type', overwrite=False, **type_kwargs):
+        """labels tjem.df and maps it with tjem.map_batch, which sends each labelled group to its batch_* mapper"""
+        tjem.df = self.label(tjem.df, trxn_type_col, overwrite)
+        return tjem.map_batch(trxn_type_col, **type_kwargs)
@@ -0,0 +1,73 @@
+## Import-time benchmark for the core mapping modules ## 导入耗时基准
+## Use as:
+##     python benchmarks/bench_import.py                 ## report
+##     python benchmarks/bench_import.py --budget-ms 800 ## exit 1 if a module is over budget or pulls in an extra
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+core_modules = ['TransactionJEM', 'InvestmentSchedule', 'FXRates', 'FSTemplate', 'TransactionStream', 'ParallelJEM', 'LedgerStore']
+## none of these may be imported by the core modules; they belong behind lazy imports (JEMDisplay, LedgerStore, ...)
+heavy_modules = ['matplotlib', 'plotly', 'scipy', 'requests', 'pyarrow', 'openpyxl', 'dateutil.relativedelta']
+
+_importtime_re = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)')
+
+
+def _run(code):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=repo_dir, capture_output=True, text=True, check=True)
+    return result.stderr, set(result.stdout.strip().split(','))
+
+
+def measure(module, runs=5):
+    """
+    imports module in fresh interpreters (python -X importtime); returns the median cumulative import time in ms,
+    the slowest direct imports of the median run, and the heavy modules it loaded beyond what NumPy/pandas load themselves
+    """
+    _, baseline = _run("import sys, numpy, pandas; print(','.join(sys.modules))")
+    totals, breakdowns, loaded = [], [], set()
+    for _ in range(runs):
+        stderr, loaded = _run(f"import sys, {module}; print(','.join(sys.modules))")
+        total, direct, pending = 0.0, [], []
+        for line in stderr.splitlines():
+            match = _importtime_re.match(line)
+            if not match:
+                continue
+            ms, level, name = int(match.group(2)) / 1000, len(match.group(3)) // 2, match.group(4)
+            if level == 1:
+                pending.append((ms, name))
+            elif level == 0:
+                if name == module:
+                    total, direct = ms, pending
+                pending = []
+        totals.append(total)
+        breakdowns.append(direct)
+    median = statistics.median(totals)
+    direct = breakdowns[min(range(runs), key=lambda run: abs(totals[run] - median))]
+    heavy = sorted(name for name in heavy_modules if name in loaded and name not in baseline)
+    return median, sorted(direct, reverse=True)[:5], heavy
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import time of the core mapping modules')
+    parser.add_argument('modules', nargs='*', default=core_modules)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=None, help='fail if a module takes longer than this to import')
+    args = parser.parse_args(argv)
+
+    failed = False
+    for module in args.modules:
+        median, slowest, heavy = measure(module, args.runs)
+        over = args.budget_ms is not None and median > args.budget_ms
+        failed = failed or over or bool(heavy)
+        print(f"{module:<20} {median:9.1f} ms" + ('  OVER BUDGET' if over else '') + (f"  imports {', '.join(heavy)}" if heavy else ''))
+        for ms, name in slowest:
+            print(f"    {name:<30} {ms:9.1f} ms")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
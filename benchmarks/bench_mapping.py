@@ -0,0 +1,137 @@
+## Journal entry mapping benchmark ## 分录映射基准
+## Use as:
+##     python benchmarks/bench_mapping.py                              ## 10k, 100k and 1M rows, seed 0
+##     python benchmarks/bench_mapping.py --sizes 10000 --seed 7 --json bench.json
+## For every size: rows/s and peak memory of the batch mapping (map_batch + concat_je_rows), and per func_* latency
+## over the first --per-row-rows transactions mapped one at a time, which must give the same entries as map_batch (exit
+## status 1 if not); the transactions come from synthetic.py, so a seed reproduces the same run
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import pandas as pd
+
+from synthetic import presentation_curr, synthetic_rates, synthetic_transactions
+from TransactionJEM import TransactionJEM
+
+## func_* arguments per transaction type beyond idx
+func_kwargs = {'curr_tf': lambda row: {'presentation_curr': presentation_curr},
+               'FAOL_close': lambda row: {'exp': row['Trxn_value'] == 0, 'ae': 'american', 'exe': False, 'cs': False, 'cp': 'call'},
+               }
+
+
+def batch_types(tjem):
+    return set(tjem.je_templates) | {name[len('batch_'):] for name in dir(tjem) if name.startswith('batch_') and name != 'batch_template'}
+
+
+def bench_batch(trxn_df, XR0_df, XR1_df):
+    tjem = TransactionJEM(trxn_df, XR0_df, XR1_df)
+    mapped = trxn_df['Trxn_type'].isin(batch_types(tjem)) ## types without a batch mapping are counted, not mapped
+    if not mapped.all():
+        trxn_df = trxn_df[mapped].reset_index(drop=True)
+        tjem = TransactionJEM(trxn_df, XR0_df, XR1_df)
+    FAOL_rows = trxn_df[trxn_df['Trxn_type'] == 'FAOL_close']
+    def run():
+        tjem.IS = type(tjem.IS)() ## every run starts from an empty Investment Schedule
+        je_df = tjem.map_batch('Trxn_type', curr_tf={'presentation_curr': presentation_curr},
+                               FAOL_close={'exp': (FAOL_rows['Trxn_value'] == 0).to_numpy(), 'ae': 'american', 'exe': False, 'cs': False, 'cp': 'call'})
+        mapped_s = time.perf_counter()
+        transaction_df = tjem.concat_je_rows(je_df)
+        return transaction_df, mapped_s
+
+    start = time.perf_counter()
+    transaction_df, mapped_s = run()
+    seconds = time.perf_counter() - start
+    ## peak memory from a second run; tracemalloc slows allocation down too much to time the same run
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'rows': len(transaction_df), 'skipped_rows': int((~mapped).sum()), 'seconds': seconds,
+            'map_batch_s': mapped_s - start, 'concat_je_rows_s': seconds - (mapped_s - start),
+            'rows_per_s': len(transaction_df) / seconds, 'peak_mb': peak / 2**20}
+
+
+def bench_per_row(trxn_df, XR0_df, XR1_df, n_rows):
+    ## in order, so opens come before the closes that read them back from the Investment Schedule
+    trxn_df = trxn_df.iloc[:n_rows].reset_index(drop=True)
+    tjem = TransactionJEM(trxn_df, XR0_df, XR1_df)
+    latencies, je_rows = {}, []
+    for idx, row in enumerate(trxn_df.to_dict('records')):
+        trxn_type = row['Trxn_type']
+        kwargs = func_kwargs[trxn_type](row) if trxn_type in func_kwargs else {}
+        start = time.perf_counter()
+        je_dfrow = getattr(tjem, f'func_{trxn_type}')(idx, **kwargs)
+        latencies.setdefault(trxn_type, []).append(time.perf_counter() - start)
+        je_rows.append(je_dfrow[0] if isinstance(je_dfrow, tuple) else je_dfrow) ## func_misc_fee also returns the description
+    stats = {trxn_type: {'calls': len(seconds), 'median_us': statistics.median(seconds) * 1e6,
+                         'p95_us': float(np.percentile(seconds, 95)) * 1e6}
+             for trxn_type, seconds in sorted(latencies.items())}
+    return stats, pd.concat(je_rows, axis=0, sort=False)
+
+
+def per_row_mismatches(trxn_df, XR0_df, XR1_df, per_row_df):
+    ## rows where the func_* entries (per_row_df, from bench_per_row) differ from map_batch's for the same transactions;
+    ## the two paths must book the same accounts and amounts in the same slots
+    trxn_df = trxn_df.iloc[:len(per_row_df)].reset_index(drop=True)
+    tjem = TransactionJEM(trxn_df, XR0_df, XR1_df)
+    FAOL_rows = trxn_df[trxn_df['Trxn_type'] == 'FAOL_close']
+    batch_df = tjem.map_batch('Trxn_type', curr_tf={'presentation_curr': presentation_curr},
+                              FAOL_close={'exp': (FAOL_rows['Trxn_value'] == 0).to_numpy(), 'ae': 'american', 'exe': False, 'cs': False, 'cp': 'call'})
+    cols = [col for col in tjem.je_col_names if col in batch_df.columns or col in per_row_df.columns]
+    batch_df = batch_df.reindex(index=per_row_df.index, columns=cols).astype(object)
+    per_row_df = per_row_df.reindex(columns=cols).astype(object)
+    differs = ~((batch_df == per_row_df) | (batch_df.isna() & per_row_df.isna()))
+    rows = differs.any(axis=1)
+    return pd.DataFrame({'Trxn_type': trxn_df['Trxn_type'].to_numpy()[rows.to_numpy()],
+                         'columns': [list(differs.columns[mask]) for mask in differs[rows].to_numpy()]},
+                        index=per_row_df.index[rows.to_numpy()])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Journal entry mapping throughput, per func_* latency and peak memory')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--per-row-rows', type=int, default=5_000)
+    parser.add_argument('--json', default=None, help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    XR0_df, XR1_df = synthetic_rates(args.seed)
+    results = {'seed': args.seed, 'python': sys.version.split()[0], 'pandas': pd.__version__, 'numpy': np.__version__, 'sizes': {}}
+    for n in args.sizes:
+        start = time.perf_counter()
+        trxn_df = synthetic_transactions(n, seed=args.seed)
+        generate_s = time.perf_counter() - start
+        batch = bench_batch(trxn_df, XR0_df, XR1_df)
+        per_row, per_row_df = bench_per_row(trxn_df, XR0_df, XR1_df, args.per_row_rows)
+        mismatches = per_row_mismatches(trxn_df, XR0_df, XR1_df, per_row_df)
+        results['sizes'][n] = {'generate_s': generate_s, 'batch': batch, 'per_row': per_row, 'per_row_mismatches': len(mismatches)}
+
+        print(f"\n{n:,} rows (seed {args.seed}, generated in {generate_s:.2f} s)")
+        print(f"  batch    {batch['rows_per_s']:>12,.0f} rows/s  {batch['seconds']:8.2f} s (map_batch {batch['map_batch_s']:.2f} s,"
+              f" concat_je_rows {batch['concat_je_rows_s']:.2f} s)  peak {batch['peak_mb']:8.1f} MB"
+              + (f"  ({batch['skipped_rows']:,} rows without a batch mapping skipped)" if batch['skipped_rows'] else ''))
+        print(f"  per row  {'func':<16}{'calls':>8}{'median us':>12}{'p95 us':>12}")
+        for trxn_type, stats in per_row.items():
+            print(f"           {trxn_type:<16}{stats['calls']:>8}{stats['median_us']:>12.0f}{stats['p95_us']:>12.0f}")
+        if len(mismatches): ## the benchmark only counts if both paths map the same entries
+            print(f"  per row != batch on {len(mismatches):,} of {len(per_row_df):,} rows:")
+            print(mismatches.groupby('Trxn_type').size().to_string())
+        else:
+            print(f"  per row == batch on all {len(per_row_df):,} rows")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 1 if any(size['per_row_mismatches'] for size in results['sizes'].values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+## Synthetic fund transactions for benchmarks ## 模拟基金交易数据
+## Use as:
+##     from synthetic import synthetic_transactions, synthetic_rates
+##     trxn_df = synthetic_transactions(100_000, seed=0)
+##     XR0_df, XR1_df = synthetic_rates(seed=0)
+import numpy as np
+import pandas as pd
+
+currencies = ['HKD', 'USD', 'CNY', 'CAD']
+presentation_curr = 'HKD'
+## HKD per unit of each currency; QUOTE/BASE rates are built from these, eg HKD/USD = 7.8
+hkd_per_unit = {'HKD': 1.0, 'USD': 7.8, 'CNY': 1.08, 'CAD': 5.7}
+exchanges = {'USD': 'XNYS', 'HKD': 'XHKG', 'CNY': 'XSHG', 'CAD': 'XTSE'}
+institutions = [('Interactive Brokers', 'U1234567'), ('招商银行', '6225880012345678'), ('HSBC', '808-123456-838'), ('富途证券', '1008600123')]
+
+## transaction type: (share of rows, Asset_type, Description)
+trxn_mix = {
+    'FAE_open': (0.22, 'Stock', 'Buy'),
+    'FAE_close': (0.15, 'Stock', 'Sell'),
+    'div_cash_rcvd': (0.12, 'Stock', 'Cash Dividend 现金股息'),
+    'int_cash_rcvd': (0.06, 'Cash', 'Credit Interest 利息'),
+    'FAOL_open': (0.05, 'Option', 'Buy to Open'),
+    'FAOL_close': (0.04, 'Option', 'Sell to Close'),
+    'curr_tf': (0.06, 'Cash', 'Currency Conversion 货币兑换'),
+    'sub': (0.04, 'Cash', 'Subscription 认购'),
+    'red': (0.03, 'Cash', 'Redemption 赎回'),
+    'misc_fee': (0.08, 'Cash', 'Custody Fee'),
+    'bank_fee': (0.06, 'Cash', 'Bank Charge 银行手续费'),
+    'bank_rebate': (0.02, 'Cash', 'Fee Rebate'),
+    'accn_tf': (0.04, 'Cash', 'Transfer Fee'),
+    'ADR_fee': (0.03, 'Stock', 'ADR Fee'),
+}
+
+
+def synthetic_rates(seed=0, drift=0.01):
+    """XR0_df, XR1_df in this project's QUOTE x BASE layout (XR_df.loc[quote, base]), XR1 drifting from XR0"""
+    rng = np.random.default_rng(seed)
+    hkd_t0 = np.array([hkd_per_unit[curr] for curr in currencies])
+    hkd_t1 = hkd_t0 * np.r_[1.0, 1 + rng.normal(0, drift, len(currencies) - 1)]
+    return tuple(pd.DataFrame(hkd[None, :] / hkd[:, None], index=currencies, columns=currencies) for hkd in [hkd_t0, hkd_t1])
+
+
+def synthetic_transactions(n, seed=0, n_securities=500, n_options=100, start='2024-01-01', months=12):
+    """
+    n rows in the README transaction layout (Init_date ... Trxn_price_curr) plus Trxn_type and Trxn_quantity_unit,
+    in Settle_date order; the same seed always gives the same frame
+    Closes never sell more than is held at that point, so the rows replay cleanly through the Investment Schedule;
+    a close with nothing to sell becomes an open. Option closes at 0 value are contracts expiring worthless
+    """
+    rng = np.random.default_rng(seed)
+    trxn_types = np.array(list(trxn_mix))
+    shares = np.array([trxn_mix[trxn_type][0] for trxn_type in trxn_types])
+    trxn_type = trxn_types[rng.choice(len(trxn_types), n, p=shares / shares.sum())]
+
+    settle = pd.Timestamp(start) + pd.to_timedelta(np.sort(rng.integers(0, months * 30, n)), 'D')
+    sec_curr = np.array(currencies)[rng.choice(len(currencies), n_securities, p=[0.35, 0.4, 0.15, 0.1])]
+    sec_codes = np.array([f'S{i:04d}.{exchanges[curr]}' for i, curr in enumerate(sec_curr)])
+    sec_price = np.round(rng.lognormal(3, 1, n_securities), 2)
+    opt_underlying = rng.integers(0, n_securities, n_options)
+    opt_codes = np.array([f'{sec_codes[u].split(".")[0]} {"C" if i % 2 else "P"}{int(sec_price[u] * 1.1)} {i % 12 + 1:02d}'
+                          for i, u in enumerate(opt_underlying)])
+
+    ## securities are skewed (a few names trade most), as in a real book
+    sec = np.minimum(rng.zipf(1.3, n) - 1, n_securities - 1)
+    opt = np.minimum(rng.zipf(1.3, n) - 1, n_options - 1)
+    is_option = np.isin(trxn_type, ['FAOL_open', 'FAOL_close'])
+    is_security = np.isin(trxn_type, ['FAE_open', 'FAE_close', 'div_cash_rcvd', 'ADR_fee'])
+    security_code = np.where(is_option, opt_codes[opt], np.where(is_security, sec_codes[sec], None))
+    curr = np.where(is_option, sec_curr[opt_underlying[opt]], np.where(is_security, sec_curr[sec],
+                    np.array(currencies)[rng.integers(0, len(currencies), n)]))
+    price = np.where(is_option, np.round(sec_price[opt_underlying[opt]] * 0.05, 2), sec_price[sec]) * rng.lognormal(0, 0.1, n)
+    quantity = np.where(is_option, rng.integers(1, 20, n), rng.integers(1, 50, n) * 100).astype(float)
+
+    ## replay positions so closes fit the holdings
+    held = {}
+    for i in np.flatnonzero(is_option | np.isin(trxn_type, ['FAE_open', 'FAE_close'])):
+        key = security_code[i]
+        if trxn_type[i] in ['FAE_close', 'FAOL_close']:
+            units = held.get(key, 0.0)
+            if units < 1:
+                trxn_type[i] = 'FAE_open' if trxn_type[i] == 'FAE_close' else 'FAOL_open'
+            else:
+                quantity[i] = units if trxn_type[i] == 'FAOL_close' or rng.random() < 0.3 else float(max(1, int(units * rng.uniform(0.1, 0.9))))
+                held[key] = units - quantity[i]
+                continue
+        held[key] = held.get(key, 0.0) + quantity[i]
+
+    multiplier = np.where(is_option, 100, 1)
+    value = np.round(price * quantity * multiplier, 2)
+    expired = (trxn_type == 'FAOL_close') & (rng.random(n) < 0.3)
+    value[expired] = 0.0
+    cash_only = ~(is_option | np.isin(trxn_type, ['FAE_open', 'FAE_close'])) ## dividends, interest, fees, subscriptions, ...
+    value[cash_only] = np.round(rng.lognormal(6, 1.5, cash_only.sum()), 2)
+
+    ## currency transfers: Trxn_quantity of Trxn_quantity_unit (base) converted into Trxn_value of Trxn_value_curr (quote)
+    quantity_unit = np.full(n, None, dtype=object)
+    trxn_price_curr = np.where(is_option | is_security, curr, None).astype(object)
+    is_tf = trxn_type == 'curr_tf'
+    base = np.array(currencies)[(np.array([currencies.index(c) for c in curr[is_tf]]) + rng.integers(1, len(currencies), is_tf.sum())) % len(currencies)]
+    xrate = np.array([hkd_per_unit[b] / hkd_per_unit[q] for q, b in zip(curr[is_tf], base)]) * rng.lognormal(0, 0.005, is_tf.sum())
+    quantity[is_tf] = np.round(rng.lognormal(8, 1, is_tf.sum()), 2)
+    price[is_tf] = np.round(xrate, 6)
+    value[is_tf] = np.round(quantity[is_tf] * xrate, 2)
+    quantity_unit[is_tf] = base
+    trxn_price_curr[is_tf] = [f'{q}/{b}' for q, b in zip(curr[is_tf], base)]
+
+    institution = rng.integers(0, len(institutions), n)
+    description = pd.Series(trxn_type).map({t: mix[2] for t, mix in trxn_mix.items()}).to_numpy(dtype=object)
+    description[expired] = 'Option Expired 期权到期'
+    trxn_df = pd.DataFrame({
+        'Init_date': settle - pd.to_timedelta(np.where(is_security | is_option, 2, 0), 'D'),
+        'Settle_date': settle,
+        'Institution': [institutions[i][0] for i in institution],
+        'Account_name': 'Fund I',
+        'Account_num': [institutions[i][1] for i in institution],
+        'Description': description,
+        'Asset_type': pd.Series(trxn_type).map({t: mix[1] for t, mix in trxn_mix.items()}).to_numpy(dtype=object),
+        'Security_code': security_code,
+        'Security_name': security_code,
+        'Trxn_value': value,
+        'Trxn_value_curr': curr,
+        'Trxn_quantity': quantity,
+        'Trxn_quantity_unit': quantity_unit,
+        'Trxn_price': np.round(price, 6),
+        'Trxn_price_curr': trxn_price_curr,
+        'Trxn_type': trxn_type,
+    })
+    return trxn_df
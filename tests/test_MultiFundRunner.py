@@ -0,0 +1,54 @@
+## MultiFundRunner: closing cash carried across periods ## 多基金批量结账：现金余额跨期结转
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+import pytest
+
+from MultiFundRunner import run_funds
+
+currencies = ['HKD', 'USD', 'CNY', 'CAD']
+hkd_per_unit = {'HKD': 1.0, 'USD': 7.8, 'CNY': 1.08, 'CAD': 5.7}
+XR_df = pd.DataFrame([[hkd_per_unit[base] / hkd_per_unit[quote] for base in currencies] for quote in currencies],
+                     index=currencies, columns=currencies)
+
+
+def transactions(rows):
+    return pd.DataFrame(rows, columns=['Settle_date', 'Description', 'Security_code', 'Trxn_value', 'Trxn_value_curr',
+                                       'Trxn_quantity', 'Trxn_quantity_unit', 'Trxn_price', 'Trxn_price_curr', 'Trxn_type']
+                        ).astype({'Trxn_value': float, 'Trxn_quantity': float, 'Trxn_price': float})
+
+
+def test_opening_cash_through_an_idle_period():
+    period_1 = transactions([[pd.Timestamp('2024-01-02'), 'Subscription 认购', None, 10000, 'USD', None, None, None, None, 'sub'],
+                             [pd.Timestamp('2024-01-03'), 'Buy', 'ABC.XNYS', 1650, 'USD', 150, None, 11, 'USD', 'FAE_open']])
+    result_1 = run_funds({'Fund A': period_1}, XR_df, XR_df, n_workers=1, period='2024-01')['Fund A']
+    assert result_1['SFP'].loc['SFP_A_CCE_USD', '2024-01'] == pytest.approx(8350)
+    assert result_1['SFP'].loc['SFP_A', '2024-01'] == pytest.approx(10000 * 7.8)
+
+    idle = {'Fund A': {'trxn_df': transactions([]), 'IS': result_1['IS'], 'opening': result_1['balances']}}
+    result_2 = run_funds(idle, XR_df, XR_df, n_workers=1, period='2024-02')['Fund A']
+    assert result_2['SFP'].loc['SFP_A_CCE_USD', '2024-02'] == pytest.approx(8350)
+    assert result_2['SFP'].loc['SFP_A', '2024-02'] == pytest.approx(10000 * 7.8)
+    assert result_2['SCF'].loc['SCF_FA_SR', '2024-02'] == pytest.approx(0) ## cash flows stay the period's movement
+
+    idle['Fund A']['opening_values'] = result_1['values'] ## chained from the evaluated values instead of the balances
+    result_3 = run_funds(idle, XR_df, XR_df, n_workers=1, period='2024-02')['Fund A']
+    assert result_3['SFP'].loc['SFP_A_CCE_USD', '2024-02'] == pytest.approx(8350)
+
+
+def test_curr_tf_cash_is_kept():
+    ## curr_tf posts straight to SFP_A_CCE_<curr>; those moves are part of the closing cash, period after period
+    period_1 = transactions([[pd.Timestamp('2024-01-02'), 'Subscription 认购', None, 10000, 'USD', None, None, None, None, 'sub'],
+                             [pd.Timestamp('2024-01-05'), 'Currency Conversion 货币兑换', None, 7800, 'HKD', 1000, 'USD', 7.8, 'HKD/USD', 'curr_tf']])
+    type_kwargs = {'curr_tf': {'presentation_curr': 'HKD'}}
+    result_1 = run_funds({'Fund A': period_1}, XR_df, XR_df, n_workers=1, period='2024-01', type_kwargs=type_kwargs)['Fund A']
+    assert result_1['SFP'].loc['SFP_A_CCE_USD', '2024-01'] == pytest.approx(9000)
+    assert result_1['SFP'].loc['SFP_A_CCE_HKD', '2024-01'] == pytest.approx(7800)
+
+    idle = {'Fund A': {'trxn_df': transactions([]), 'opening': result_1['balances']}}
+    result_2 = run_funds(idle, XR_df, XR_df, n_workers=1, period='2024-02')['Fund A']
+    assert result_2['SFP'].loc['SFP_A_CCE_HKD', '2024-02'] == pytest.approx(7800)
+    assert result_2['SFP'].loc['SFP_A', '2024-02'] == pytest.approx(10000 * 7.8)